@@ -0,0 +1,137 @@
+import asyncio
+import base64
+import json
+import time
+
+import httpx
+from shapely import wkt
+
+from eudr_backend import settings
+from eudr_backend.geometry import stored_polygon_geometry
+
+AG_BASE_URL = "https://api-ar.agstack.org"
+MAX_CONCURRENT_REQUESTS = 8
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 1.0
+# used when the access token does not say when it expires
+DEFAULT_TOKEN_TTL = 15 * 60
+TOKEN_EXPIRY_MARGIN = 60
+
+
+class AccessToken:
+    """
+    AgStack access token shared by every registration run of the process, so
+    logins only happen when the token is about to expire or was rejected.
+    """
+
+    def __init__(self):
+        self.value = None
+        self.expires_at = 0
+
+    def is_valid(self):
+        return self.value is not None and time.time() < self.expires_at - TOKEN_EXPIRY_MARGIN
+
+    def clear(self):
+        self.value = None
+        self.expires_at = 0
+
+    async def get(self, client):
+        if not self.is_valid():
+            await self.login(client)
+        return self.value
+
+    async def login(self, client):
+        response = await client.post(f'{AG_BASE_URL}/login', json={
+            "email": settings.AGSTACK_EMAIL,
+            "password": settings.AGSTACK_PASSWORD
+        })
+        response.raise_for_status()
+        self.value = response.json()['access_token']
+        self.expires_at = token_expiry(self.value)
+
+
+access_token = AccessToken()
+
+
+def token_expiry(token):
+    """
+    Reads the exp claim of a JWT access token, without verifying it.
+    """
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(
+            payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + DEFAULT_TOKEN_TTL
+
+
+def farm_boundary_wkt(polygon, polygon_type):
+    """
+    Builds the WKT sent to the asset registry, with the coordinates in the order
+    they are stored. Returns None for points and unreadable polygons.
+    """
+    boundary = stored_polygon_geometry(polygon, polygon_type)
+    return wkt.dumps(boundary) if boundary is not None else None
+
+
+async def register_field_boundary(client, semaphore, token_lock, boundary):
+    """
+    Registers one field boundary and returns its geoid, or the geoid it matched
+    when it was already registered. Server errors, rate limits and dropped
+    connections are retried with exponential backoff, and a rejected token is
+    refreshed once for all the requests that used it.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        # one login at a time, the others wait for its token
+        async with token_lock:
+            token = await access_token.get(client)
+        response = None
+        async with semaphore:
+            try:
+                response = await client.post(
+                    f'{AG_BASE_URL}/register-field-boundary',
+                    json={"wkt": boundary},
+                    headers={'Authorization': f'Bearer {token}'})
+            except httpx.TransportError:
+                pass
+
+        if response is not None:
+            if response.status_code == 401:
+                async with token_lock:
+                    # another request may have refreshed it already
+                    if access_token.value == token:
+                        access_token.clear()
+                continue
+            if response.status_code == 200:
+                return response.json().get("Geo Id")
+            if response.status_code < 500 and response.status_code != 429:
+                try:
+                    matched = response.json().get("matched geo ids")
+                except ValueError:
+                    matched = None
+                return matched[0] if matched else None
+
+        await asyncio.sleep(BACKOFF_SECONDS * 2 ** attempt)
+    return None
+
+
+async def register_geoids(boundaries):
+    """
+    Registers field boundaries concurrently over one pooled client. Takes a dict
+    of farm id to WKT and returns a dict of farm id to geoid for the farms that
+    were registered.
+    """
+    if not boundaries:
+        return {}
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    token_lock = asyncio.Lock()
+    limits = httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS)
+    async with httpx.AsyncClient(timeout=60.0, limits=limits) as client:
+        farm_ids = list(boundaries)
+        geoids = await asyncio.gather(*[
+            register_field_boundary(
+                client, semaphore, token_lock, boundaries[farm_id])
+            for farm_id in farm_ids])
+    return {farm_id: geoid for farm_id, geoid in zip(farm_ids, geoids) if geoid}
@@ -1,14 +1,25 @@
+import asyncio
 import json
+import random
 import httpx
+from datetime import timedelta
 from asgiref.sync import sync_to_async
+from django.db import transaction
 from django.db.models import Q
-from eudr_backend.models import EUDRFarmModel, EUDRUploadedFilesModel, WhispAPISetting
+from django.utils import timezone
+from eudr_backend.dashboard import mark_deleted_rows
+from eudr_backend.models import EUDRFarmModel, EUDRUploadedFilesModel, WhispAPISetting, WhispAnalysisCacheModel, resolve_farm_owners
+from eudr_backend.overlaps import update_farm_overlaps
 from eudr_backend.serializers import EUDRFarmModelSerializer
-from eudr_backend.utils import flatten_geojson, format_geojson_data, transform_db_data_to_geojson
+from eudr_backend.utils import flatten_geojson, format_geojson_data, geometry_cache_key, iter_batches, transform_db_data_to_geojson
+
+WHISP_API_URL = "https://whisp.openforis.org/api/geojson"
+# share of the writes to the analysis cache that also evict its stale entries
+CACHE_EVICTION_RATE = 0.01
 
 
 # Define an async function
-async def async_create_farm_data(data, file_id, isSyncing=False, hasCreatedFiles=[]):
+async def async_create_farm_data(data, file_id, isSyncing=False, hasCreatedFiles=[], on_progress=None, owner=None):
     errors = []
     created_data = []
 
@@ -18,7 +29,7 @@ async def async_create_farm_data(data, file_id, isSyncing=False, hasCreatedFiles
         if err:
             errors.append(err)
         else:
-            err, new_data = await save_farm_data(formatted_data, file_id, analysis_results)
+            err, new_data = await save_farm_data(formatted_data, file_id, analysis_results, owner)
             if err:
                 errors.append(err)
             else:
@@ -26,16 +37,18 @@ async def async_create_farm_data(data, file_id, isSyncing=False, hasCreatedFiles
 
         return errors, created_data
     else:
-        err, analysis_results = await perform_analysis(data)
+        err, analysis_results = await perform_analysis(data, on_progress=on_progress)
         if err:
             # delete the file if there are errors
-            EUDRUploadedFilesModel.objects.get(id=file_id).delete()
+            await sync_to_async(EUDRUploadedFilesModel.objects.filter(id=file_id).delete)()
             errors.append(err)
         else:
-            err, new_data = await save_farm_data(data, file_id, analysis_results)
+            if on_progress:
+                await on_progress(stage='SAVING')
+            err, new_data = await save_farm_data(data, file_id, analysis_results, owner)
             if err:
                 # delete the file if there are errors
-                EUDRUploadedFilesModel.objects.get(id=file_id).delete()
+                await sync_to_async(EUDRUploadedFilesModel.objects.filter(id=file_id).delete)()
                 errors.append(err)
             else:
                 created_data.extend(new_data)
@@ -44,6 +57,58 @@ async def async_create_farm_data(data, file_id, isSyncing=False, hasCreatedFiles
     return errors, serializerData.data
 
 
+async def async_create_farm_data_from_features(features, file_id, on_progress=None, owner=None):
+    """
+    Streams features through WHISP analysis and saving in fixed-size batches, so
+    only one batch of an upload is held in memory at a time. Farms of a file
+    whose uploader is not a user belong to owner. Returns the errors and the
+    number of saved rows.
+    """
+    settings = await sync_to_async(WhispAPISetting.objects.first)()
+    batch_size = (settings.chunk_size if settings else 500) * \
+        (settings.max_concurrent_requests if settings else 4)
+    started_at = timezone.now()
+    progress = {"chunks_done": 0, "chunks_in_batch": 0, "rows_saved": 0}
+
+    async def report_progress(**counters):
+        # chunk counters restart for every batch, report them for the whole upload
+        if 'chunks_analysed' in counters:
+            progress["chunks_in_batch"] = counters['chunks_total']
+            counters['chunks_analysed'] += progress["chunks_done"]
+            counters['chunks_total'] += progress["chunks_done"]
+        if on_progress:
+            await on_progress(**counters)
+
+    async def discard_upload():
+        # drop the rows saved by earlier batches so a failed upload leaves nothing behind
+        farms = EUDRFarmModel.objects.filter(file_id=file_id, created_at__gte=started_at)
+        files = EUDRUploadedFilesModel.objects.filter(id=file_id)
+        await sync_to_async(mark_deleted_rows)(farms)
+        await sync_to_async(farms.delete)()
+        await sync_to_async(mark_deleted_rows)(files)
+        await sync_to_async(files.delete)()
+
+    for batch in iter_batches(features, batch_size):
+        data = {"type": "FeatureCollection", "features": batch}
+        await report_progress(stage='ANALYSING')
+        err, analysis_results = await perform_analysis(data, on_progress=report_progress)
+        if err:
+            await discard_upload()
+            return [err], progress["rows_saved"]
+        progress["chunks_done"] += progress["chunks_in_batch"]
+        progress["chunks_in_batch"] = 0
+
+        await report_progress(stage='SAVING')
+        err, saved_records = await save_farm_data(data, file_id, analysis_results, owner)
+        if err:
+            await discard_upload()
+            return [err], progress["rows_saved"]
+        progress["rows_saved"] += len(saved_records)
+        await report_progress(rows_saved=progress["rows_saved"])
+
+    return [], progress["rows_saved"]
+
+
 async def get_existing_record(data):
     # Define your lookup fields
     lookup_fields = {
@@ -57,12 +122,63 @@ async def get_existing_record(data):
     return await sync_to_async(EUDRFarmModel.objects.filter(**lookup_fields).first)()
 
 
-async def perform_analysis(data, hasCreatedFiles=[]):
-    url = "https://whisp.openforis.org/api/geojson"
-    headers = {"Content-Type": "application/json"}
+async def analyse_chunk(client, semaphore, chunk, geojson_type="FeatureCollection"):
+    chunked_data = {
+        "type": geojson_type,
+        "features": chunk
+    }
+    # Only hold a slot while the request is in flight
+    async with semaphore:
+        response = await client.post(
+            WHISP_API_URL, headers={"Content-Type": "application/json"}, json=chunked_data)
+
+    if response.status_code != 200:
+        return None
+    return response.json().get('data', [])
+
+
+def get_cached_analysis(keys, dataset_version, cache_ttl_days):
+    cutoff = timezone.now() - timedelta(days=cache_ttl_days)
+    cached = {}
+    keys = list(keys)
+    # keep the IN clause below the database parameter limits
+    for i in range(0, len(keys), 500):
+        cached.update(WhispAnalysisCacheModel.objects.filter(
+            geometry_hash__in=keys[i:i + 500],
+            dataset_version=dataset_version,
+            created_at__gte=cutoff
+        ).values_list('geometry_hash', 'analysis'))
+    return cached
+
+
+def evict_cached_analysis(dataset_version, cache_ttl_days):
+    """
+    Deletes the cached results of older dataset versions or past their TTL.
+    """
+    cutoff = timezone.now() - timedelta(days=cache_ttl_days)
+    WhispAnalysisCacheModel.objects.filter(
+        Q(created_at__lt=cutoff) | ~Q(dataset_version=dataset_version)).delete()
+
+
+def store_cached_analysis(results, dataset_version, cache_ttl_days):
+    # the eviction scans the whole table, only a share of the writes runs it
+    if random.random() < CACHE_EVICTION_RATE:
+        evict_cached_analysis(dataset_version, cache_ttl_days)
+    # expired entries still in the table are refreshed in place
+    WhispAnalysisCacheModel.objects.bulk_create([
+        WhispAnalysisCacheModel(
+            geometry_hash=key, dataset_version=dataset_version, analysis=analysis)
+        for key, analysis in results.items()
+    ], batch_size=500, update_conflicts=True, unique_fields=['geometry_hash', 'dataset_version'],
+        update_fields=['analysis', 'created_at'])
+
+
+async def perform_analysis(data, hasCreatedFiles=[], on_progress=None):
     settings = await sync_to_async(WhispAPISetting.objects.first)()
     chunk_size = settings.chunk_size if settings else 500
-    analysis_results = []
+    max_concurrent_requests = settings.max_concurrent_requests if settings else 4
+    dataset_version = settings.dataset_version if settings else "1"
+    cache_ttl_days = settings.cache_ttl_days if settings else 30
     data = json.loads(data) if isinstance(data, str) else data
     data = flatten_geojson(data)
     features = data.get('features', [])
@@ -70,57 +186,178 @@ async def perform_analysis(data, hasCreatedFiles=[]):
     if not features:
         return {"error": "No features found in the data."}, None
 
-    async with httpx.AsyncClient(timeout=1200.0) as client:
-        for i in range(0, len(features), chunk_size):
-            chunk = features[i:i + chunk_size]
-            chunked_data = {
-                "type": data.get("type", "FeatureCollection"),
-                "features": chunk
-            }
-            response = await client.post(url, headers=headers, json=chunked_data)
-
-            if response.status_code != 200:
-                if hasCreatedFiles:
-                    EUDRUploadedFilesModel.objects.filter(
-                        id__in=hasCreatedFiles).delete()
-                return {"Validation against global database failed."}, None
-            analysis_results.extend(response.json().get('data', []))
+    # only send geometries without a valid cached result, once per distinct geometry
+    keys = [geometry_cache_key(feature.get('geometry')) for feature in features]
+    cached = await sync_to_async(get_cached_analysis)(
+        {key for key in keys if key}, dataset_version, cache_ttl_days)
+    missing = {}
+    for i, key in enumerate(keys):
+        if key is None or key not in cached:
+            missing.setdefault(key if key else i, features[i])
+    missing_keys = list(missing)
+    missing_features = list(missing.values())
+
+    if missing_features:
+        err, missing_results = await dispatch_analysis(
+            missing_features, data.get("type", "FeatureCollection"), chunk_size, max_concurrent_requests, hasCreatedFiles, on_progress)
+        if err:
+            return err, None
+        if len(missing_results) != len(missing_features):
+            return {"error": "Validation against global database failed."}, None
+        fetched = dict(zip(missing_keys, missing_results))
+        await sync_to_async(store_cached_analysis)(
+            {key: result for key, result in fetched.items() if isinstance(key, str)}, dataset_version, cache_ttl_days)
+        cached.update(fetched)
+
+    # merge hits and freshly analysed results back in feature order
+    analysis_results = [cached[key if key else i] for i, key in enumerate(keys)]
 
     return None, analysis_results
 
 
-async def save_farm_data(data, file_id, analysis_results=None):
-    formatted_data = format_geojson_data(data, analysis_results, file_id)
-    saved_records = []
+async def dispatch_analysis(features, geojson_type, chunk_size, max_concurrent_requests, hasCreatedFiles=[], on_progress=None):
+    chunks = [features[i:i + chunk_size]
+              for i in range(0, len(features), chunk_size)]
+    semaphore = asyncio.Semaphore(max(max_concurrent_requests, 1))
+    limits = httpx.Limits(max_connections=max(max_concurrent_requests, 1))
+
+    async with httpx.AsyncClient(timeout=1200.0, limits=limits) as client:
+        tasks = [asyncio.create_task(analyse_chunk(
+            client, semaphore, chunk, geojson_type)) for chunk in chunks]
+        try:
+            for completed, next_completed in enumerate(asyncio.as_completed(tasks), start=1):
+                if await next_completed is None:
+                    # stop the remaining chunks as soon as one of them fails
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    if hasCreatedFiles:
+                        await sync_to_async(EUDRUploadedFilesModel.objects.filter(
+                            id__in=hasCreatedFiles).delete)()
+                    return {"error": "Validation against global database failed."}, None
+                if on_progress:
+                    await on_progress(chunks_analysed=completed, chunks_total=len(chunks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
 
-    for item in formatted_data:
-        query = Q(farmer_name=item['farmer_name'],
-                  collection_site=item['collection_site'])
+    # chunks complete out of order, so rebuild the results in feature order
+    analysis_results = []
+    for task in tasks:
+        analysis_results.extend(task.result())
+
+    return None, analysis_results
 
-        # Additional condition if polygon exists
-        if item.get('polygon'):
-            query &= Q(polygon__isnull=False) & ~Q(polygon=[])
 
-        # Additional condition if latitude and longitude are not 0 or 0.0
+def match_existing_record(candidates, item):
+    """
+    In-memory equivalent of the lookup query save_farm_data used to run per record:
+    same farmer_name/collection_site, a stored polygon when the item has one, and a
+    matching latitude or longitude when the item has coordinates.
+    """
+    for record in candidates:
+        if item.get('polygon') and (record.polygon is None or record.polygon == []):
+            continue
         if item.get('latitude', 0) != 0 or item.get('longitude', 0) != 0:
-            query &= (Q(latitude=item['latitude'])
-                      | Q(longitude=item['longitude']))
+            if not (coordinates_equal(record.latitude, item['latitude'])
+                    or coordinates_equal(record.longitude, item['longitude'])):
+                continue
+        return record
+    return None
+
+
+def coordinates_equal(stored, value):
+    try:
+        return stored == float(value)
+    except (TypeError, ValueError):
+        return False
+
+
+def geometry_changed(record, validated_data):
+    return any(attr in validated_data and validated_data[attr] != getattr(record, attr)
+               for attr in ('polygon', 'polygon_type'))
+
+
+def bulk_save_farm_data(formatted_data, owner=None):
+    # fetch every candidate record for the file in one pass, keyed like the lookup query
+    farmer_names = list({item.get('farmer_name') for item in formatted_data})
+    collection_sites = list({item.get('collection_site')
+                            for item in formatted_data})
+    candidates = {}
+    for i in range(0, len(farmer_names), 500):
+        for record in EUDRFarmModel.objects.filter(
+            farmer_name__in=farmer_names[i:i + 500],
+            collection_site__in=collection_sites
+        ).order_by('id'):
+            candidates.setdefault(
+                (record.farmer_name, record.collection_site), []).append(record)
 
-        # Retrieve the existing record based on the constructed query
-        existing_record = await sync_to_async(EUDRFarmModel.objects.filter(query).first)()
+    errors = []
+    saved_records = []
+    to_create = []
+    to_update = {}
+    changed_geometry_records = {}
+    for i, item in enumerate(formatted_data, start=1):
+        key = (item.get('farmer_name'), item.get('collection_site'))
+        existing_record = match_existing_record(candidates.get(key, []), item)
+
+        serializer = EUDRFarmModelSerializer(existing_record, data=item)
+        if not serializer.is_valid():
+            errors.append({"record": i, "errors": serializer.errors})
+            continue
+        if errors:
+            continue
 
         if existing_record:
-            serializer = EUDRFarmModelSerializer(
-                existing_record, data=item)
+            if existing_record.pk and geometry_changed(existing_record, serializer.validated_data):
+                changed_geometry_records[existing_record.pk] = existing_record
+            for attr, value in serializer.validated_data.items():
+                setattr(existing_record, attr, value)
+            if existing_record.pk:
+                to_update[existing_record.pk] = existing_record
+            saved_records.append(existing_record)
         else:
-            serializer = EUDRFarmModelSerializer(data=item)
+            # later rows of the same file must be able to match this one, as they did when saved one by one
+            new_record = EUDRFarmModel(**serializer.validated_data)
+            candidates.setdefault(key, []).append(new_record)
+            to_create.append(new_record)
+            saved_records.append(new_record)
 
-        if serializer.is_valid():
-            saved_instance = await sync_to_async(serializer.save)()
-            saved_records.append(saved_instance)
-        else:
-            # delete the file if there are errors
-            EUDRUploadedFilesModel.objects.get(id=file_id).delete()
-            return serializer.errors, None
+    if errors:
+        return errors, None
+
+    update_fields = [field.name for field in EUDRFarmModel._meta.concrete_fields
+                     if not field.primary_key and field.name != 'created_at']
+    now = timezone.now()
+    for record in to_update.values():
+        record.updated_at = now
+    # bulk writes skip save(), derive the geometry columns here instead
+    for record in to_create + list(to_update.values()):
+        record.refresh_geometry()
+    try:
+        resolve_farm_owners(to_create + list(to_update.values()), owner)
+    except ValueError as e:
+        return {"error": str(e)}, None
+
+    with transaction.atomic():
+        EUDRFarmModel.objects.bulk_create(to_create, batch_size=500)
+        EUDRFarmModel.objects.bulk_update(
+            list(to_update.values()), update_fields, batch_size=500)
+        # only new plots and plots whose geometry moved need their overlaps refreshed
+        update_farm_overlaps([record.pk for record in to_create] +
+                             list(changed_geometry_records))
+
+    return None, saved_records
+
+
+async def save_farm_data(data, file_id, analysis_results=None, owner=None):
+    formatted_data = format_geojson_data(data, analysis_results, file_id)
+
+    err, saved_records = await sync_to_async(bulk_save_farm_data)(formatted_data, owner)
+    if err:
+        # delete the file if there are errors
+        await sync_to_async(EUDRUploadedFilesModel.objects.filter(id=file_id).delete)()
+        return err, None
 
-    return None, saved_records
\ No newline at end of file
+    return None, saved_records
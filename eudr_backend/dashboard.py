@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from eudr_backend.models import (
+    DashboardDailyMetricsModel,
+    EUDRCollectionSiteModel,
+    EUDRFarmModel,
+    EUDRUploadedFilesModel,
+    S3ObjectModel,
+)
+
+# the rollup columns counted from the database, with the rows they count, the
+# date field they are counted by and the field telling which rows changed
+DAILY_COUNTS = {
+    # updated rather than created, analyses of older farms move their risk counts
+    'farms': (EUDRFarmModel.objects.all(), 'created_at', 'updated_at', {
+        'farms': Count('id'),
+        'low_risk_farms': Count('id', filter=Q(analysis__eudr_risk_level='low')),
+        'high_risk_farms': Count('id', filter=Q(analysis__eudr_risk_level='high')),
+        'more_info_needed_farms': Count('id', filter=Q(analysis__eudr_risk_level='more_info_needed')),
+    }),
+    'files': (EUDRUploadedFilesModel.objects.all(), 'created_at', 'updated_at', {'files': Count('id')}),
+    'users': (User.objects.all(), 'date_joined', 'date_joined', {'users': Count('id')}),
+    'backups': (EUDRCollectionSiteModel.objects.all(), 'created_at', 'updated_at', {'backups': Count('id')}),
+    # the crawler indexes objects stored before it last ran
+    's3_objects': (S3ObjectModel.objects.all(), 'last_modified', 'indexed_at', {'s3_objects': Count('id')}),
+}
+METRIC_FIELDS = [field for *_, counts in DAILY_COUNTS.values() for field in counts]
+# rows written while a refresh ran are picked up by the next one
+REFRESH_OVERLAP = timedelta(minutes=5)
+
+
+def day_range(field, start, end):
+    """
+    Filter of the rows whose date field falls between two days, both included,
+    compared as datetimes so the indexes are used.
+    """
+    lookups = {}
+    if start:
+        lookups[f'{field}__gte'] = timezone.make_aware(
+            datetime.combine(start, datetime.min.time()))
+    if end:
+        lookups[f'{field}__lt'] = timezone.make_aware(
+            datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    return lookups
+
+
+def daily_counts(start=None, end=None):
+    """
+    Counts the rows created each day between two days (or of all time), with
+    one grouped query per table. Returns the counts of each day that has any.
+    """
+    days = {}
+    for rows, field, _, counts in DAILY_COUNTS.values():
+        for row in rows.filter(**day_range(field, start, end)).annotate(
+                day=TruncDate(field)).values('day').annotate(**counts).order_by():
+            days.setdefault(row.pop('day'), {}).update(row)
+    return days
+
+
+def rebuild_dashboard_metrics(start=None, end=None, days=None):
+    """
+    Rebuilds the daily rollups between two days, or of the given days.
+    """
+    now = timezone.now()
+    if days is not None:
+        if not days:
+            return
+        start, end = min(days), max(days)
+    counts = daily_counts(start, end)
+    if days is not None:
+        counts = {day: values for day, values in counts.items() if day in days}
+
+    # days whose rows were all deleted have nothing left to count
+    stale = DashboardDailyMetricsModel.objects.exclude(date__in=list(counts))
+    if days is not None:
+        stale = stale.filter(date__in=list(days))
+    if start:
+        stale = stale.filter(date__gte=start)
+    if end:
+        stale = stale.filter(date__lte=end)
+    stale.update(refreshed_at=now, **{field: 0 for field in METRIC_FIELDS})
+
+    DashboardDailyMetricsModel.objects.bulk_create([
+        DashboardDailyMetricsModel(date=day, refreshed_at=now, **{
+            field: values.get(field, 0) for field in METRIC_FIELDS})
+        for day, values in counts.items()
+    ], update_conflicts=True, unique_fields=['date'], update_fields=METRIC_FIELDS + ['refreshed_at'],
+        batch_size=500)
+
+
+def changed_days(since):
+    """
+    Days whose counts may have changed since a refresh: the creation days of the
+    rows written since then, the days rows were deleted from, and today.
+    """
+    days = {timezone.localdate()}
+    days.update(DashboardDailyMetricsModel.objects.filter(
+        refreshed_at__isnull=True).values_list('date', flat=True))
+    for rows, field, changed_field, _ in DAILY_COUNTS.values():
+        changed = rows.filter(**{f'{changed_field}__gte': since})
+        days.update(changed.annotate(day=TruncDate(field)).values_list('day', flat=True).distinct().order_by())
+    return days
+
+
+def refresh_dashboard_metrics():
+    """
+    Brings the daily rollups up to date with the rows written since the last
+    refresh, or builds them all on the first one.
+    """
+    last_refresh = DashboardDailyMetricsModel.objects.aggregate(
+        last=Max('refreshed_at'))['last']
+    if last_refresh is None:
+        rebuild_dashboard_metrics()
+    else:
+        rebuild_dashboard_metrics(days=changed_days(last_refresh - REFRESH_OVERLAP))
+
+
+def mark_deleted_rows(rows):
+    """
+    Marks the rollup days of rows about to be deleted for the next refresh, as
+    deleted rows leave nothing for changed_days to find. Takes the queryset of
+    the rows and runs a single update, whatever their number.
+    """
+    for counted, field, _, _ in DAILY_COUNTS.values():
+        if counted.model is rows.model:
+            DashboardDailyMetricsModel.objects.filter(
+                date__in=rows.annotate(day=TruncDate(field)).values('day')).update(refreshed_at=None)
+
+
+def dashboard_totals(start, end):
+    """
+    Sums the daily rollups between two days, both included.
+    """
+    totals = DashboardDailyMetricsModel.objects.filter(
+        date__gte=start, date__lte=end).aggregate(**{field: Sum(field) for field in METRIC_FIELDS})
+    return {field: value or 0 for field, value in totals.items()}
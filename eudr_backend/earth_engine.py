@@ -0,0 +1,83 @@
+import threading
+import time
+
+import ee
+
+from eudr_backend import settings
+
+
+class ServiceAccountBackend:
+    """
+    Builds the service account credentials and initializes the Earth Engine
+    library with them.
+    """
+
+    def credentials(self):
+        return ee.ServiceAccountCredentials(settings.EE_ACCOUNT_NAME, settings.EE_CREDENTIALS)
+
+    def initialize(self, credentials):
+        ee.Initialize(credentials)
+
+
+class EarthEngineSession:
+    """
+    Initializes Earth Engine lazily, once per process, and keeps using the same
+    credentials until they expire, instead of an OAuth handshake per request.
+    Also records how long the initializations took, for the health endpoint.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or ServiceAccountBackend()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.credentials = None
+        self.initializations = 0
+        self.failures = 0
+        self.last_initialized_at = None
+        self.last_initialization_ms = None
+        self.total_initialization_ms = 0.0
+        self.last_error = None
+
+    def is_initialized(self):
+        # service account credentials are refreshed in place by the ee library,
+        # expired is only True when that did not happen
+        return self.credentials is not None and not getattr(self.credentials, 'expired', False)
+
+    def ensure_initialized(self):
+        if self.is_initialized():
+            return
+        with self.lock:
+            # another request may have initialized it while this one waited
+            if self.is_initialized():
+                return
+            started = time.perf_counter()
+            try:
+                credentials = self.backend.credentials()
+                self.backend.initialize(credentials)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                raise
+            elapsed = (time.perf_counter() - started) * 1000
+            self.credentials = credentials
+            self.initializations += 1
+            self.last_initialized_at = time.time()
+            self.last_initialization_ms = elapsed
+            self.total_initialization_ms += elapsed
+            self.last_error = None
+
+    def metrics(self):
+        return {
+            "initialized": self.is_initialized(),
+            "initializations": self.initializations,
+            "failures": self.failures,
+            "last_initialized_at": self.last_initialized_at,
+            "last_initialization_ms": round(self.last_initialization_ms, 2) if self.last_initialization_ms is not None else None,
+            "average_initialization_ms": round(self.total_initialization_ms / self.initializations, 2) if self.initializations else None,
+            "last_error": self.last_error,
+        }
+
+
+earth_engine_session = EarthEngineSession()
@@ -0,0 +1,75 @@
+from django.db.models import Q
+
+from eudr_backend.models import EUDRFarmModel, EUDRFarmOverlapModel, EUDRUploadedFilesModel
+from eudr_backend.overlaps import stored_overlaps_for_farms
+
+# the farm fields the map draws and shows in its popups
+MAP_FIELDS = (
+    'id', 'farmer_name', 'farm_size', 'collection_site', 'agent_name',
+    'farm_village', 'farm_district', 'latitude', 'longitude', 'polygon',
+    'polygon_type', 'geoid', 'analysis', 'updated_at',
+)
+
+
+def visible_farms(user):
+    """
+    Farms visible to a user, newest first, as listed by the API and the map.
+    """
+    return EUDRFarmModel.objects.visible_to(user).order_by("-updated_at")
+
+
+def file_farms(file_id):
+    return EUDRFarmModel.objects.filter(file_id=file_id)
+
+
+def farm_detail(pk):
+    """
+    Returns the farm with the given id, or None when it does not exist.
+    """
+    return EUDRFarmModel.objects.filter(id=pk).first()
+
+
+def overlapping_farms(file_id):
+    """
+    Returns the farms of a file, newest first, with the stored overlaps of each
+    of them grouped by farm id, or None when the file does not exist.
+    """
+    if not EUDRUploadedFilesModel.objects.filter(id=file_id).exists():
+        return None
+    farms = EUDRFarmModel.objects.filter(
+        file_id=str(file_id)).order_by("-updated_at")
+
+    # overlaps are kept up to date on save, including those with other files
+    return farms, stored_overlaps_for_farms(farms.values('id'))
+
+
+def farm_rows(farms, fields=MAP_FIELDS):
+    """
+    Reads farms as plain dicts of the given fields, without model instances or
+    serializers in between.
+    """
+    return list(farms.values(*fields))
+
+
+def map_farms(user, file_id=None, farm_id=None, overlaps_only=False):
+    """
+    The farms drawn by the map: a single farm, the farms of a file (only the
+    overlapping ones when asked), or every farm visible to the user.
+    """
+    if farm_id:
+        return EUDRFarmModel.objects.filter(id=farm_id)
+    if not file_id:
+        return visible_farms(user)
+    farms = file_farms(file_id).order_by("-updated_at")
+    if overlaps_only:
+        # the stored pairs are matched with subqueries, never a list of ids
+        pairs = EUDRFarmOverlapModel.objects.all()
+        farms = farms.filter(Q(id__in=pairs.values('farm_id')) | Q(id__in=pairs.values('other_farm_id')))
+    return farms
+
+
+def map_farm_rows(user, file_id=None, farm_id=None, overlaps_only=False):
+    """
+    Rows of the farms drawn by the map, see map_farms.
+    """
+    return farm_rows(map_farms(user, file_id=file_id, farm_id=farm_id, overlaps_only=overlaps_only))
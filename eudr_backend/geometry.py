@@ -0,0 +1,101 @@
+from functools import reduce
+
+import numpy as np
+import shapely
+from pyproj import Geod
+
+GEOD = Geod(ellps="WGS84")
+
+# geometry columns of EUDRFarmModel derived from polygon, polygon_type and the coordinates
+GEOMETRY_FIELDS = (
+    'geometry_wkb', 'bbox_min_lon', 'bbox_min_lat', 'bbox_max_lon', 'bbox_max_lat',
+    'centroid_lon', 'centroid_lat', 'area_ha', 'vertex_count', 'geometry_is_valid',
+)
+
+
+def polygon_geometry(polygon, polygon_type):
+    """
+    Builds the shapely geometry of a stored farm polygon, valid or not. MultiPolygon
+    farms are stored as a flat list of rings, so the rings are combined with the
+    even-odd rule: a ring inside another one is a hole. Returns None for points
+    and unreadable polygons.
+    """
+    if not polygon or polygon_type == 'Point':
+        return None
+    try:
+        rings = [[tuple(point[:2]) for point in ring] for ring in polygon]
+        if polygon_type == 'MultiPolygon':
+            geometry = reduce(lambda a, b: a.symmetric_difference(b),
+                              [shapely.Polygon(ring) for ring in rings])
+            if isinstance(geometry, shapely.Polygon):
+                geometry = shapely.MultiPolygon([geometry])
+        else:
+            geometry = shapely.Polygon(rings[0], rings[1:])
+    except Exception:
+        return None
+    return None if geometry.is_empty else geometry
+
+
+def stored_polygon_geometry(polygon, polygon_type):
+    """
+    Same as polygon_geometry, but also returns None for invalid polygons.
+    """
+    geometry = polygon_geometry(polygon, polygon_type)
+    if geometry is None or not geometry.is_valid:
+        return None
+    return geometry
+
+
+def make_polygonal(geometries):
+    """
+    Repairs the invalid geometries of an array in place with make_valid and
+    keeps only their polygonal part, since overlay operations raise on
+    self-intersecting rings. Returns the mask of the geometries left with a
+    polygonal part.
+    """
+    invalid = ~shapely.is_valid(geometries)
+    geometries[invalid] = shapely.make_valid(geometries[invalid])
+    for index in np.flatnonzero(invalid):
+        parts = shapely.get_parts(geometries[index])
+        geometries[index] = shapely.union_all(
+            parts[np.isin(shapely.get_type_id(parts), (3, 6))])
+    return np.isin(shapely.get_type_id(geometries), (3, 6)) & ~shapely.is_empty(geometries)
+
+
+def geodesic_area_ha(geometry):
+    area, _ = GEOD.geometry_area_perimeter(geometry)
+    return abs(area) / 10000
+
+
+def farm_geometry_columns(polygon, polygon_type, latitude, longitude):
+    """
+    Derives the stored geometry columns of a farm: its geometry as WKB, bounding
+    box, centroid, geodesic area in hectares, vertex count and validity. Farms
+    without a readable polygon are stored as the point of their coordinates.
+    """
+    geometry = polygon_geometry(polygon, polygon_type)
+    if geometry is None and (latitude or longitude):
+        geometry = shapely.Point(longitude, latitude)
+    if geometry is None:
+        return {field: None for field in GEOMETRY_FIELDS} | {
+            'vertex_count': 0, 'geometry_is_valid': False}
+
+    is_valid = geometry.is_valid
+    min_lon, min_lat, max_lon, max_lat = geometry.bounds
+    centroid = geometry.centroid
+    if centroid.is_empty:
+        # rings whose signed areas cancel out have no centroid of their own
+        centroid = shapely.box(min_lon, min_lat, max_lon, max_lat).centroid
+    return {
+        'geometry_wkb': shapely.to_wkb(geometry),
+        'bbox_min_lon': min_lon,
+        'bbox_min_lat': min_lat,
+        'bbox_max_lon': max_lon,
+        'bbox_max_lat': max_lat,
+        'centroid_lon': centroid.x,
+        'centroid_lat': centroid.y,
+        # the area of a self-intersecting ring is meaningless
+        'area_ha': geodesic_area_ha(geometry) if is_valid else None,
+        'vertex_count': shapely.get_num_coordinates(geometry),
+        'geometry_is_valid': is_valid,
+    }
@@ -0,0 +1,115 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from eudr_backend.models import EUDRFarmModel, EUDRUploadedFilesModel
+
+
+class Command(BaseCommand):
+    help = "Seeds farms and times the hot farm queries with and without the EUDRFarmModel indexes. Everything is rolled back afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--farms', type=int, default=20000,
+                            help='Number of farms to seed')
+        parser.add_argument('--files', type=int, default=50,
+                            help='Number of uploaded files the farms are spread over')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per query, the fastest one is reported')
+        parser.add_argument('--explain', action='store_true',
+                            help='Print the query plans with the indexes in place')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            owner, file = self.seed(options['farms'], options['files'])
+            queries = self.queries(owner, file)
+
+            with_indexes = self.time_queries(queries, options['repeat'])
+            if options['explain']:
+                for name, queryset in queries.items():
+                    self.stdout.write(f"\n{name}\n{queryset.explain()}")
+
+            self.drop_indexes()
+            without_indexes = self.time_queries(queries, options['repeat'])
+
+            self.stdout.write(
+                f"\n{'query':<24}{'no index (ms)':>16}{'indexed (ms)':>16}")
+            for name in queries:
+                self.stdout.write(
+                    f"{name:<24}{without_indexes[name]:>16.2f}{with_indexes[name]:>16.2f}")
+
+            transaction.set_rollback(True)
+
+    def seed(self, farm_count, file_count):
+        owner, _ = User.objects.get_or_create(username='benchmark-owner')
+        files = EUDRUploadedFilesModel.objects.bulk_create([
+            EUDRUploadedFilesModel(file_name=f"benchmark_{i}.csv",
+                                   uploaded_by=owner.username if i % 10 == 0 else f"benchmark-{i}")
+            for i in range(file_count)])
+
+        now = timezone.now()
+        farms = []
+        for i in range(farm_count):
+            file = files[i % file_count]
+            farms.append(EUDRFarmModel(
+                farmer_name=f"Farmer {i}",
+                farm_size=random.uniform(0.5, 10),
+                collection_site=f"Site {i % 200}",
+                farm_village="Village",
+                farm_district="District",
+                latitude=random.uniform(-3, 3),
+                longitude=random.uniform(28, 34),
+                polygon=[],
+                geoid=None if i % 20 == 0 else f"geoid-{i}",
+                file_id=str(file.id),
+                uploaded_file=file,
+                owner=owner if file.uploaded_by == owner.username else None,
+            ))
+        EUDRFarmModel.objects.bulk_create(farms, batch_size=2000)
+
+        # spread the timestamps so range and ordering queries have work to do
+        for i, farm_id in enumerate(EUDRFarmModel.objects.values_list('id', flat=True)):
+            if i % 97 == 0:
+                EUDRFarmModel.objects.filter(id__gte=farm_id, id__lt=farm_id + 97).update(
+                    created_at=now - timedelta(days=i // 97), updated_at=now - timedelta(hours=i // 97))
+        return owner, files[0]
+
+    def queries(self, owner, file):
+        today = timezone.now()
+        return {
+            'match_records': EUDRFarmModel.objects.filter(
+                farmer_name__in=[f"Farmer {i}" for i in range(0, 5000, 50)],
+                collection_site__in=[f"Site {i}" for i in range(200)]),
+            'file_listing': EUDRFarmModel.objects.filter(
+                file_id=str(file.id)).order_by('-updated_at')[:100],
+            'owner_listing': EUDRFarmModel.objects.visible_to(owner).order_by(
+                '-updated_at', '-id')[:100],
+            'staff_listing': EUDRFarmModel.objects.order_by('-updated_at', '-id')[:100],
+            'missing_geoid': EUDRFarmModel.objects.filter(
+                geoid__isnull=True, owner__username=owner.username),
+            'created_range': EUDRFarmModel.objects.filter(
+                created_at__gte=today - timedelta(days=7), created_at__lt=today),
+        }
+
+    def time_queries(self, queries, repeat):
+        timings = {}
+        for name, queryset in queries.items():
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                # values_list keeps JSON decoding out of the measurement
+                list(queryset.values_list('id', flat=True))
+                elapsed = (time.perf_counter() - started) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+        return timings
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for index in EUDRFarmModel._meta.indexes:
+                cursor.execute(
+                    f"DROP INDEX {connection.ops.quote_name(index.name)}")
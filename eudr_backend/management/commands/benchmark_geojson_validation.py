@@ -0,0 +1,147 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from eudr_backend.utils import is_valid_polygon
+from eudr_backend.validators import validate_geojson
+
+
+def legacy_validate_geojson(data):
+    """
+    The feature by feature validator validate_geojson replaced, kept as the
+    baseline of the benchmark. Like the original, it stops at the first feature
+    checked after an error.
+    """
+    errors = []
+    for feature in data['features']:
+        if feature.get('type') != 'Feature':
+            errors.append('Invalid GeoJSON feature. Must be Feature')
+            continue
+        properties = feature.get('properties')
+        if not isinstance(properties, dict):
+            errors.append('Invalid GeoJSON properties. Must be a dictionary')
+            continue
+        for prop, prop_type in {'farmer_name': str, 'farm_village': str, 'farm_district': str,
+                                'farm_size': (int, float), 'latitude': (int, float),
+                                'longitude': (int, float)}.items():
+            if not isinstance(properties.get(prop), prop_type):
+                errors.append(
+                    f'Invalid GeoJSON properties. Missing or invalid "{prop}"')
+        if len(errors) > 0:
+            return errors
+
+        geometry = feature.get('geometry')
+        if not isinstance(geometry, dict):
+            errors.append('Invalid GeoJSON geometry. Must be a dictionary')
+            continue
+        geometry_type = geometry.get('type')
+        coordinates = geometry.get('coordinates')
+        if geometry_type == 'Polygon':
+            polygons = [coordinates]
+        elif geometry_type == 'MultiPolygon':
+            polygons = coordinates
+        elif geometry_type == 'Point':
+            if not (isinstance(coordinates, list) and len(coordinates) == 2):
+                errors.append(
+                    'Invalid GeoJSON coordinates. Must be a list of 2 numbers')
+            if not all(isinstance(c, (int, float)) for c in coordinates):
+                errors.append(
+                    'Invalid GeoJSON coordinates. Must be a list of numbers')
+            if properties.get('farm_size') >= 4:
+                errors.append(
+                    'Invalid record. Farm size must be less than 4 hectares for a point geometry')
+            continue
+        else:
+            errors.append(
+                'Invalid GeoJSON geometry type. Must be Point or Polygon')
+            continue
+        for polygon in polygons:
+            if not (isinstance(polygon, list) and len(polygon) >= 1):
+                errors.append(
+                    'Invalid GeoJSON coordinates. Must be a list of lists')
+            if not (isinstance(polygon[0], list) and len(polygon[0]) >= 4):
+                errors.append(
+                    'Invalid GeoJSON coordinates. Must be a list of lists with at least 4 coordinates')
+            if properties.get('farm_size') >= 4 and not is_valid_polygon(polygon):
+                errors.append(
+                    'Invalid GeoJSON coordinates. Must be a valid polygon')
+            for coord in polygon[0]:
+                if not (isinstance(coord, list) and len(coord) == 2):
+                    errors.append(
+                        'Invalid GeoJSON coordinates. Must be a list of lists with 2 coordinates')
+                if not all(isinstance(c, (int, float)) for c in coord):
+                    errors.append(
+                        'Invalid GeoJSON coordinates. Must be a list of lists with numbers')
+    return errors
+
+
+class Command(BaseCommand):
+    help = "Times validate_geojson against the feature by feature validator it replaced on synthetic FeatureCollections."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--features', type=int, default=50000,
+                            help='Number of features per collection')
+        parser.add_argument('--vertices', type=int, default=12,
+                            help='Vertices of each polygon ring')
+        parser.add_argument('--error-rate', type=float, default=0.01,
+                            help='Share of features with a broken geometry in the second collection')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Runs per validator, the fastest one is reported')
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        collections = {
+            'valid': self.collection(options['features'], options['vertices'], 0),
+            'with errors': self.collection(options['features'], options['vertices'], options['error_rate']),
+        }
+
+        self.stdout.write(
+            f"\n{'collection':<16}{'legacy (ms)':>14}{'errors':>8}{'vectorized (ms)':>18}{'errors':>8}")
+        for name, collection in collections.items():
+            legacy, legacy_errors = self.time(legacy_validate_geojson,
+                                                  collection, options['repeat'])
+            vectorized, errors = self.time(
+                lambda data: validate_geojson(data, max_errors=len(data['features'])),
+                collection, options['repeat'])
+            self.stdout.write(
+                f"{name:<16}{legacy:>14.2f}{len(legacy_errors):>8}{vectorized:>18.2f}{len(errors):>8}")
+
+    def collection(self, count, vertices, error_rate):
+        features = []
+        for i in range(count):
+            lon, lat = random.uniform(28, 34), random.uniform(-3, 3)
+            if i % 10 == 0:
+                geometry = {"type": "Point", "coordinates": [lon, lat]}
+            else:
+                # a ring around the point, so every polygon is a valid geometry
+                ring = [[lon + 0.001 * math.cos(2 * math.pi * k / vertices),
+                         lat + 0.001 * math.sin(2 * math.pi * k / vertices)] for k in range(vertices)]
+                ring.append(ring[0])
+                geometry = {"type": "Polygon", "coordinates": [ring]}
+                if random.random() < error_rate:
+                    # a ring too short, the other checks still apply to it
+                    geometry["coordinates"] = [ring[:2]]
+            features.append({
+                "type": "Feature",
+                "properties": {
+                    "farmer_name": f"Farmer {i}",
+                    "farm_village": "Village",
+                    "farm_district": "District",
+                    "farm_size": random.uniform(0.5, 3.5),
+                    "latitude": lat,
+                    "longitude": lon,
+                },
+                "geometry": geometry,
+            })
+        return {"type": "FeatureCollection", "features": features}
+
+    def time(self, validator, data, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            errors = validator(data)
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best, errors
@@ -0,0 +1,31 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from eudr_backend.dashboard import rebuild_dashboard_metrics
+from eudr_backend.models import DashboardDailyMetricsModel
+from eudr_backend.s3_objects import crawl_s3_objects
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the daily dashboard rollups from the database, optionally crawling the S3 bucket into the object index first."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat,
+                            help='First day to rebuild (YYYY-MM-DD), all days by default')
+        parser.add_argument('--end', type=date.fromisoformat,
+                            help='Last day to rebuild (YYYY-MM-DD), all days by default')
+        parser.add_argument('--s3', action='store_true',
+                            help='Reconcile the S3 object index with the bucket before counting')
+
+    def handle(self, *args, **options):
+        start, end = options['start'], options['end']
+        if start and end and start > end:
+            raise CommandError('--start must not be after --end')
+
+        if options['s3']:
+            indexed, deleted, _ = crawl_s3_objects()
+            self.stdout.write(f"Indexed {indexed} S3 objects, dropped {deleted}")
+        rebuild_dashboard_metrics(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {DashboardDailyMetricsModel.objects.count()} daily rollups"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0052_delete_eudrusermodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='whispapisetting',
+            name='max_concurrent_requests',
+            field=models.PositiveIntegerField(default=4, help_text='Maximum number of WHISP API chunks in flight at once.'),
+        ),
+    ]
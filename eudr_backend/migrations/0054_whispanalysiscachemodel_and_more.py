@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0053_whispapisetting_max_concurrent_requests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='whispapisetting',
+            name='cache_ttl_days',
+            field=models.PositiveIntegerField(default=30, help_text='Number of days a cached WHISP analysis result stays valid.'),
+        ),
+        migrations.AddField(
+            model_name='whispapisetting',
+            name='dataset_version',
+            field=models.CharField(default='1', help_text='WHISP dataset version. Changing it invalidates cached analysis results.', max_length=255),
+        ),
+        migrations.CreateModel(
+            name='WhispAnalysisCacheModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geometry_hash', models.CharField(max_length=64)),
+                ('dataset_version', models.CharField(max_length=255)),
+                ('analysis', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('geometry_hash', 'dataset_version')},
+            },
+        ),
+    ]
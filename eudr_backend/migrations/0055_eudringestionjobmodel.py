@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0054_whispanalysiscachemodel_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EUDRIngestionJobModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255)),
+                ('data_format', models.CharField(default='geojson', max_length=255)),
+                ('uploaded_by', models.CharField(max_length=255)),
+                ('file_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('from_file', models.BooleanField(default=False)),
+                ('payload', models.JSONField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='PENDING', max_length=255)),
+                ('stage', models.CharField(choices=[('QUEUED', 'Queued'), ('VALIDATING', 'Validating'), ('ANALYSING', 'Analysing'), ('SAVING', 'Saving'), ('DONE', 'Done')], default='QUEUED', max_length=255)),
+                ('rows_parsed', models.PositiveIntegerField(default=0)),
+                ('chunks_total', models.PositiveIntegerField(default=0)),
+                ('chunks_analysed', models.PositiveIntegerField(default=0)),
+                ('rows_saved', models.PositiveIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,116 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:13
+
+import django.db.models.deletion
+import numpy as np
+import shapely
+from django.db import migrations, models
+from pyproj import Geod
+
+# the overlap detection as it was when this migration was written, kept here so
+# the backfill does not change with the application code
+
+GEOD = Geod(ellps="WGS84")
+
+
+def geodesic_area_ha(geometry):
+    area, _ = GEOD.geometry_area_perimeter(geometry)
+    return abs(area) / 10000
+
+
+def farm_geometry(farm):
+    coordinates = farm['polygon']
+    if not coordinates or farm['polygon_type'] == 'Point':
+        return None
+    try:
+        # multipolygon rings are read as one flattened ring, as the views did
+        flattened = [[point for polygon in coordinates for point in polygon]]
+        if len(flattened if farm['polygon_type'] == 'MultiPolygon' else coordinates) != 1:
+            return None
+        geometry = shapely.Polygon(flattened[0])
+    except Exception:
+        return None
+    return None if geometry.is_empty else geometry
+
+
+def find_overlapping_pairs(farms):
+    ids = []
+    geometries = []
+    for farm in farms:
+        geometry = farm_geometry(farm)
+        if geometry is not None:
+            ids.append(farm['id'])
+            geometries.append(geometry)
+    if len(geometries) < 2:
+        return []
+
+    ids = np.array(ids)
+    geometries = np.array(geometries, dtype=object)
+    # overlay operations raise on self-intersecting rings, compare their repaired polygonal part
+    invalid = ~shapely.is_valid(geometries)
+    geometries[invalid] = shapely.make_valid(geometries[invalid])
+    for index in np.flatnonzero(invalid):
+        parts = shapely.get_parts(geometries[index])
+        geometries[index] = shapely.union_all(parts[np.isin(shapely.get_type_id(parts), (3, 6))])
+    polygonal = np.isin(shapely.get_type_id(geometries), (3, 6)) & ~shapely.is_empty(geometries)
+    ids, geometries = ids[polygonal], geometries[polygonal]
+    if len(geometries) < 2:
+        return []
+    left, right = shapely.STRtree(geometries).query(geometries, predicate='overlaps')
+    # keep each pair once, lowest id first
+    swap = ids[left] > ids[right]
+    left[swap], right[swap] = right[swap], left[swap]
+    if len(left):
+        left, right = np.unique(np.stack([left, right]), axis=1)
+
+    areas = {}
+    pairs = []
+    for i, j, intersection in zip(left, right, shapely.intersection(geometries[left], geometries[right])):
+        for index in (i, j):
+            if index not in areas:
+                areas[index] = geodesic_area_ha(geometries[index])
+        intersection_area = geodesic_area_ha(intersection)
+        pairs.append({
+            "farm_id": int(ids[i]),
+            "other_farm_id": int(ids[j]),
+            "intersection_area_ha": round(intersection_area, 4),
+            "farm_overlap_percentage": round(intersection_area / areas[i] * 100, 2) if areas[i] else 0,
+            "other_farm_overlap_percentage": round(intersection_area / areas[j] * 100, 2) if areas[j] else 0,
+        })
+    return pairs
+
+
+def backfill_farm_overlaps(apps, schema_editor):
+    EUDRFarmModel = apps.get_model('eudr_backend', 'EUDRFarmModel')
+    EUDRFarmOverlapModel = apps.get_model(
+        'eudr_backend', 'EUDRFarmOverlapModel')
+    farms = EUDRFarmModel.objects.values(
+        'id', 'polygon', 'polygon_type').iterator(chunk_size=2000)
+    EUDRFarmOverlapModel.objects.bulk_create(
+        [EUDRFarmOverlapModel(**pair) for pair in find_overlapping_pairs(farms)], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0055_eudringestionjobmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EUDRFarmOverlapModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('intersection_area_ha', models.FloatField()),
+                ('farm_overlap_percentage', models.FloatField()),
+                ('other_farm_overlap_percentage', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('farm', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='overlaps', to='eudr_backend.eudrfarmmodel')),
+                ('other_farm', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='eudr_backend.eudrfarmmodel')),
+            ],
+            options={
+                'unique_together': {('farm', 'other_farm')},
+            },
+        ),
+        migrations.RunPython(backfill_farm_overlaps,
+                             migrations.RunPython.noop),
+    ]
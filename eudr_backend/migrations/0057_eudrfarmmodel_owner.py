@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_farm_owners(apps, schema_editor):
+    EUDRFarmModel = apps.get_model('eudr_backend', 'EUDRFarmModel')
+    EUDRUploadedFilesModel = apps.get_model(
+        'eudr_backend', 'EUDRUploadedFilesModel')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    uploaders = dict(
+        EUDRUploadedFilesModel.objects.values_list('id', 'uploaded_by'))
+    users = dict(User.objects.filter(
+        username__in=set(uploaders.values())).values_list('username', 'id'))
+
+    batch = []
+    for farm in EUDRFarmModel.objects.only('id', 'file_id').iterator(chunk_size=2000):
+        file_id = int(farm.file_id) if str(
+            farm.file_id or '').isdigit() else None
+        if file_id not in uploaders:
+            continue
+        farm.uploaded_file_id = file_id
+        farm.owner_id = users.get(uploaders[file_id])
+        batch.append(farm)
+        if len(batch) >= 2000:
+            EUDRFarmModel.objects.bulk_update(
+                batch, ['uploaded_file', 'owner'])
+            batch = []
+    EUDRFarmModel.objects.bulk_update(batch, ['uploaded_file', 'owner'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0056_eudrfarmoverlapmodel'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='farms', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='uploaded_file',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='farms', to='eudr_backend.eudruploadedfilesmodel'),
+        ),
+        migrations.RunPython(backfill_farm_owners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0057_eudrfarmmodel_owner'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='eudrfarmmodel',
+            index=models.Index(fields=['farmer_name', 'collection_site'], name='farm_name_site_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eudrfarmmodel',
+            index=models.Index(fields=['file_id', '-updated_at'], name='farm_file_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eudrfarmmodel',
+            index=models.Index(fields=['owner', '-updated_at', '-id'], name='farm_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eudrfarmmodel',
+            index=models.Index(fields=['-updated_at', '-id'], name='farm_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eudrfarmmodel',
+            index=models.Index(condition=models.Q(('geoid__isnull', True)), fields=['owner'], name='farm_missing_geoid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eudrfarmmodel',
+            index=models.Index(fields=['created_at'], name='farm_created_idx'),
+        ),
+    ]
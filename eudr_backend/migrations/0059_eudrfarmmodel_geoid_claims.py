@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:27
+
+from django.db import migrations, models
+
+
+def collapse_repeating_geoid_tasks(apps, schema_editor):
+    # uploads used to add a task repeating every minute forever, keep one plain task per user instead
+    Task = apps.get_model('background_task', 'Task')
+    tasks = Task.objects.filter(
+        task_name='eudr_backend.tasks.update_geoid', locked_at__isnull=True).order_by('run_at')
+    kept = set()
+    for task in tasks:
+        if task.task_hash in kept:
+            task.delete()
+            continue
+        kept.add(task.task_hash)
+        task.repeat = 0
+        task.repeat_until = None
+        task.save(update_fields=['repeat', 'repeat_until'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('background_task', '0004_auto_20220202_1721'),
+        ('eudr_backend', '0058_eudrfarmmodel_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='geoid_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='geoid_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(collapse_repeating_geoid_tasks,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,146 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:43
+
+from functools import reduce
+
+import shapely
+from django.conf import settings
+from django.db import migrations, models
+from pyproj import Geod
+
+# the geometry columns as they were derived when this migration was written,
+# kept here so the backfill does not change with the application code
+
+GEOD = Geod(ellps="WGS84")
+
+GEOMETRY_FIELDS = (
+    'geometry_wkb', 'bbox_min_lon', 'bbox_min_lat', 'bbox_max_lon', 'bbox_max_lat',
+    'centroid_lon', 'centroid_lat', 'area_ha', 'vertex_count', 'geometry_is_valid',
+)
+
+
+def polygon_geometry(polygon, polygon_type):
+    if not polygon or polygon_type == 'Point':
+        return None
+    try:
+        rings = [[tuple(point[:2]) for point in ring] for ring in polygon]
+        if polygon_type == 'MultiPolygon':
+            # multipolygons are stored as a flat list of rings, even-odd rule
+            geometry = reduce(lambda a, b: a.symmetric_difference(b),
+                              [shapely.Polygon(ring) for ring in rings])
+            if isinstance(geometry, shapely.Polygon):
+                geometry = shapely.MultiPolygon([geometry])
+        else:
+            geometry = shapely.Polygon(rings[0], rings[1:])
+    except Exception:
+        return None
+    return None if geometry.is_empty else geometry
+
+
+def farm_geometry_columns(polygon, polygon_type, latitude, longitude):
+    geometry = polygon_geometry(polygon, polygon_type)
+    if geometry is None and (latitude or longitude):
+        geometry = shapely.Point(longitude, latitude)
+    if geometry is None:
+        return {field: None for field in GEOMETRY_FIELDS} | {
+            'vertex_count': 0, 'geometry_is_valid': False}
+
+    is_valid = geometry.is_valid
+    min_lon, min_lat, max_lon, max_lat = geometry.bounds
+    centroid = geometry.centroid
+    if centroid.is_empty:
+        centroid = shapely.box(min_lon, min_lat, max_lon, max_lat).centroid
+    return {
+        'geometry_wkb': shapely.to_wkb(geometry),
+        'bbox_min_lon': min_lon,
+        'bbox_min_lat': min_lat,
+        'bbox_max_lon': max_lon,
+        'bbox_max_lat': max_lat,
+        'centroid_lon': centroid.x,
+        'centroid_lat': centroid.y,
+        'area_ha': abs(GEOD.geometry_area_perimeter(geometry)[0]) / 10000 if is_valid else None,
+        'vertex_count': shapely.get_num_coordinates(geometry),
+        'geometry_is_valid': is_valid,
+    }
+
+
+def backfill_farm_geometry(apps, schema_editor):
+    EUDRFarmModel = apps.get_model('eudr_backend', 'EUDRFarmModel')
+
+    batch = []
+    for farm in EUDRFarmModel.objects.only(
+            'id', 'polygon', 'polygon_type', 'latitude', 'longitude').iterator(chunk_size=2000):
+        for field, value in farm_geometry_columns(
+                farm.polygon, farm.polygon_type, farm.latitude, farm.longitude).items():
+            setattr(farm, field, value)
+        batch.append(farm)
+        if len(batch) >= 2000:
+            EUDRFarmModel.objects.bulk_update(batch, GEOMETRY_FIELDS)
+            batch = []
+    EUDRFarmModel.objects.bulk_update(batch, GEOMETRY_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0059_eudrfarmmodel_geoid_claims'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='area_ha',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='bbox_max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='bbox_max_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='bbox_min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='bbox_min_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='centroid_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='centroid_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='geometry_is_valid',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='geometry_wkb',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmmodel',
+            name='vertex_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='eudrfarmmodel',
+            index=models.Index(fields=['bbox_min_lon', 'bbox_max_lon'], name='farm_bbox_lon_idx'),
+        ),
+        migrations.RunPython(backfill_farm_geometry,
+                             migrations.RunPython.noop),
+    ]
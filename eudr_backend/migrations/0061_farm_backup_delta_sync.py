@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0060_eudrfarmmodel_geometry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EUDRFarmBackupTombstoneModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('remote_id', models.CharField(max_length=255)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='eudrfarmbackupmodel',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='eudrfarmbackupmodel',
+            index=models.Index(fields=['remote_id'], name='backup_remote_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eudrfarmbackupmodel',
+            index=models.Index(fields=['site_id', 'updated_at', 'id'], name='backup_site_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='eudrfarmbackuptombstonemodel',
+            name='site_id',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to='eudr_backend.eudrcollectionsitemodel'),
+        ),
+        migrations.AddIndex(
+            model_name='eudrfarmbackuptombstonemodel',
+            index=models.Index(fields=['site_id', 'deleted_at'], name='tombstone_site_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0061_farm_backup_delta_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardDailyMetricsModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('farms', models.PositiveIntegerField(default=0)),
+                ('low_risk_farms', models.PositiveIntegerField(default=0)),
+                ('high_risk_farms', models.PositiveIntegerField(default=0)),
+                ('more_info_needed_farms', models.PositiveIntegerField(default=0)),
+                ('files', models.PositiveIntegerField(default=0)),
+                ('users', models.PositiveIntegerField(default=0)),
+                ('backups', models.PositiveIntegerField(default=0)),
+                ('s3_objects', models.PositiveIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0062_dashboard_daily_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='S3ObjectModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=1024, unique=True)),
+                ('category', models.CharField(blank=True, max_length=255, null=True)),
+                ('uploaded_by', models.CharField(blank=True, max_length=255, null=True)),
+                ('file_name', models.CharField(blank=True, max_length=1024, null=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('last_modified', models.DateTimeField()),
+                ('indexed_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_modified'], name='s3_object_modified_idx')],
+            },
+        ),
+    ]
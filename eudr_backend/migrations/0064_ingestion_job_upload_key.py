@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eudr_backend', '0063_s3_object_index'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='eudringestionjobmodel',
+            name='payload',
+        ),
+        migrations.AddField(
+            model_name='eudringestionjobmodel',
+            name='upload_key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -1,6 +1,43 @@
+from django.contrib.auth.models import User
+from eudr_backend.geometry import farm_geometry_columns
 from my_eudr_app import models
 
 
+class EUDRFarmQuerySet(models.models.QuerySet):
+    def visible_to(self, user):
+        """
+        Farms a user may list: every farm for staff, the farms of their own
+        uploads otherwise.
+        """
+        if user.is_authenticated and user.is_staff:
+            return self
+        if not user.is_authenticated:
+            return self.filter(owner__username="admin")
+        return self.filter(owner=user)
+
+
+def resolve_farm_owners(farms, owner=None):
+    """
+    Points farms at the uploaded file named by their file_id and at the user who
+    uploaded it, with one query for the files and one for the users. Files
+    whose uploader is not a user, such as uploads recorded as "admin", fall
+    back to the given owner, the user saving the farms. Raises ValueError when
+    there is none, rather than leaving the farms of a file without an owner.
+    """
+    file_ids = {str(farm.file_id) for farm in farms if farm.file_id}
+    files = {str(file.id): file for file in EUDRUploadedFilesModel.objects.filter(
+        id__in=[file_id for file_id in file_ids if file_id.isdigit()])}
+    users = {user.username: user.id for user in User.objects.filter(
+        username__in={file.uploaded_by for file in files.values()})}
+    for farm in farms:
+        file = files.get(str(farm.file_id))
+        farm.uploaded_file_id = file.id if file else None
+        farm.owner_id = users.get(file.uploaded_by, owner.id if owner else None) if file else None
+        if file and farm.owner_id is None:
+            raise ValueError(
+                f'File {file.id} was uploaded by "{file.uploaded_by}", who is not a user')
+
+
 class EUDRFarmModel(models.models.Model):
     remote_id = models.models.CharField(max_length=255, null=True, blank=True)
     farmer_name = models.models.CharField(max_length=255)
@@ -17,13 +54,67 @@ class EUDRFarmModel(models.models.Model):
         max_length=255, null=True, blank=True)
     accuracies = models.models.JSONField(default=list, blank=True)
     geoid = models.models.CharField(max_length=255, null=True, blank=True)
+    # claim of the geoid registration worker, and how often registration failed
+    geoid_claimed_at = models.models.DateTimeField(null=True, blank=True)
+    geoid_attempts = models.models.PositiveSmallIntegerField(default=0)
     is_validated = models.models.BooleanField(default=False)
     analysis = models.models.JSONField(null=True, blank=True)
     validated_at = models.models.DateTimeField(null=True, blank=True)
     file_id = models.models.CharField(max_length=255, null=True, blank=True)
+    uploaded_file = models.models.ForeignKey(
+        "EUDRUploadedFilesModel", on_delete=models.models.SET_NULL, null=True, blank=True, related_name="farms")
+    owner = models.models.ForeignKey(
+        User, on_delete=models.models.SET_NULL, null=True, blank=True, related_name="farms")
+    # derived from polygon, polygon_type and the coordinates on every save
+    geometry_wkb = models.models.BinaryField(null=True, blank=True)
+    bbox_min_lon = models.models.FloatField(null=True, blank=True)
+    bbox_min_lat = models.models.FloatField(null=True, blank=True)
+    bbox_max_lon = models.models.FloatField(null=True, blank=True)
+    bbox_max_lat = models.models.FloatField(null=True, blank=True)
+    centroid_lon = models.models.FloatField(null=True, blank=True)
+    centroid_lat = models.models.FloatField(null=True, blank=True)
+    area_ha = models.models.FloatField(null=True, blank=True)
+    vertex_count = models.models.PositiveIntegerField(default=0)
+    geometry_is_valid = models.models.BooleanField(default=False)
     created_at = models.models.DateTimeField(auto_now_add=True)
     updated_at = models.models.DateTimeField(auto_now=True)
 
+    objects = EUDRFarmQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # record matching while saving uploads
+            models.models.Index(
+                fields=['farmer_name', 'collection_site'], name='farm_name_site_idx'),
+            # listings of a file or an owner, newest first
+            models.models.Index(
+                fields=['file_id', '-updated_at'], name='farm_file_updated_idx'),
+            models.models.Index(
+                fields=['owner', '-updated_at', '-id'], name='farm_owner_updated_idx'),
+            models.models.Index(
+                fields=['-updated_at', '-id'], name='farm_updated_idx'),
+            # farms still waiting for a geoid
+            models.models.Index(fields=['owner'], name='farm_missing_geoid_idx',
+                                condition=models.models.Q(geoid__isnull=True)),
+            # dashboard date ranges
+            models.models.Index(fields=['created_at'], name='farm_created_idx'),
+            # bounding box prefilters of spatial lookups
+            models.models.Index(
+                fields=['bbox_min_lon', 'bbox_max_lon'], name='farm_bbox_lon_idx'),
+        ]
+
+    def refresh_geometry(self):
+        for field, value in farm_geometry_columns(
+                self.polygon, self.polygon_type, self.latitude, self.longitude).items():
+            setattr(self, field, value)
+
+    def save(self, *args, **kwargs):
+        # keep the owner relations in step with file_id, which clients still send
+        if str(self.file_id or '') != str(self.uploaded_file_id or ''):
+            resolve_farm_owners([self])
+        self.refresh_geometry()
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.farmer_name
 
@@ -42,9 +133,37 @@ class EUDRFarmBackupModel(models.models.Model):
     longitude = models.models.FloatField(default=0.0)
     coordinates = models.models.JSONField(null=True)
     accuracies = models.models.JSONField(default=list, blank=True)
+    # hash of the values last synced, unchanged rows are not written again
+    content_hash = models.models.CharField(max_length=64, null=True, blank=True)
     created_at = models.models.DateTimeField(auto_now_add=True)
     updated_at = models.models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.models.Index(fields=['remote_id'], name='backup_remote_id_idx'),
+            # farms of a site changed since a restore watermark
+            models.models.Index(fields=['site_id', 'updated_at', 'id'], name='backup_site_updated_idx'),
+        ]
+
+    def __str__(self):
+        return self.remote_id
+
+
+class EUDRFarmBackupTombstoneModel(models.models.Model):
+    """
+    Farm backup deleted by a device, kept so that restores of the other
+    devices of its site delete it as well.
+    """
+    remote_id = models.models.CharField(max_length=255)
+    site_id = models.models.ForeignKey(
+        "EUDRCollectionSiteModel", on_delete=models.models.CASCADE, related_name="tombstones")
+    deleted_at = models.models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.models.Index(fields=['site_id', 'deleted_at'], name='tombstone_site_deleted_idx'),
+        ]
+
     def __str__(self):
         return self.remote_id
 
@@ -77,6 +196,43 @@ class EUDRUploadedFilesModel(models.models.Model):
         return self.file_name
 
 
+class EUDRIngestionJobModel(models.models.Model):
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    )
+    STAGE_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('VALIDATING', 'Validating'),
+        ('ANALYSING', 'Analysing'),
+        ('SAVING', 'Saving'),
+        ('DONE', 'Done'),
+    )
+    file_name = models.models.CharField(max_length=255)
+    data_format = models.models.CharField(max_length=255, default="geojson")
+    uploaded_by = models.models.CharField(max_length=255)
+    file_id = models.models.CharField(max_length=255, null=True, blank=True)
+    from_file = models.models.BooleanField(default=False)
+    # key of the upload in the S3 bucket, until the job succeeds
+    upload_key = models.models.CharField(max_length=255, null=True, blank=True)
+    status = models.models.CharField(
+        max_length=255, choices=STATUS_CHOICES, default='PENDING')
+    stage = models.models.CharField(
+        max_length=255, choices=STAGE_CHOICES, default='QUEUED')
+    rows_parsed = models.models.PositiveIntegerField(default=0)
+    chunks_total = models.models.PositiveIntegerField(default=0)
+    chunks_analysed = models.models.PositiveIntegerField(default=0)
+    rows_saved = models.models.PositiveIntegerField(default=0)
+    errors = models.models.JSONField(default=list, blank=True)
+    created_at = models.models.DateTimeField(auto_now_add=True)
+    updated_at = models.models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.file_name} ({self.status})"
+
+
 class EUDRSharedMapAccessCodeModel(models.models.Model):
     file_id = models.models.CharField(max_length=255)
     access_code = models.models.CharField(max_length=255)
@@ -91,6 +247,87 @@ class EUDRSharedMapAccessCodeModel(models.models.Model):
 class WhispAPISetting(models.models.Model):
     chunk_size = models.models.PositiveIntegerField(
         default=500, help_text="Size of WHISP API data chunks to fetch.")
+    max_concurrent_requests = models.models.PositiveIntegerField(
+        default=4, help_text="Maximum number of WHISP API chunks in flight at once.")
+    dataset_version = models.models.CharField(
+        max_length=255, default="1", help_text="WHISP dataset version. Changing it invalidates cached analysis results.")
+    cache_ttl_days = models.models.PositiveIntegerField(
+        default=30, help_text="Number of days a cached WHISP analysis result stays valid.")
 
     def __str__(self):
         return f"Whisp API Settings (Chunk Size: {self.chunk_size})"
+
+
+class WhispAnalysisCacheModel(models.models.Model):
+    geometry_hash = models.models.CharField(max_length=64)
+    dataset_version = models.models.CharField(max_length=255)
+    analysis = models.models.JSONField()
+    created_at = models.models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('geometry_hash', 'dataset_version')
+
+    def __str__(self):
+        return self.geometry_hash
+
+
+class EUDRFarmOverlapModel(models.models.Model):
+    farm = models.models.ForeignKey(
+        EUDRFarmModel, on_delete=models.models.CASCADE, related_name="overlaps")
+    other_farm = models.models.ForeignKey(
+        EUDRFarmModel, on_delete=models.models.CASCADE, related_name="+")
+    intersection_area_ha = models.models.FloatField()
+    farm_overlap_percentage = models.models.FloatField()
+    other_farm_overlap_percentage = models.models.FloatField()
+    created_at = models.models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('farm', 'other_farm')
+
+    def __str__(self):
+        return f"{self.farm_id} - {self.other_farm_id}"
+
+
+class DashboardDailyMetricsModel(models.models.Model):
+    """
+    Daily rollup of the dashboard counts: what was created each day, the risk
+    levels of the farms created that day and the objects stored in S3.
+    """
+    date = models.models.DateField(unique=True)
+    farms = models.models.PositiveIntegerField(default=0)
+    low_risk_farms = models.models.PositiveIntegerField(default=0)
+    high_risk_farms = models.models.PositiveIntegerField(default=0)
+    more_info_needed_farms = models.models.PositiveIntegerField(default=0)
+    files = models.models.PositiveIntegerField(default=0)
+    users = models.models.PositiveIntegerField(default=0)
+    backups = models.models.PositiveIntegerField(default=0)
+    s3_objects = models.models.PositiveIntegerField(default=0)
+    # when the counts were last rebuilt, cleared once rows of the day are deleted
+    refreshed_at = models.models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return str(self.date)
+
+
+class S3ObjectModel(models.models.Model):
+    """
+    Local index of the objects of the S3 bucket, written when files are stored
+    and reconciled with the bucket by a crawler, so listings are database
+    queries. Keys are "<category>/<uploader>_<file name>".
+    """
+    key = models.models.CharField(max_length=1024, unique=True)
+    category = models.models.CharField(max_length=255, null=True, blank=True)
+    uploaded_by = models.models.CharField(max_length=255, null=True, blank=True)
+    file_name = models.models.CharField(max_length=1024, null=True, blank=True)
+    size = models.models.BigIntegerField(default=0)
+    last_modified = models.models.DateTimeField()
+    # last time the object was seen, by an upload or the crawler
+    indexed_at = models.models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.models.Index(fields=['last_modified'], name='s3_object_modified_idx'),
+        ]
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,139 @@
+import numpy as np
+import shapely
+from django.db.models import Max, Min, Q
+
+from eudr_backend.geometry import geodesic_area_ha, make_polygonal, polygon_geometry
+from eudr_backend.models import EUDRFarmModel, EUDRFarmOverlapModel
+
+
+def farm_geometry(farm):
+    """
+    The shapely geometry of a farm, valid or not, None for points and
+    unreadable polygons.
+    """
+    return polygon_geometry(farm.get('polygon'), farm.get('polygon_type'))
+
+
+def find_overlapping_pairs(farms, changed_ids=None):
+    """
+    Finds every pair of farms whose polygons overlap, using an STRtree so each
+    polygon is only tested against the candidates whose bounding boxes intersect
+    it. Invalid polygons are repaired first. When changed_ids is given only pairs
+    involving those farms are looked up.
+    Returns one entry per pair, lowest farm id first, with the intersection area
+    in hectares and the share of each farm it covers.
+    """
+    ids = []
+    geometries = []
+    for farm in farms:
+        geometry = farm_geometry(farm)
+        if geometry is not None:
+            ids.append(farm['id'])
+            geometries.append(geometry)
+
+    if len(geometries) < 2:
+        return []
+
+    ids = np.array(ids)
+    geometries = np.array(geometries, dtype=object)
+    # self-intersecting plots are compared by their repaired outline
+    polygonal = make_polygonal(geometries)
+    ids, geometries = ids[polygonal], geometries[polygonal]
+    if len(geometries) < 2:
+        return []
+    shapely.prepare(geometries)
+    tree = shapely.STRtree(geometries)
+    if changed_ids is None:
+        queried = np.arange(len(geometries))
+    else:
+        queried = np.flatnonzero(np.isin(ids, list(changed_ids)))
+    left, right = tree.query(geometries[queried], predicate='overlaps')
+    left = queried[left]
+    # the relation is symmetric, keep each pair once with the lowest id first
+    swap = ids[left] > ids[right]
+    left[swap], right[swap] = right[swap], left[swap]
+    if len(left):
+        left, right = np.unique(np.stack([left, right]), axis=1)
+
+    intersections = shapely.intersection(geometries[left], geometries[right])
+    areas = {}
+
+    def farm_area_ha(index):
+        if index not in areas:
+            areas[index] = geodesic_area_ha(geometries[index])
+        return areas[index]
+
+    pairs = []
+    for i, j, intersection in zip(left, right, intersections):
+        intersection_area = geodesic_area_ha(intersection)
+        farm_area = farm_area_ha(i)
+        other_farm_area = farm_area_ha(j)
+        pairs.append({
+            "farm_id": int(ids[i]),
+            "other_farm_id": int(ids[j]),
+            "intersection_area_ha": round(intersection_area, 4),
+            "farm_overlap_percentage": round(intersection_area / farm_area * 100, 2) if farm_area else 0,
+            "other_farm_overlap_percentage": round(intersection_area / other_farm_area * 100, 2) if other_farm_area else 0,
+        })
+    return pairs
+
+
+def update_farm_overlaps(farm_ids):
+    """
+    Refreshes the stored overlaps of the given farms after their geometry was
+    created or changed. Only these farms are queried against the spatial index
+    of all stored plots, so overlaps with other files and uploaders are found
+    without recomputing the pairs that did not change.
+    """
+    farm_ids = set(farm_ids)
+    if not farm_ids:
+        return []
+
+    EUDRFarmOverlapModel.objects.filter(
+        Q(farm_id__in=farm_ids) | Q(other_farm_id__in=farm_ids)).delete()
+
+    # only farms whose bounding box meets that of the changed farms can overlap them
+    bounds = EUDRFarmModel.objects.filter(id__in=farm_ids).aggregate(
+        min_lon=Min('bbox_min_lon'), min_lat=Min('bbox_min_lat'),
+        max_lon=Max('bbox_max_lon'), max_lat=Max('bbox_max_lat'))
+    if None in bounds.values():
+        return []
+    farms = EUDRFarmModel.objects.filter(
+        bbox_min_lon__lte=bounds['max_lon'], bbox_max_lon__gte=bounds['min_lon'],
+        bbox_min_lat__lte=bounds['max_lat'], bbox_max_lat__gte=bounds['min_lat'],
+    ).values('id', 'polygon', 'polygon_type').iterator(chunk_size=2000)
+    pairs = find_overlapping_pairs(farms, changed_ids=farm_ids)
+    EUDRFarmOverlapModel.objects.bulk_create(
+        [EUDRFarmOverlapModel(**pair) for pair in pairs], batch_size=500)
+    return pairs
+
+
+def stored_overlaps_for_farms(farm_ids):
+    """
+    Reads the stored overlaps touching the given farm ids (a list or an id
+    subquery), grouped by farm id.
+    """
+    pairs = EUDRFarmOverlapModel.objects.filter(
+        Q(farm_id__in=farm_ids) | Q(other_farm_id__in=farm_ids)
+    ).values('farm_id', 'other_farm_id', 'intersection_area_ha',
+             'farm_overlap_percentage', 'other_farm_overlap_percentage')
+    return group_overlaps_by_farm(pairs)
+
+
+def group_overlaps_by_farm(pairs):
+    """
+    Indexes overlap pairs by farm id, from the point of view of each farm.
+    """
+    overlaps = {}
+    for pair in pairs:
+        overlaps.setdefault(pair['farm_id'], []).append({
+            "farm_id": pair['other_farm_id'],
+            "intersection_area_ha": pair['intersection_area_ha'],
+            "overlap_percentage": pair['farm_overlap_percentage'],
+        })
+        overlaps.setdefault(pair['other_farm_id'], []).append({
+            "farm_id": pair['farm_id'],
+            "intersection_area_ha": pair['intersection_area_ha'],
+            "overlap_percentage": pair['other_farm_overlap_percentage'],
+        })
+    return overlaps
@@ -0,0 +1,133 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from drf_yasg import openapi
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+LIST_QUERY_PARAMETERS = [
+    openapi.Parameter(
+        name="page_size",
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_INTEGER,
+        required=False,
+        description="Number of rows per page (max 1000). When set, the response is {next, results}",
+    ),
+    openapi.Parameter(
+        name="cursor",
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        required=False,
+        description="Cursor of the page to fetch, taken from the next link of the previous page",
+    ),
+    openapi.Parameter(
+        name="fields",
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        required=False,
+        description="Comma separated list of fields to return, e.g. id,farmer_name,updated_at",
+    ),
+]
+
+
+class UpdatedAtCursorPagination(BasePagination):
+    """
+    Keyset pagination on (updated_at, id), newest first. The cursor holds the
+    position of the last row of a page, so each page is a single indexed range
+    query however deep the client pages, and rows sharing an updated_at (as
+    written by bulk saves) are never skipped or repeated.
+    """
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        if position:
+            updated_at, pk = position
+            queryset = queryset.filter(Q(updated_at__lt=updated_at) | Q(
+                updated_at=updated_at, id__lt=pk))
+
+        rows = list(queryset.order_by(
+            '-updated_at', '-id')[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(page_size, self.max_page_size) if page_size > 0 else self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            updated_at, pk = base64.urlsafe_b64decode(
+                encoded.encode('ascii')).decode('ascii').split('|')
+            return datetime.fromisoformat(updated_at), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, record):
+        position = f"{record.updated_at.isoformat()}|{record.id}"
+        return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+def requested_fields(request, serializer_class):
+    """
+    Returns the model fields listed in the fields= query parameter, ignoring
+    unknown names, or None when the parameter is not given.
+    """
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    model_fields = {
+        field.name for field in serializer_class.Meta.model._meta.concrete_fields}
+    names = dict.fromkeys(name.strip() for name in value.split(','))
+    return [name for name in names if name in model_fields] or None
+
+
+def list_response(request, queryset, serializer_class):
+    """
+    Serializes a listing, projected to the fields= query parameter. The rows are
+    paginated by cursor when the client asks for a cursor or a page_size, and the
+    whole listing is returned as before otherwise.
+    """
+    fields = requested_fields(request, serializer_class)
+    if fields:
+        # polygons and analyses are only read from the database when asked for
+        queryset = queryset.only(*set(fields) | {'id', 'updated_at'})
+
+    paginator = UpdatedAtCursorPagination()
+    if paginator.cursor_query_param in request.query_params or paginator.page_size_query_param in request.query_params:
+        page = paginator.paginate_queryset(queryset, request)
+        serializer = serializer_class(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
+
+    serializer = serializer_class(queryset, many=True, fields=fields)
+    return Response(serializer.data)
@@ -0,0 +1,111 @@
+from datetime import datetime, timezone as dt_timezone
+from functools import cache
+
+import boto3
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from eudr_backend import settings
+from eudr_backend.models import S3ObjectModel
+
+# list_objects_v2 returns at most this many keys per call
+S3_LIST_PAGE_SIZE = 1000
+INDEXED_FIELDS = ['category', 'uploaded_by', 'file_name', 'size', 'last_modified', 'indexed_at']
+
+
+@cache
+def s3_client():
+    """
+    The boto3 client of the bucket, created once per process, boto3 clients
+    are thread safe.
+    """
+    return boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+
+
+def s3_file_url(key):
+    return f"{settings.AWS_S3_BASE_URL}{key}"
+
+
+def s3_object(key, size, last_modified, indexed_at):
+    """
+    Index row of an object, with the category, uploader and file name read from
+    its "<category>/<uploader>_<file name>" key, left empty when the key does
+    not have that form.
+    """
+    category = uploaded_by = file_name = None
+    key_parts = key.split("/")
+    if len(key_parts) >= 2:
+        file_parts = key_parts[1].split("_", 1)
+        if len(file_parts) == 2:
+            category, (uploaded_by, file_name) = key_parts[0], file_parts
+    return S3ObjectModel(key=key, category=category, uploaded_by=uploaded_by, file_name=file_name,
+                         size=size, last_modified=last_modified, indexed_at=indexed_at)
+
+
+def save_s3_objects(objects):
+    S3ObjectModel.objects.bulk_create(
+        objects, update_conflicts=True, unique_fields=['key'], update_fields=INDEXED_FIELDS,
+        batch_size=S3_LIST_PAGE_SIZE)
+
+
+def index_s3_object(key, size, last_modified=None):
+    """
+    Adds an object just stored in the bucket to the index, or updates it when
+    the key was overwritten.
+    """
+    now = timezone.now()
+    save_s3_objects([s3_object(key, size, last_modified or now, now)])
+
+
+def crawl_s3_objects():
+    """
+    Reconciles the index with the bucket: walks every page of the bucket
+    listing, writes the objects of each page with one query and then drops the
+    index rows of objects no longer in the bucket. Objects stored while the
+    crawl runs are kept, they were indexed after it started. Returns the number
+    of objects indexed and of rows dropped, and the days of the dropped rows.
+    """
+    started = timezone.now()
+    indexed = 0
+    pages = s3_client().get_paginator('list_objects_v2').paginate(
+        Bucket=settings.AWS_STORAGE_BUCKET_NAME, PaginationConfig={'PageSize': S3_LIST_PAGE_SIZE})
+    for page in pages:
+        objects = [s3_object(content['Key'], content.get('Size', 0), content['LastModified'], timezone.now())
+                   for content in page.get('Contents', [])]
+        save_s3_objects(objects)
+        indexed += len(objects)
+
+    gone = S3ObjectModel.objects.filter(indexed_at__lt=started)
+    days = set(gone.annotate(day=TruncDate('last_modified')).values_list('day', flat=True).distinct().order_by())
+    deleted, _ = gone.delete()
+    return indexed, deleted, days
+
+
+def s3_files(start=None, end=None):
+    """
+    The indexed files whose key has the expected form, newest first, optionally
+    modified between two aware datetimes, both included.
+    """
+    files = S3ObjectModel.objects.filter(file_name__isnull=False)
+    if start:
+        files = files.filter(last_modified__gte=start)
+    if end:
+        files = files.filter(last_modified__lte=end)
+    return files.order_by('-last_modified', '-id').values(
+        'key', 'category', 'uploaded_by', 'file_name', 'size', 'last_modified')
+
+
+def aware(value):
+    """
+    Datetime parsed from a query parameter, the S3 timestamps being UTC.
+    """
+    return timezone.make_aware(value, dt_timezone.utc) if timezone.is_naive(value) else value
+
+
+def day_bounds(start, end):
+    """
+    The first and last instants of two days, as aware datetimes.
+    """
+    return (aware(datetime.combine(start, datetime.min.time())),
+            aware(datetime.combine(end, datetime.max.time())))
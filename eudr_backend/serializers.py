@@ -1,6 +1,7 @@
 from rest_framework import serializers
-from .models import EUDRCollectionSiteModel, EUDRFarmBackupModel, EUDRFarmModel, EUDRSharedMapAccessCodeModel, EUDRUploadedFilesModel
+from .models import EUDRCollectionSiteModel, EUDRFarmBackupModel, EUDRFarmModel, EUDRIngestionJobModel, EUDRSharedMapAccessCodeModel, EUDRUploadedFilesModel
 from django.contrib.auth.models import User
+from eudr_backend.geometry import GEOMETRY_FIELDS
 
 
 class EUDRUserModelSerializer(serializers.ModelSerializer):
@@ -10,10 +11,27 @@ class EUDRUserModelSerializer(serializers.ModelSerializer):
                   'username', 'is_active', 'date_joined', 'is_staff', 'is_superuser']
 
 
-class EUDRFarmModelSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    Model serializer that only outputs the fields passed in the `fields` argument.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+class EUDRFarmModelSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = EUDRFarmModel
-        fields = "__all__"
+        # the derived geometry columns are read only, the WKB is internal
+        exclude = ["geometry_wkb"]
+        read_only_fields = ["uploaded_file", "owner", "geoid_claimed_at",
+                            "geoid_attempts", *GEOMETRY_FIELDS]
 
 
 class EUDRUploadedFilesModelSerializer(serializers.ModelSerializer):
@@ -22,7 +40,7 @@ class EUDRUploadedFilesModelSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class EUDRFarmBackupModelSerializer(serializers.ModelSerializer):
+class EUDRFarmBackupModelSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = EUDRFarmBackupModel
         fields = "__all__"
@@ -38,3 +56,9 @@ class EUDRSharedMapAccessCodeModelSerializer(serializers.ModelSerializer):
     class Meta:
         model = EUDRSharedMapAccessCodeModel
         fields = "__all__"
+
+
+class EUDRIngestionJobModelSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = EUDRIngestionJobModel
+        exclude = ["upload_key"]
@@ -14,8 +14,6 @@ import os
 from pathlib import Path
 from decouple import config
 
-import ee
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -132,12 +130,6 @@ LOGOUT_REDIRECT_URL = 'login'
 ASGI_APPLICATION = 'eudr_backend.asgi.application'
 
 
-def initialize_earth_engine():
-    ee.Initialize(ee.ServiceAccountCredentials(
-        EE_ACCOUNT_NAME, EE_CREDENTIALS
-    ))
-
-
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -0,0 +1,287 @@
+import base64
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from eudr_backend.models import EUDRCollectionSiteModel, EUDRFarmBackupModel, EUDRFarmBackupTombstoneModel
+from rest_framework import serializers
+
+SYNC_BATCH_SIZE = 500
+RESTORE_PAGE_SIZE = 500
+# farms read from the database at a time by streamed restores
+RESTORE_CHUNK_SIZE = 2000
+MAX_RESTORE_PAGE_SIZE = 2000
+# rows written by syncs still in flight when a watermark was handed out carry
+# an earlier updated_at, restores look back this far before the watermark
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+# fields set by the server, which devices echo back from restores
+READ_ONLY_FIELDS = ('id', 'created_at', 'updated_at')
+
+
+def model_fields(model):
+    return {field.name for field in model._meta.concrete_fields if field.name not in READ_ONLY_FIELDS}
+
+
+SITE_FIELDS = model_fields(EUDRCollectionSiteModel)
+FARM_FIELDS = model_fields(EUDRFarmBackupModel)
+# the fields restores send, as the model serializers of sites and farms do
+SITE_ROW_FIELDS = [field.name for field in EUDRCollectionSiteModel._meta.concrete_fields]
+FARM_ROW_FIELDS = [field.name for field in EUDRFarmBackupModel._meta.concrete_fields]
+DATETIME_FIELD = serializers.DateTimeField()
+
+# the values a device hashes to tell whether a farm changed
+HASHED_FARM_FIELDS = sorted(FARM_FIELDS - {'site_id', 'content_hash'})
+
+
+def backup_hash(farm_data):
+    """
+    Content hash of a farm as sent by a device: the SHA-256 of its values as
+    compact JSON with sorted keys, leaving out site_id and content_hash.
+    """
+    values = {field: farm_data[field] for field in HASHED_FARM_FIELDS if field in farm_data}
+    return hashlib.sha256(json.dumps(
+        values, sort_keys=True, separators=(',', ':'), default=str).encode()).hexdigest()
+
+
+def check_fields(data, fields, kind):
+    for field in READ_ONLY_FIELDS:
+        data.pop(field, None)
+    unknown = set(data) - fields
+    if unknown:
+        raise ValueError(
+            f'Unknown {kind} field(s): {", ".join(sorted(unknown))}')
+
+
+def upsert(model, existing, rows):
+    """
+    Applies rows of field values to the existing instances they were matched
+    with, or to new instances when they were not matched, and writes them with
+    one bulk_create and one bulk_update. Rows are (existing key, values) pairs,
+    and a later row for the same key overwrites an earlier one as it would when
+    saved one by one. Returns the instance of each row.
+    """
+    to_create = []
+    to_update = {}
+    instances = []
+    updated_fields = {'updated_at'}
+    now = timezone.now()
+    for key, values in rows:
+        instance = existing.get(key) if key is not None else None
+        if instance is None:
+            instance = model(**values)
+            to_create.append(instance)
+            if key is not None:
+                existing[key] = instance
+        else:
+            for attr, value in values.items():
+                setattr(instance, attr, value)
+            if instance.pk:
+                # bulk_update does not touch auto_now fields
+                instance.updated_at = now
+                updated_fields.update(values)
+                to_update[instance.pk] = instance
+        instances.append(instance)
+
+    model.objects.bulk_create(to_create, batch_size=SYNC_BATCH_SIZE)
+    if to_update:
+        model.objects.bulk_update(
+            list(to_update.values()), sorted(updated_fields), batch_size=SYNC_BATCH_SIZE)
+    return instances
+
+
+def sync_backups(entries):
+    """
+    Saves the collection sites and farms backed up by devices. Sites are matched
+    by name and farms by remote_id, each with a single query, and everything is
+    written in one transaction so a failed sync leaves nothing half applied.
+    Farms whose content hash did not change since their last sync are not
+    written again, and the remote_ids listed in deleted_remote_ids are deleted
+    and recorded as tombstones for the other devices of their site.
+
+    Returns the remote_id of every farm synced, of every farm deleted and the
+    watermark to restore from next. The id and timestamps restores send are
+    ignored, and entries with other unknown fields raise ValueError.
+    """
+    watermark = timezone.now()
+    site_rows = []
+    for entry in entries:
+        site_data = dict(entry.get('collection_site') or {})
+        # append device_id to site_data
+        site_data['device_id'] = entry.get("device_id")
+        check_fields(site_data, SITE_FIELDS, 'collection site')
+        site_rows.append((site_data.get('name'), site_data))
+
+    farm_entries = [(i, dict(farm_data)) for i, entry in enumerate(entries)
+                    for farm_data in entry.get('farms', [])]
+    for _, farm_data in farm_entries:
+        farm_data.pop('site_id', None)
+        check_fields(farm_data, FARM_FIELDS, 'farm')
+        farm_data['content_hash'] = farm_data.get('content_hash') or backup_hash(farm_data)
+
+    with transaction.atomic():
+        # of the rows already sharing a name or remote_id, the newest one is updated
+        existing_sites = {site.name: site for site in EUDRCollectionSiteModel.objects.filter(
+            name__in=[name for name, _ in site_rows]).order_by('id')}
+        sites = upsert(EUDRCollectionSiteModel, existing_sites, site_rows)
+
+        remote_ids = [farm_data.get('remote_id') for _, farm_data in farm_entries]
+        existing_farms = {farm.remote_id: farm for farm in EUDRFarmBackupModel.objects.filter(
+            remote_id__in=[remote_id for remote_id in remote_ids if remote_id is not None]).order_by('id')}
+        changed = []
+        for i, farm_data in farm_entries:
+            farm = existing_farms.get(farm_data.get('remote_id'))
+            if farm is not None and farm.pk and farm.content_hash == farm_data['content_hash'] \
+                    and farm.site_id_id == sites[i].pk:
+                continue
+            changed.append((farm_data.get('remote_id'), farm_data | {'site_id': sites[i]}))
+        upsert(EUDRFarmBackupModel, existing_farms, changed)
+
+        # a farm synced again is no longer deleted
+        EUDRFarmBackupTombstoneModel.objects.filter(
+            remote_id__in=[remote_id for remote_id, _ in changed if remote_id is not None]).delete()
+        deleted = delete_backups(entries, sites)
+
+    return {
+        "synced_remote_ids": remote_ids,
+        "deleted_remote_ids": deleted,
+        "watermark": watermark.isoformat(),
+    }
+
+
+def delete_backups(entries, sites):
+    """
+    Deletes the farms each entry lists in deleted_remote_ids from its site and
+    records their tombstones. Returns the remote_ids deleted.
+    """
+    deletions = {}
+    for i, entry in enumerate(entries):
+        for remote_id in entry.get('deleted_remote_ids') or []:
+            deletions.setdefault(sites[i], {})[remote_id] = None
+    if not deletions:
+        return []
+
+    query = Q()
+    for site, remote_ids in deletions.items():
+        query |= Q(site_id=site, remote_id__in=list(remote_ids))
+    EUDRFarmBackupModel.objects.filter(query).delete()
+    EUDRFarmBackupTombstoneModel.objects.bulk_create([
+        EUDRFarmBackupTombstoneModel(remote_id=remote_id, site_id=site)
+        for site, remote_ids in deletions.items() for remote_id in remote_ids], batch_size=SYNC_BATCH_SIZE)
+    return [remote_id for remote_ids in deletions.values() for remote_id in remote_ids]
+
+
+def parse_watermark(value):
+    """
+    Reads a watermark handed out by a sync or restore. Raises ValueError when
+    it is not an ISO 8601 timestamp.
+    """
+    try:
+        watermark = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid watermark')
+    return timezone.make_aware(watermark) if timezone.is_naive(watermark) else watermark
+
+
+def plain_row(row):
+    """
+    Formats a values() row the way the model serializers would, without
+    building model instances or serializers for it.
+    """
+    return {key: DATETIME_FIELD.to_representation(value) if isinstance(value, datetime) else value
+            for key, value in row.items()}
+
+
+def encode_restore_cursor(since, watermark, farm):
+    position = [since.isoformat() if since else None, watermark.isoformat(),
+                farm['updated_at'].isoformat(), farm['id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode('ascii')
+
+
+def decode_restore_cursor(cursor):
+    try:
+        since, watermark, updated_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return (datetime.fromisoformat(since) if since else None, datetime.fromisoformat(watermark),
+                datetime.fromisoformat(updated_at), int(pk))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+
+
+def restore_backups(sites, since=None, cursor=None, page_size=RESTORE_PAGE_SIZE):
+    """
+    Returns a page of the farms of the given collection sites, oldest change
+    first, grouped by site. With a since watermark only the farms changed after
+    it are returned, and the first page also lists the farms deleted after it.
+    The page holds the cursor of the next one and the watermark to restore from
+    once the last page was read. Raises ValueError for an invalid cursor.
+    """
+    page_size = min(max(page_size, 1), MAX_RESTORE_PAGE_SIZE)
+    sites = {site['id']: site for site in sites.order_by('id').values(*SITE_ROW_FIELDS)}
+    after = None
+    if cursor:
+        since, watermark, *after = decode_restore_cursor(cursor)
+    else:
+        watermark = timezone.now()
+
+    farms = EUDRFarmBackupModel.objects.filter(site_id__in=list(sites))
+    if since:
+        farms = farms.filter(updated_at__gte=since - WATERMARK_OVERLAP)
+    if after:
+        updated_at, pk = after
+        farms = farms.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=pk))
+    farms = list(farms.order_by('updated_at', 'id').values(*FARM_ROW_FIELDS)[:page_size + 1])
+    has_next = len(farms) > page_size
+    farms = farms[:page_size]
+
+    farms_by_site = {}
+    for farm in farms:
+        farms_by_site.setdefault(farm['site_id'], []).append(plain_row(farm))
+    # the first page carries every site, so sites without farms are restored too
+    page_sites = list(sites) if not cursor else list(farms_by_site)
+
+    deleted = []
+    if since and not cursor:
+        deleted = [{"remote_id": tombstone.remote_id, "deleted_at": tombstone.deleted_at.isoformat()}
+                   for tombstone in EUDRFarmBackupTombstoneModel.objects.filter(
+                       site_id__in=list(sites), deleted_at__gte=since - WATERMARK_OVERLAP).order_by('deleted_at')]
+
+    return {
+        "watermark": watermark.isoformat(),
+        "next": encode_restore_cursor(since, watermark, farms[-1]) if has_next else None,
+        "results": [{
+            "device_id": sites[site_pk]['device_id'],
+            "collection_site": plain_row(sites[site_pk]),
+            "farms": farms_by_site.get(site_pk, []),
+        } for site_pk in page_sites],
+        "deleted": deleted,
+    }
+
+
+def stream_restore(sites):
+    """
+    Yields the JSON of a full restore of the given collection sites, one site at
+    a time, so the response starts before all their farms were read. Reads the
+    sites with one query and their farms with another, in chunks.
+    """
+    sites = list(sites.order_by('id').values(*SITE_ROW_FIELDS))
+    farms = EUDRFarmBackupModel.objects.filter(site_id__in=[site['id'] for site in sites]).order_by(
+        'site_id', 'id').values(*FARM_ROW_FIELDS).iterator(chunk_size=RESTORE_CHUNK_SIZE)
+
+    farm = next(farms, None)
+    yield '['
+    for i, site in enumerate(sites):
+        site_farms = []
+        while farm is not None and farm['site_id'] == site['id']:
+            site_farms.append(plain_row(farm))
+            farm = next(farms, None)
+        yield (',' if i else '') + json.dumps({
+            "device_id": site['device_id'],
+            "collection_site": plain_row(site),
+            "farms": site_farms,
+        }, separators=(',', ':'))
+    yield ']'
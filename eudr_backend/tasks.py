@@ -1,63 +1,196 @@
-import requests
-from shapely import Polygon
+from datetime import timedelta
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.utils import timezone
 
-from eudr_backend import settings
-from .models import EUDRFarmModel, EUDRUploadedFilesModel
+from eudr_backend.agstack import farm_boundary_wkt, register_geoids
+from eudr_backend.async_tasks import async_create_farm_data_from_features
+from eudr_backend.dashboard import rebuild_dashboard_metrics, refresh_dashboard_metrics
+from eudr_backend.s3_objects import crawl_s3_objects
+from eudr_backend.utils import delete_job_upload, extract_data_from_file, iter_csv_features, read_job_upload, store_file_in_s3
+from eudr_backend.validators import validate_csv, validate_geojson
+from .models import EUDRFarmModel, EUDRIngestionJobModel, EUDRUploadedFilesModel
 from background_task import background
-from shapely import wkt
-
-AG_BASE_URL = "https://api-ar.agstack.org"
-
-
-def get_access_token():
-    login_url = f'{AG_BASE_URL}/login'
-    payload = {
-        "email": settings.AGSTACK_EMAIL,
-        "password": settings.AGSTACK_PASSWORD
-    }
-    response = requests.post(login_url, json=payload)
-    response.raise_for_status()  # Raise an error for bad responses
-    data = response.json()
-    return data['access_token']
-
-
-@background(schedule=60)  # Schedule task to run every 5 minutes
-def update_geoid(user_id):
-    access_token = get_access_token()
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    # Get all file IDs corresponding to the user
-    user_files = EUDRUploadedFilesModel.objects.filter(uploaded_by=user_id)
-    file_ids = user_files.values_list('id', flat=True)
-
-    # Filter farms based on these file IDs and geoid being null
+from background_task.models import Task
+from background_task.tasks import TaskSchedule
+
+GEOID_BATCH_SIZE = 500
+# a claimed farm is left alone this long, which is also the delay before failed registrations are retried
+GEOID_CLAIM_LEASE = timedelta(minutes=5)
+GEOID_MAX_ATTEMPTS = 5
+DASHBOARD_REFRESH_INTERVAL = 15 * 60
+# uploads index their objects as they store them, the crawl catches the rest
+S3_CRAWL_INTERVAL = 60 * 60
+
+
+def geoid_queue(user_id=None):
+    """
+    Farms still waiting for a geoid, of one user (by username) or of everyone.
+    """
     farms = EUDRFarmModel.objects.filter(
-        geoid__isnull=True, file_id__in=file_ids)
-    for farm in farms:
-        # check if polygon has only one ring
-        if len(farm.polygon) != 1:
-            continue
-
-        reversed_coords = [[(lat, lon) for lat, lon in ring]
-                           for ring in farm.polygon]
-
-# Create a Shapely Polygon
-        polygon = Polygon(reversed_coords[0])
-
-        # Convert to WKT format
-        wkt_format = wkt.dumps(polygon)
-
-        response = requests.post(
-            f'{AG_BASE_URL}/register-field-boundary',
-            json={"wkt": wkt_format},
-            headers=headers
-        )
-        data = response.json()
-        if response.status_code == 200:
-            farm.geoid = data.get("Geo Id")
-            farm.save()
+        geoid__isnull=True, geoid_attempts__lt=GEOID_MAX_ATTEMPTS)
+    return farms.filter(owner__username=user_id) if user_id else farms
+
+
+def claim_geoid_batch(user_id=None, after_id=0):
+    """
+    Claims the next batch of unclaimed (or abandoned) farms of the queue. The
+    claim is a conditional update, so concurrent workers never get the same farm.
+    """
+    now = timezone.now()
+    claimable = geoid_queue(user_id).filter(
+        Q(geoid_claimed_at__isnull=True) | Q(geoid_claimed_at__lt=now - GEOID_CLAIM_LEASE)
+    ).filter(id__gt=after_id)
+    ids = list(claimable.order_by('id').values_list(
+        'id', flat=True)[:GEOID_BATCH_SIZE])
+    claimable.filter(id__in=ids).update(geoid_claimed_at=now)
+    return list(EUDRFarmModel.objects.filter(id__in=ids, geoid_claimed_at=now).only(
+        'id', 'polygon', 'polygon_type', 'geoid', 'geoid_claimed_at', 'geoid_attempts', 'updated_at'))
+
+
+def schedule_geoid_registration(user_id=None, delay=60):
+    """
+    Schedules the geoid registration of a user's farms (by username), or of all
+    farms, unless a job for them is already pending.
+    """
+    update_geoid(user_id=user_id, schedule={
+        'run_at': delay, 'action': TaskSchedule.CHECK_EXISTING})
+
+
+@background(schedule=60)
+def update_geoid(user_id=None):
+    # walk the queue in id order so each farm is tried at most once per run
+    last_id = 0
+    while True:
+        batch = claim_geoid_batch(user_id, after_id=last_id)
+        if not batch:
+            break
+        last_id = max(farm.id for farm in batch)
+
+        boundaries = {}
+        for farm in batch:
+            boundary = farm_boundary_wkt(farm.polygon, farm.polygon_type)
+            if boundary:
+                boundaries[farm.id] = boundary
+
+        geoids = async_to_sync(register_geoids)(boundaries)
+        now = timezone.now()
+        for farm in batch:
+            if farm.id in geoids:
+                farm.geoid = geoids[farm.id]
+                farm.geoid_claimed_at = None
+                farm.updated_at = now
+            elif farm.id in boundaries:
+                # keep the claim so the farm waits for the lease before the retry
+                farm.geoid_attempts += 1
+            else:
+                # points and unreadable polygons can never be registered
+                farm.geoid_attempts = GEOID_MAX_ATTEMPTS
+        EUDRFarmModel.objects.bulk_update(
+            batch, ['geoid', 'geoid_claimed_at', 'geoid_attempts', 'updated_at'], batch_size=GEOID_BATCH_SIZE)
+
+    # only come back for farms whose registration failed and may be retried
+    if geoid_queue(user_id).exists():
+        schedule_geoid_registration(
+            user_id, delay=int(GEOID_CLAIM_LEASE.total_seconds()))
+
+
+@background(schedule=0)
+def process_ingestion_job(job_id):
+    job = EUDRIngestionJobModel.objects.get(id=job_id)
+    if not job.upload_key:
+        # the job succeeded already, before its worker could delete the task
+        return
+    user = User.objects.filter(username=job.uploaded_by).first()
+    file_name = job.file_name.rsplit('.', 1)[0]
+    # the upload stays in the bucket until the job succeeds, a job whose worker
+    # died is run again from it
+    upload = read_job_upload(job.upload_key)
+    job.status = 'RUNNING'
+    job.stage = 'VALIDATING'
+    job.save()
+
+    def finish(status, errors=[]):
+        job.refresh_from_db()
+        job.status = status
+        job.errors = errors
+        if status == 'COMPLETED':
+            job.stage = 'DONE'
+        job.save()
+        # archive the upload the same way the synchronous upload does
+        if job.from_file and user:
+            store_file_in_s3(upload, user, file_name, status == 'COMPLETED')
+
+    async def report_progress(**counters):
+        await sync_to_async(EUDRIngestionJobModel.objects.filter(id=job.id).update)(**counters)
+
+    try:
+        source_data = extract_data_from_file(upload, job.data_format)
+        errors = validate_csv(source_data) if job.data_format == 'csv' else validate_geojson(
+            source_data)
+        if errors:
+            return finish('FAILED', errors)
+
+        if job.data_format == 'csv':
+            job.rows_parsed = max(sum(1 for _ in source_data) - 1, 0)
+            features = iter_csv_features(source_data)
         else:
-            farm.geoid = data.get("matched geo ids")[0]
-            farm.save()
+            features = source_data['features']
+            job.rows_parsed = sum(1 for _ in features)
+
+        file, _ = EUDRUploadedFilesModel.objects.get_or_create(
+            file_name=job.file_name, uploaded_by=job.uploaded_by)
+        job.file_id = file.id
+        job.stage = 'ANALYSING'
+        job.save()
+
+        errors, _ = async_to_sync(async_create_farm_data_from_features)(
+            features, file.id, on_progress=report_progress, owner=user)
+        if errors:
+            return finish('FAILED', errors)
+    except Exception as e:
+        return finish('FAILED', [str(e)])
+
+    finish('COMPLETED')
+    delete_job_upload(job.upload_key)
+    EUDRIngestionJobModel.objects.filter(id=job.id).update(upload_key=None)
+    schedule_geoid_registration(job.uploaded_by)
+
+
+def schedule_repeating(task, interval):
+    """
+    Schedules a task repeated every interval seconds, unless a run of it is
+    already pending or running. CHECK_EXISTING only sees unlocked tasks, so it
+    would start a second repeating chain while the task runs.
+    """
+    if not Task.objects.filter(task_name=task.name).exists():
+        task(repeat=interval, schedule=0)
+
+
+def schedule_dashboard_metrics_refresh():
+    """
+    Schedules the refresh of the dashboard rollups, repeated every
+    DASHBOARD_REFRESH_INTERVAL seconds, unless it is already scheduled.
+    """
+    schedule_repeating(update_dashboard_metrics, DASHBOARD_REFRESH_INTERVAL)
+
+
+@background(schedule=0)
+def update_dashboard_metrics():
+    refresh_dashboard_metrics()
+
+
+def schedule_s3_index_crawl():
+    """
+    Schedules the reconciliation of the S3 object index with the bucket,
+    repeated every S3_CRAWL_INTERVAL seconds, unless it is already scheduled.
+    """
+    schedule_repeating(crawl_s3_index, S3_CRAWL_INTERVAL)
+
+
+@background(schedule=0)
+def crawl_s3_index():
+    _, _, deleted_days = crawl_s3_objects()
+    # rollup days of objects gone from the bucket, the refresh only sees new rows
+    rebuild_dashboard_metrics(days=deleted_days)
@@ -0,0 +1,156 @@
+import math
+import re
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+from django.core.cache import cache
+from django.db.models import Count, Exists, Max, OuterRef
+
+from eudr_backend.farm_queries import map_farms
+from eudr_backend.models import EUDRFarmOverlapModel
+
+MAX_ZOOM = 22
+# below this zoom plots are a few pixels wide, so they are sent as points
+MIN_POLYGON_ZOOM = 12
+TILE_SIZE = 256
+TILE_CACHE_TIMEOUT = 24 * 60 * 60
+MAX_INDEXES = 8
+# versions sent back by the map, see farm_tiles_version
+TILES_VERSION_PATTERN = re.compile(r'[\w:.+-]{1,64}')
+
+_indexes = OrderedDict()
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns the (min_lon, min_lat, max_lon, max_lat) of an XYZ web mercator tile.
+    """
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def farm_tiles_version(farms):
+    """
+    Version of the tiles of some farms, read from the database so every process
+    sees the same one: the last time one of them was written and how many there
+    are, so saves and deletes both move it. Farm writes set updated_at, bulk ones
+    included.
+    """
+    version = farms.aggregate(updated=Max('updated_at'), count=Count('id'))
+    updated = version['updated'].isoformat() if version['updated'] else ''
+    return f"{updated}:{version['count']}"
+
+
+class FarmTileIndex:
+    """
+    Spatial index of the farms visible in one scope, built once per tiles version
+    and shared by every tile of that scope.
+    """
+
+    def __init__(self, farms):
+        ids = []
+        risks = []
+        overlapping = []
+        wkbs = []
+        for farm in farms:
+            if farm['geometry_is_valid']:
+                wkb = bytes(farm['geometry_wkb'])
+            elif farm['latitude'] or farm['longitude']:
+                # unreadable polygons are drawn at the farm coordinates
+                wkb = shapely.to_wkb(shapely.Point(
+                    farm['longitude'], farm['latitude']))
+            else:
+                continue
+            ids.append(farm['id'])
+            risks.append((farm['analysis'] or {}).get('eudr_risk_level'))
+            overlapping.append(farm['overlaps_farm'] or farm['overlapped_by_farm'])
+            wkbs.append(wkb)
+
+        self.ids = ids
+        self.risks = risks
+        self.overlapping = overlapping
+        self.geometries = shapely.from_wkb(np.array(wkbs, dtype=object))
+        self.tree = shapely.STRtree(self.geometries)
+
+    def tile(self, z, x, y):
+        box = shapely.box(*tile_bounds(z, x, y))
+        matches = np.sort(self.tree.query(box, predicate='intersects'))
+        if not len(matches):
+            return {"type": "FeatureCollection", "features": []}
+
+        # about one pixel of the tile, finer detail is not visible at this zoom
+        tolerance = 360 / 2 ** z / TILE_SIZE
+        geometries = self.geometries[matches]
+        if z < MIN_POLYGON_ZOOM:
+            geometries = shapely.point_on_surface(geometries)
+        else:
+            geometries = shapely.simplify(
+                geometries, tolerance, preserve_topology=True)
+        geometries = shapely.set_precision(
+            geometries, max(tolerance / 10, 1e-7))
+
+        features = []
+        for index, geometry in zip(matches, geometries):
+            if geometry.is_empty:
+                continue
+            features.append({
+                "type": "Feature",
+                "id": self.ids[index],
+                "geometry": shapely.geometry.mapping(geometry),
+                "properties": {
+                    "id": self.ids[index],
+                    "eudr_risk_level": self.risks[index],
+                    "overlapping": self.overlapping[index],
+                },
+            })
+        return {"type": "FeatureCollection", "features": features}
+
+
+def tile_index(scope, farms, version):
+    key = (scope, version)
+    if key not in _indexes:
+        pairs = EUDRFarmOverlapModel.objects.all()
+        _indexes[key] = FarmTileIndex(farms.annotate(
+            overlaps_farm=Exists(pairs.filter(farm_id=OuterRef('id'))),
+            overlapped_by_farm=Exists(pairs.filter(other_farm_id=OuterRef('id'))),
+        ).values('id', 'geometry_wkb', 'geometry_is_valid', 'latitude', 'longitude', 'analysis',
+                 'overlaps_farm', 'overlapped_by_farm'))
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    _indexes.move_to_end(key)
+    return _indexes[key]
+
+
+def tiles_scope(user, file_id=None, farm_id=None, overlaps_only=False):
+    """
+    Name of the set of farms drawn by a map, see map_farms.
+    """
+    if farm_id:
+        return f"farm:{farm_id}"
+    if file_id:
+        return f"file:{file_id}:overlaps" if overlaps_only else f"file:{file_id}"
+    return 'all' if user.is_staff else f"user:{user.id}"
+
+
+def farm_tile(user, z, x, y, file_id=None, farm_id=None, overlaps_only=False, version=None):
+    """
+    Returns the GeoJSON tile of the farms drawn by a map, from the cache when it
+    was already built for the current version of those farms. The map sends
+    back the version it was loaded with, so tiles are served without reading
+    the farms; it is only read here when missing.
+    """
+    scope = tiles_scope(user, file_id=file_id, farm_id=farm_id, overlaps_only=overlaps_only)
+    farms = map_farms(user, file_id=file_id, farm_id=farm_id, overlaps_only=overlaps_only)
+    if not version or not TILES_VERSION_PATTERN.fullmatch(version):
+        version = farm_tiles_version(farms)
+    cache_key = f"farm_tile:{version}:{scope}:{z}:{x}:{y}"
+    tile = cache.get(cache_key)
+    if tile is None:
+        tile = tile_index(scope, farms, version).tile(z, x, y)
+        cache.set(cache_key, tile, TILE_CACHE_TIMEOUT)
+    return tile
@@ -31,10 +31,13 @@ from eudr_backend.views import (
     retrieve_collection_sites,
     retrieve_farm_data,
     retrieve_farm_data_from_file_id,
+    retrieve_farm_data_job,
     retrieve_farm_detail,
     retrieve_file,
     retrieve_files,
     retrieve_map_data,
+    retrieve_farm_tile,
+    retrieve_earth_engine_health,
     retrieve_overlapping_farm_data,
     retrieve_s3_files,
     retrieve_user,
@@ -101,6 +104,8 @@ urlpatterns = [
     path("api/users/update/<int:pk>/", update_user, name="user_update"),
     path("api/users/delete/<int:pk>/", delete_user, name="user_delete"),
     path("api/farm/add/", create_farm_data, name="create_farm_data"),
+    path("api/farm/add/status/<int:pk>/", retrieve_farm_data_job,
+         name="retrieve_farm_data_job"),
     path("api/farm/update/<int:pk>/", update_farm_data, name="update_farm_data"),
     path("api/farm/sync/", sync_farm_data, name="sync_farm_data"),
     path("api/farm/restore/", restore_farm_data, name="restore_farm_data"),
@@ -116,6 +121,10 @@ urlpatterns = [
     path("api/farm/sync/list/<int:pk>/", retrieve_all_synced_farm_data_by_cs,
          name="retrieve_all_synced_farm_data_by_cs"),
     path("api/farm/map/list/", retrieve_map_data, name="retrieve_map_data"),
+    path("api/farm/tiles/<int:z>/<int:x>/<int:y>/", retrieve_farm_tile,
+         name="retrieve_farm_tile"),
+    path("api/health/earth-engine/", retrieve_earth_engine_health,
+         name="retrieve_earth_engine_health"),
     path("api/farm/list/<int:pk>/", retrieve_farm_detail,
          name="retrieve_farm_detail"),
     path("api/collection_sites/list/", retrieve_collection_sites,
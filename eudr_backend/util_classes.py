@@ -1,3 +1,9 @@
+import gzip
+import io
+
+from eudr_backend import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import BasePermission
 
 
@@ -8,3 +14,24 @@ class IsSuperUser(BasePermission):
 
     def has_permission(self, request, view):
         return request.user and request.user.is_superuser
+
+
+class GzipJSONParser(JSONParser):
+    """
+    JSON parser that also reads gzip-compressed bodies, sent with a
+    Content-Encoding: gzip header. The decompressed body is held to the same
+    size limit as uncompressed ones.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get('request')
+        if request is not None and request.META.get('HTTP_CONTENT_ENCODING', '').lower() == 'gzip':
+            limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+            try:
+                body = gzip.GzipFile(fileobj=stream).read(limit + 1)
+            except (OSError, EOFError) as e:
+                raise ParseError(f'Invalid gzip body: {e}')
+            if len(body) > limit:
+                raise ParseError('Request body is too large once decompressed')
+            stream = io.BytesIO(body)
+        return super().parse(stream, media_type, parser_context)
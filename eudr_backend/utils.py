@@ -1,13 +1,30 @@
 import ast
 import csv
+import hashlib
+import io
 import json
+import tempfile
 import uuid
+from itertools import islice
 
-import boto3
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import ijson
+import shapely
+from shapely.geometry import shape
 from eudr_backend import settings
+from eudr_backend.dashboard import mark_deleted_rows
 from eudr_backend.models import EUDRUploadedFilesModel
+from eudr_backend.s3_objects import index_s3_object, s3_client
+
+# uploaded file formats read with geopandas, handled as GeoJSON once read
+# (shapefiles are uploaded as a zip of their parts)
+VECTOR_FILE_FORMATS = ['zip', 'gpkg', 'kml']
+# bucket folder of the uploads of background jobs, their keys are not indexed
+# as files since they have no "<uploader>_<file name>" part
+JOB_UPLOAD_FOLDER = "jobs"
+JOB_UPLOAD_MEMORY_SIZE = 10 * 1024 * 1024
 
 
 def flatten_multipolygon(multipolygon):
@@ -78,14 +95,20 @@ def transform_db_data_to_geojson(data, isSyncing=False):
     return geojson
 
 
-def transform_csv_to_json(data):
-    features = []
+def iter_csv_features(data):
+    """
+    Yields one GeoJSON feature per CSV row. The first row is the header, and
+    rows are consumed lazily so an uploaded file can be streamed.
+    """
+    rows = iter(data)
 
     # Assume the first element is the header (column names)
-    headers = data[0]
+    headers = next(rows, None)
+    if headers is None:
+        return
 
     # Iterate over data starting from the second row (actual data)
-    for row in data[1:]:
+    for row in rows:
         # Create a record as a dictionary mapping headers to row values
         record = dict(zip(headers, row))
 
@@ -95,7 +118,7 @@ def transform_csv_to_json(data):
 
         # Handle empty or missing polygon field
         if not record['polygon'] or record['polygon'] in ['']:
-            feature = {
+            yield {
                 "type": "Feature",
                 "geometry": {
                     "type": "Point",
@@ -103,31 +126,40 @@ def transform_csv_to_json(data):
                 },
                 "properties": {k: v for k, v in record.items() if k not in ['latitude', 'longitude', 'polygon']}
             }
-            features.append(feature)
         else:
             try:
                 coordinates = ast.literal_eval(record['polygon'])
-                feature = {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Polygon",
-                        "coordinates": [coordinates]
-                    },
-                    "properties": {k: v for k, v in record.items() if k not in ['latitude', 'longitude', 'polygon']}
-                }
-                features.append(feature)
             except (ValueError, SyntaxError):
                 # Skip record if polygon parsing fails
                 continue
+            yield {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [coordinates]
+                },
+                "properties": {k: v for k, v in record.items() if k not in ['latitude', 'longitude', 'polygon']}
+            }
+
 
+def transform_csv_to_json(data):
     geojson = {
         "type": "FeatureCollection",
-        "features": features
+        "features": list(iter_csv_features(data))
     }
 
     return geojson
 
 
+def iter_batches(iterable, size):
+    """
+    Splits any iterable into lists of at most `size` items without reading ahead.
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
 def flatten_geojson(geojson):
     """
     Loops through a GeoJSON object and flattens any MultiPolygon geometry to Polygon.
@@ -217,6 +249,22 @@ def is_valid_polygon(polygon):
         return False
 
 
+def geometry_cache_key(geometry, precision=6):
+    """
+    Hashes a GeoJSON geometry after rounding its coordinates and normalizing it,
+    so that the same plot always maps to the same key regardless of ring
+    orientation or starting vertex. Returns None for geometries shapely cannot read.
+    """
+    try:
+        geom = shape(geometry)
+        geom = shapely.transform(
+            geom, lambda coords: np.round(coords, precision))
+        geom = shapely.normalize(geom)
+    except Exception:
+        return None
+    return hashlib.sha256(shapely.to_wkb(geom)).hexdigest()
+
+
 def reverse_polygon_points(polygon):
     reversed_polygon = [[lon, lat] for lat, lon in polygon[0]]
     return reversed_polygon
@@ -226,43 +274,163 @@ def generate_access_code():
     return str(uuid.uuid4())
 
 
-def extract_data_from_file(file, data_format):
+class UploadedCSVRows:
+    """
+    Re-iterable view over the rows of an uploaded CSV file. Each iteration rewinds
+    the file and decodes it line by line, so validation and transformation can
+    both stream through the upload without keeping it in memory.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def __iter__(self):
+        self.file.seek(0)
+        return csv.reader(line.decode('utf-8', errors='replace') for line in self.file)
+
+
+class UploadedGeoJSONFeatures:
+    """
+    Re-iterable view over the features of an uploaded GeoJSON file. Each
+    iteration rewinds the file and parses it incrementally, so validation and
+    transformation can both stream through the upload one feature at a time.
+    Raises ValueError when the file turns out not to be JSON.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def __iter__(self):
+        self.file.seek(0)
+        try:
+            # use_float, the validators expect numbers rather than Decimals
+            yield from ijson.items(self.file, 'features.item', use_float=True)
+        except ijson.JSONError as e:
+            raise ValueError(f"Invalid GeoJSON file: {e}")
+
+
+def read_geojson(file):
+    """
+    Reads the top level members of a GeoJSON file that come before its
+    features, and hands the features over as UploadedGeoJSONFeatures, property
+    types included, without keeping the file in memory. Files that are not an
+    object with a features array are read as they are, for validation to
+    report. Raises ValueError when the file is not JSON.
+    """
+    file.seek(0)
+    members = {}
+    streamed = False
     try:
-        if data_format == 'csv':
-            data = []
-            decoded_file = file.read().decode('utf-8', errors='replace').splitlines()
-            reader = csv.reader(decoded_file)
-            for row in reader:
-                data.append(row)
-        elif data_format == 'geojson':
+        events = ijson.parse(file, use_float=True)
+        if next(events, (None, None, None))[1] == 'start_map':
+            for prefix, event, value in events:
+                if prefix == 'features':
+                    streamed = event == 'start_array'
+                    break
+                if prefix == '':
+                    if event == 'map_key':
+                        key = value
+                        members[key] = ijson.ObjectBuilder()
+                else:
+                    members[key].event(event, value)
+        data = {key: builder.value for key, builder in members.items() if key != 'features'}
+        if streamed and 'type' not in data:
+            # the type comes after the features, look it up without building them
+            file.seek(0)
+            data['type'] = next(ijson.items(file, 'type'), None)
+    except ijson.JSONError as e:
+        raise ValueError(f"Invalid GeoJSON file: {e}")
+    if streamed:
+        return data | {"features": UploadedGeoJSONFeatures(file)}
+
+    file.seek(0)
+    try:
+        return json.load(file)
+    except ValueError as e:
+        raise ValueError(f"Invalid GeoJSON file: {e}")
+
+
+def extract_data_from_file(file, data_format):
+    if data_format == 'csv':
+        return UploadedCSVRows(file)
+    if data_format == 'geojson':
+        return read_geojson(file)
+    if data_format in VECTOR_FILE_FORMATS:
+        # other vector formats go through GDAL, in WGS84 like GeoJSON
+        try:
             data = gpd.read_file(file)
-            # convert to geojson
-            data = json.loads(data.to_json())
-        else:
-            raise ValueError(
-                "Unsupported data format. Please use 'csv' or 'geojson'.")
-        return data
-    except Exception as e:
-        raise e
+            if data.crs is not None:
+                data = data.to_crs(epsg=4326)
+        except Exception as e:
+            raise ValueError(f"Invalid {data_format} file: {e}")
+        return json.loads(data.to_json())
+    raise ValueError(
+        "Unsupported data format. Please use 'csv', 'geojson', 'zip', 'gpkg' or 'kml'.")
+
+
+def serialize_payload_to_file(data, data_format):
+    """
+    Writes parsed upload data back into an in-memory file, for data that was not
+    uploaded as a CSV or GeoJSON file to be stored like one.
+    """
+    buffer = io.StringIO()
+    if data_format == 'csv':
+        csv.writer(buffer).writerows(data)
+    else:
+        json.dump(data, buffer)
+    return io.BytesIO(buffer.getvalue().encode('utf-8'))
 
 
 def store_file_in_s3(file, user, file_name, is_failed=False):
     # Store the file in the AWS S3 bucket's failed directory
     if file:
-        s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
         folder = "failed" if is_failed else "processed"
-        s3.upload_fileobj(
+        key = f"{folder}/{user.username}_{file_name}"
+        # the upload has already been read while parsing it
+        file.seek(0, io.SEEK_END)
+        size = file.tell()
+        file.seek(0)
+        s3_client().upload_fileobj(
             file, 
             settings.AWS_STORAGE_BUCKET_NAME,
-            f"{folder}/{user.username}_{file_name}", 
+            key, 
             ExtraArgs={'ACL': 'public-read'}
         )
+        index_s3_object(key, size)
+
+
+
+def store_job_upload(file, data_format):
+    """
+    Keeps the upload of a background job in the bucket, privately, until the
+    job succeeds, so a job whose worker died can be run again from it. Returns
+    the key of the upload.
+    """
+    key = f"{JOB_UPLOAD_FOLDER}/{uuid.uuid4()}.{data_format}"
+    file.seek(0)
+    s3_client().upload_fileobj(file, settings.AWS_STORAGE_BUCKET_NAME, key)
+    return key
+
+
+def read_job_upload(key):
+    """
+    Downloads the upload of a background job into a temporary file, kept in
+    memory up to JOB_UPLOAD_MEMORY_SIZE bytes.
+    """
+    upload = tempfile.SpooledTemporaryFile(max_size=JOB_UPLOAD_MEMORY_SIZE)
+    s3_client().download_fileobj(settings.AWS_STORAGE_BUCKET_NAME, key, upload)
+    upload.seek(0)
+    return upload
+
 
+def delete_job_upload(key):
+    s3_client().delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
 
 
 def handle_failed_file_entry(file_serializer, file, user):
     if "id" in file_serializer.data:
-        EUDRUploadedFilesModel.objects.get(
-            id=file_serializer.data.get("id")).delete()
+        files = EUDRUploadedFilesModel.objects.filter(
+            id=file_serializer.data.get("id"))
+        mark_deleted_rows(files)
+        files.delete()
     store_file_in_s3(file, user, file_serializer.data.get('file_name'))
\ No newline at end of file
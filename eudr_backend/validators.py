@@ -1,5 +1,15 @@
 import json
-from eudr_backend.utils import is_valid_polygon
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from eudr_backend.utils import UploadedGeoJSONFeatures, is_valid_polygon, iter_batches
+
+MAX_VALIDATION_ERRORS = 100
+CSV_CHUNK_SIZE = 20000
+GEOJSON_CHUNK_SIZE = 20000
 
 
 REQUIRED_FIELDS = [
@@ -23,6 +33,26 @@ OPTIONAL_FIELDS = [
     'accuracies'
 ]
 
+GEOJSON_PROPERTY_TYPES = {
+    'farmer_name': str,
+    'farm_village': str,
+    'farm_district': str,
+    'farm_size': (int, float),
+    'latitude': (int, float),
+    'longitude': (int, float),
+}
+
+GEOJSON_GEOMETRY_TYPES = ['Point', 'Polygon', 'MultiPolygon']
+
+COORDINATE_ERRORS = {
+    'not_lists': 'Invalid GeoJSON coordinates. Must be a list of lists',
+    'not_positions': 'Invalid GeoJSON coordinates. Must be a list of lists with 2 numbers',
+    'not_point': 'Invalid GeoJSON coordinates. Must be a list of 2 numbers',
+    'short': 'Invalid GeoJSON coordinates. Must be a list of lists with at least 4 coordinates',
+    'out_of_range': 'Invalid GeoJSON coordinates. Longitude must be between -180 and 180 and latitude between -90 and 90',
+    'invalid': 'Invalid GeoJSON coordinates. Must be a valid polygon',
+}
+
 GEOJSON_REQUIRED_FIELDS = ['geometry',
                            'farmer_name',
                            'farm_size',
@@ -34,162 +64,355 @@ GEOJSON_REQUIRED_FIELDS = ['geometry',
                            ]
 
 
-def validate_csv(data):
-    errors = []
+def validation_error(record, field, message):
+    return {"record": record, "field": field, "message": message}
+
+
+def validate_csv(data, max_errors=MAX_VALIDATION_ERRORS):
+    """
+    Validates CSV rows (header first) a chunk at a time, with the checks of each
+    chunk run column by column on a DataFrame. Returns at most max_errors errors,
+    ordered by record, each as {record, field, message}.
+    """
+    rows = iter(data)
 
     # Check if required fields are present in the header
-    header = data[0]
-    for field in REQUIRED_FIELDS:
-        if field not in header:
-            errors.append(f'"{field}" is required.')
+    header = next(rows, None)
+    if header is None:
+        return [validation_error(None, None, 'The file is empty.')]
+    errors = [validation_error(None, field, f'"{field}" is required.')
+              for field in REQUIRED_FIELDS if field not in header]
     if len(errors) > 0:
         return errors
 
     # Check for any invalid fields in the header
-    for field in header:
-        if field not in REQUIRED_FIELDS and field not in OPTIONAL_FIELDS:
-            errors.append(f'"{field}" is not a valid field.')
+    errors = [validation_error(None, field, f'"{field}" is not a valid field.')
+              for field in header if field not in REQUIRED_FIELDS and field not in OPTIONAL_FIELDS]
     if len(errors) > 0:
         return errors
 
     # Check each record for data validation
-    for i, record in enumerate(data[1:], start=1):
-        record_dict = dict(zip(header, record))
+    first_record = 1
+    for chunk in iter_batches(rows, CSV_CHUNK_SIZE):
+        # short rows are padded with None, extra cells are ignored
+        frame = pd.DataFrame([row[:len(header)] for row in chunk],
+                             columns=header, dtype=object)
+        errors.extend(validate_csv_frame(frame, first_record))
+        first_record += len(chunk)
+        if len(errors) > max_errors:
+            return errors[:max_errors] + [validation_error(
+                None, None, f'Validation stopped after {max_errors} errors.')]
 
-        # Validate numerical fields
-        if not record_dict.get('latitude'):
-            record_dict['latitude'] = 0.0
+    return errors
 
-        if not record_dict.get('longitude'):
-            record_dict['longitude'] = 0.0
-        try:
-            float(record_dict['farm_size'])
-        except (ValueError, KeyError):
-            errors.append(f'Record {i}: "farm_size" must be a number.')
 
-        try:
-            float(record_dict['latitude'])
-        except (ValueError, KeyError):
-            errors.append(f'Record {i}: "latitude" must be a number.')
+def validate_csv_frame(frame, first_record):
+    records = np.arange(first_record, first_record + len(frame))
+    errors = []
 
-        try:
-            float(record_dict['longitude'])
-        except (ValueError, KeyError):
-            errors.append(f'Record {i}: "longitude" must be a number.')
+    def flag(mask, field, message):
+        errors.extend(validation_error(int(record), field, message)
+                      for record in records[np.asarray(mask, dtype=bool)])
 
-        # Validate polygon field
+    # Validate numerical fields, empty coordinates default to 0
+    flag(pd.to_numeric(frame['farm_size'], errors='coerce').isna(),
+         'farm_size', '"farm_size" must be a number.')
+    for field in ('latitude', 'longitude'):
+        values = frame[field].fillna('')
+        flag(pd.to_numeric(values.mask(values == '', '0'), errors='coerce').isna(),
+             field, f'"{field}" must be a number.')
+
+    # Validate polygon field
+    polygons = frame['polygon'].fillna('').astype(str)
+    present = (polygons != '').to_numpy()
+    unreadable, malformed, invalid = check_polygons(
+        polygons[present].reset_index(drop=True))
+    for mask, message in ((unreadable, '"polygon" must be a valid list.'),
+                          (malformed, 'Should have valid polygon format.'),
+                          (invalid, '"polygon" must be a valid polygon geometry.')):
+        errors.extend(validation_error(int(record), 'polygon', message)
+                      for record in records[present][mask])
+
+    # report the errors of a record together, as they appear in the file
+    return sorted(errors, key=lambda error: error['record'])
+
+
+def polygon_ring(polygon):
+    """
+    The ring of a parsed polygon cell, given as a ring or as a list holding a
+    ring, or None when the cell is not a list of at least 3 points of at least
+    2 coordinates.
+    """
+    if not is_valid_polygon(polygon):
+        return None
+    ring = polygon[0] if isinstance(polygon[0], list) and polygon[0] and isinstance(
+        polygon[0][0], list) else polygon
+    if len(ring) < 3 or not all(isinstance(point, list) and len(point) >= 2 for point in ring):
+        return None
+    return ring
+
+
+def invalid_rings(coords, counts):
+    """
+    Builds the polygons of rings laid out one after the other in coords and
+    returns which of them are not valid geometries, including rings with fewer
+    than 3 distinct corners once closed.
+    """
+    if not len(counts):
+        return np.zeros(0, dtype=bool)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    closed = (coords[starts] == coords[starts + counts - 1]).all(axis=1)
+    usable = counts - closed >= 3
+
+    invalid = ~usable
+    rings = shapely.linearrings(coords[np.repeat(usable, counts)], indices=np.repeat(
+        np.arange(usable.sum()), counts[usable]))
+    invalid[usable] = ~shapely.is_valid(shapely.polygons(rings))
+    return invalid
+
+
+def check_polygons(texts):
+    """
+    Checks the non-empty polygon cells of a chunk. Each cell is parsed with the
+    json parser and its ring flattened into one list of coordinates, which is
+    read into an array once so the polygons of all the rings are checked at
+    once. Returns three masks over the cells: cells that are not JSON lists,
+    lists that are not rings of at least 3 points and rings whose polygon is not
+    a valid geometry.
+    """
+    unreadable = np.zeros(len(texts), dtype=bool)
+    malformed = np.zeros(len(texts), dtype=bool)
+    invalid = np.zeros(len(texts), dtype=bool)
+
+    indexes = []
+    counts = []
+    coordinates = []
+    for i, text in enumerate(texts.tolist()):
         try:
-            polygon = record_dict.get('polygon', '')
-            if polygon:
-                if float(record_dict['farm_size']) >= 4 and not is_valid_polygon(json.loads(polygon)):
-                    errors.append(
-                        f'Record {i}: Should have valid polygon format.')
-                elif not is_valid_polygon(json.loads(polygon)):
-                    errors.append(
-                        f'Record {i}: Should have valid polygon format.')
-        except (ValueError, SyntaxError, KeyError):
-            errors.append(f'Record {i}: "polygon" must be a valid list.')
+            ring = polygon_ring(json.loads(text))
+        except ValueError:
+            unreadable[i] = True
+            continue
+        if ring is None:
+            malformed[i] = True
+        else:
+            indexes.append(i)
+            counts.append(len(ring))
+            # numbers only, keeping the parsed lists alive slows the json parser down
+            coordinates.extend(chain.from_iterable(ring))
+    if not indexes:
+        return unreadable, malformed, invalid
 
-    return errors
+    indexes = np.array(indexes, dtype=np.int64)
+    counts = np.array(counts, dtype=np.int64)
+    # points have at least 2 coordinates, twice as many as points means all are 2D
+    positions = numeric_positions(coordinates, counts.sum())
+    if positions is None:
+        # 3D points or a point that is not numbers, read the rings one by one
+        ring_positions = [numeric_positions([point[:2] for point in polygon_ring(json.loads(texts[i]))])
+                          for i in indexes]
+        numeric = np.array([ring is not None for ring in ring_positions], dtype=bool)
+        malformed[indexes[~numeric]] = True
+        indexes, counts = indexes[numeric], counts[numeric]
+        positions = np.concatenate(
+            [ring for ring in ring_positions if ring is not None] + [np.empty((0, 2))])
+    invalid[indexes] = invalid_rings(positions, counts)
+    return unreadable, malformed, invalid
 
 
-def validate_geojson(data: dict) -> bool:
+def validate_geojson(data, max_errors=MAX_VALIDATION_ERRORS):
+    """
+    Validates a GeoJSON FeatureCollection a chunk of features at a time, with
+    the checks of each chunk run on columns of properties and on the flattened
+    coordinates of all its features at once. The features may be a list or
+    streamed from an upload. Returns at most max_errors errors, ordered by
+    record (the feature position), each as {record, field, message}.
+    """
     errors = []
 
     try:
         if data.get('type') != 'FeatureCollection':
-            errors.append('Invalid GeoJSON type. Must be FeatureCollection')
-        if not isinstance(data.get('features'), list):
-            errors.append('Invalid GeoJSON features. Must be a list')
+            errors.append(validation_error(
+                None, 'type', 'Invalid GeoJSON type. Must be FeatureCollection'))
+        if not isinstance(data.get('features'), (list, UploadedGeoJSONFeatures)):
+            errors.append(validation_error(
+                None, 'features', 'Invalid GeoJSON features. Must be a list'))
     except AttributeError:
-        errors.append('Invalid GeoJSON. Must be a dictionary')
+        errors.append(validation_error(
+            None, None, 'Invalid GeoJSON. Must be a dictionary'))
 
     if len(errors) > 0:
         return errors
 
-    for feature in data['features']:
-        if feature.get('type') != 'Feature':
-            errors.append('Invalid GeoJSON feature. Must be Feature')
-            continue
-        properties = feature.get('properties')
-        if not isinstance(properties, dict):
-            errors.append('Invalid GeoJSON properties. Must be a dictionary')
-            continue
+    first_record = 1
+    for chunk in iter_batches(data['features'], GEOJSON_CHUNK_SIZE):
+        errors.extend(validate_features(chunk, first_record))
+        first_record += len(chunk)
+        if len(errors) > max_errors:
+            return errors[:max_errors] + [validation_error(
+                None, None, f'Validation stopped after {max_errors} errors.')]
+    return errors
+
+
+def validate_features(features, first_record=1):
+    count = len(features)
+    records = np.arange(first_record, first_record + count)
+    errors = []
+
+    def flag(mask, field, message):
+        errors.extend(validation_error(int(record), field, message)
+                      for record in records[mask])
+
+    def column(values):
+        return np.fromiter(values, dtype=bool, count=count)
+
+    is_feature = column(isinstance(feature, dict) and feature.get('type') == 'Feature'
+                        for feature in features)
+    flag(~is_feature, None, 'Invalid GeoJSON feature. Must be Feature')
+
+    properties = [feature.get('properties') if ok else None
+                  for feature, ok in zip(features, is_feature)]
+    has_properties = column(isinstance(value, dict) for value in properties)
+    flag(is_feature & ~has_properties, 'properties',
+         'Invalid GeoJSON properties. Must be a dictionary')
+    properties = [value if ok else {} for value, ok in zip(properties, has_properties)]
+
+    # Check for required properties
+    for prop, prop_type in GEOJSON_PROPERTY_TYPES.items():
+        flag(has_properties & ~column(isinstance(value.get(prop), prop_type) for value in properties),
+             prop, f'Invalid GeoJSON properties. Missing or invalid "{prop}"')
+    farm_sizes = np.array([value.get('farm_size') if isinstance(value.get('farm_size'), (int, float))
+                           else np.nan for value in properties], dtype=float)
+
+    # Check for valid geometry
+    geometries = [feature.get('geometry') if ok else None
+                  for feature, ok in zip(features, has_properties)]
+    has_geometry = column(isinstance(value, dict) for value in geometries)
+    flag(has_properties & ~has_geometry, 'geometry',
+         'Invalid GeoJSON geometry. Must be a dictionary')
+    geometry_types = np.array([geometry.get('type') if ok else None
+                               for geometry, ok in zip(geometries, has_geometry)], dtype=object)
+    known_type = np.isin(geometry_types, GEOJSON_GEOMETRY_TYPES)
+    flag(has_geometry & ~known_type, 'geometry',
+         'Invalid GeoJSON geometry type. Must be Point, Polygon or MultiPolygon')
+
+    flag((farm_sizes >= 4) & (geometry_types == 'Point'), 'farm_size',
+         'Invalid record. Farm size must be less than 4 hectares for a point geometry')
+
+    checks = check_coordinates(
+        [geometry if ok else None for geometry, ok in zip(geometries, known_type)], geometry_types)
+    for name, message in COORDINATE_ERRORS.items():
+        flag(checks[name], 'geometry', message)
+
+    # the errors of a feature stay in the order they were checked in
+    return sorted(errors, key=lambda error: error['record'])
 
-        # Check for required properties
-        required_properties = {
-            'farmer_name': str,
-            'farm_village': str,
-            'farm_district': str,
-            'farm_size': (int, float),
-            'latitude': (int, float),
-            'longitude': (int, float),
-        }
-        for prop, prop_type in required_properties.items():
-            if not isinstance(properties.get(prop), prop_type):
-                errors.append(
-                    f'Invalid GeoJSON properties. Missing or invalid "{prop}"')
-        if len(errors) > 0:
-            return errors
-
-        # Check for valid geometry
-        geometry = feature.get('geometry')
-        if not isinstance(geometry, dict):
-            errors.append('Invalid GeoJSON geometry. Must be a dictionary')
+
+def numeric_positions(positions, count=None):
+    """
+    Returns the positions as an (n, 2) float array, or None unless every one of
+    them is a pair of numbers. With a count of positions, they may also be given
+    as a flat list of their coordinates.
+    """
+    if not len(positions):
+        return np.empty((0, 2))
+    try:
+        array = np.array(positions)
+    except ValueError:
+        return None
+    if count is not None and array.ndim == 1 and array.size == 2 * count:
+        array = array.reshape(-1, 2)
+    if array.ndim != 2 or array.shape[1] != 2 or array.dtype.kind not in 'biuf':
+        return None
+    return array.astype(float)
+
+
+def check_coordinates(geometries, geometry_types):
+    """
+    Checks the coordinates of every Point, Polygon and MultiPolygon geometry at
+    once. The rings of all of them are laid out one after the other in a single
+    array of positions, a point being a ring of one position, on which the
+    length and range checks run. The polygons and multipolygons are then built
+    from that array into one array of shapely geometries, whose validity is
+    checked whatever the size of the farm. Returns a mask over the geometries
+    for each of COORDINATE_ERRORS.
+    """
+    count = len(geometries)
+    checks = {name: np.zeros(count, dtype=bool) for name in COORDINATE_ERRORS}
+    rings = []
+    ring_geometry = []
+    ring_polygon = []
+    for i, geometry in enumerate(geometries):
+        if geometry is None:
             continue
-        geometry_type = geometry.get('type')
         coordinates = geometry.get('coordinates')
-
-        if geometry_type == 'Polygon':
-            if not (isinstance(coordinates, list) and len(coordinates) >= 1):
-                errors.append(
-                    'Invalid GeoJSON coordinates. Must be a list of lists')
-            if not (isinstance(coordinates[0], list) and len(coordinates[0]) >= 4):
-                errors.append(
-                    'Invalid GeoJSON coordinates. Must be a list of lists with at least 4 coordinates')
-            if properties.get('farm_size') >= 4 and not is_valid_polygon(coordinates):
-                errors.append(
-                    'Invalid GeoJSON coordinates. Must be a valid polygon')
-            for coord in coordinates[0]:
-                if not (isinstance(coord, list) and len(coord) == 2):
-                    errors.append(
-                        'Invalid GeoJSON coordinates. Must be a list of lists with 2 coordinates')
-                if not all(isinstance(c, (int, float)) for c in coord):
-                    errors.append(
-                        'Invalid GeoJSON coordinates. Must be a list of lists with numbers')
-        elif geometry_type == 'Point':
-            if not (isinstance(coordinates, list) and len(coordinates) == 2):
-                errors.append(
-                    'Invalid GeoJSON coordinates. Must be a list of 2 numbers')
-            if not all(isinstance(c, (int, float)) for c in coordinates):
-                errors.append(
-                    'Invalid GeoJSON coordinates. Must be a list of numbers')
-            if properties.get('farm_size') >= 4:
-                errors.append(
-                    'Invalid record. Farm size must be less than 4 hectares for a point geometry')
-        elif geometry_type == 'MultiPolygon':
-            if not (isinstance(coordinates, list) and len(coordinates) >= 1):
-                errors.append(
-                    'Invalid GeoJSON coordinates. Must be a list of lists')
-            for polygon in coordinates:
-                if not (isinstance(polygon, list) and len(polygon) >= 1):
-                    errors.append(
-                        'Invalid GeoJSON coordinates. Must be a list of lists')
-                if not (isinstance(polygon[0], list) and len(polygon[0]) >= 4):
-                    errors.append(
-                        'Invalid GeoJSON coordinates. Must be a list of lists with at least 4 coordinates')
-                if properties.get('farm_size') >= 4 and not is_valid_polygon(polygon):
-                    errors.append(
-                        'Invalid GeoJSON coordinates. Must be a valid polygon')
-                for coord in polygon[0]:
-                    if not (isinstance(coord, list) and len(coord) == 2):
-                        errors.append(
-                            'Invalid GeoJSON coordinates. Must be a list of lists with 2 coordinates')
-                    if not all(isinstance(c, (int, float)) for c in coord):
-                        errors.append(
-                            'Invalid GeoJSON coordinates. Must be a list of lists with numbers')
+        if geometry_types[i] == 'Point':
+            polygons = [[[coordinates]]]
+        elif geometry_types[i] == 'Polygon':
+            polygons = [coordinates]
         else:
-            errors.append(
-                'Invalid GeoJSON geometry type. Must be Point or Polygon')
+            polygons = coordinates
+        if not (isinstance(polygons, list) and polygons and all(
+                isinstance(polygon, list) and polygon and all(isinstance(ring, list) for ring in polygon)
+                for polygon in polygons)):
+            checks['not_lists'][i] = True
+            continue
+        for polygon in polygons:
+            rings.extend(polygon)
+            ring_geometry.extend([i] * len(polygon))
+            ring_polygon.extend([len(ring_polygon) and ring_polygon[-1] + 1] * len(polygon))
 
-    return errors
+    ring_geometry = np.array(ring_geometry, dtype=np.int64)
+    ring_polygon = np.array(ring_polygon, dtype=np.int64)
+    positions = numeric_positions([position for ring in rings for position in ring])
+    if positions is None:
+        # look for the rings at fault and go on with the others
+        ring_positions = [numeric_positions(ring) for ring in rings]
+        numeric = np.array([ring is not None for ring in ring_positions], dtype=bool)
+        points = geometry_types[ring_geometry] == 'Point'
+        checks['not_point'][ring_geometry[~numeric & points]] = True
+        checks['not_positions'][ring_geometry[~numeric & ~points]] = True
+        positions = np.concatenate(
+            [ring for ring in ring_positions if ring is not None] + [np.empty((0, 2))])
+        rings = [ring for ring, ok in zip(rings, numeric) if ok]
+        ring_geometry, ring_polygon = ring_geometry[numeric], ring_polygon[numeric]
+    sizes = np.array([len(ring) for ring in rings], dtype=np.int64)
+
+    polygonal = geometry_types[ring_geometry] != 'Point'
+    checks['short'][ring_geometry[polygonal & (sizes < 4)]] = True
+
+    outside = ~((np.abs(positions[:, 0]) <= 180) & (np.abs(positions[:, 1]) <= 90))
+    checks['out_of_range'][np.repeat(ring_geometry, sizes)[outside]] = True
+
+    built = polygonal & ~(checks['not_positions'] | checks['short'] | checks['out_of_range'])[ring_geometry]
+    checks['invalid'] |= invalid_geometries(
+        positions[np.repeat(built, sizes)], sizes[built], ring_polygon[built], ring_geometry[built], count)
+    return checks
+
+
+def invalid_geometries(positions, sizes, ring_polygon, ring_geometry, count):
+    """
+    Builds the polygons of rings laid out one after the other in positions, the
+    first ring of each polygon being its shell, and the multipolygons of the
+    polygons of each geometry, all in one array of shapely geometries. Returns a
+    mask over the count geometries of those that are not valid, including those
+    with a ring of fewer than 3 distinct corners once closed.
+    """
+    invalid = np.zeros(count, dtype=bool)
+    if not len(sizes):
+        return invalid
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    closed = (positions[starts] == positions[starts + sizes - 1]).all(axis=1)
+    degenerate = sizes - closed < 3
+    invalid[ring_geometry[degenerate]] = True
+
+    usable = ~invalid[ring_geometry]
+    rings = shapely.linearrings(positions[np.repeat(usable, sizes)], indices=np.repeat(
+        np.arange(usable.sum()), sizes[usable]))
+    polygon_ids, ring_polygon = np.unique(ring_polygon[usable], return_inverse=True)
+    polygons = shapely.polygons(rings, indices=ring_polygon)
+    geometry_ids, polygon_geometry = np.unique(
+        ring_geometry[usable][np.searchsorted(ring_polygon, np.arange(len(polygon_ids)))],
+        return_inverse=True)
+    invalid[geometry_ids] = ~shapely.is_valid(shapely.multipolygons(polygons, indices=polygon_geometry))
+    return invalid
@@ -1,27 +1,34 @@
 import json
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from datetime import datetime
 from django.utils import timezone
 import pandas as pd
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
+from rest_framework.decorators import api_view, parser_classes, permission_classes, authentication_classes
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
 from asgiref.sync import async_to_sync
 from django.contrib.auth.models import User
-import boto3
-from shapely import Polygon
-from eudr_backend import settings
-from eudr_backend.async_tasks import async_create_farm_data
-from eudr_backend.models import EUDRCollectionSiteModel, EUDRFarmBackupModel, EUDRSharedMapAccessCodeModel, EUDRFarmModel, EUDRUploadedFilesModel
+from eudr_backend.async_tasks import async_create_farm_data, async_create_farm_data_from_features, geometry_changed
+from eudr_backend.earth_engine import earth_engine_session
+from eudr_backend.dashboard import dashboard_totals, mark_deleted_rows
+from eudr_backend.farm_queries import farm_detail, file_farms, overlapping_farms, visible_farms
+from eudr_backend.models import EUDRCollectionSiteModel, EUDRFarmBackupModel, EUDRIngestionJobModel, EUDRSharedMapAccessCodeModel, EUDRFarmModel, EUDRUploadedFilesModel
+from eudr_backend.overlaps import update_farm_overlaps
+from eudr_backend.pagination import LIST_QUERY_PARAMETERS, list_response
 from datetime import timedelta
-from eudr_backend.tasks import update_geoid
-from eudr_backend.util_classes import IsSuperUser
-from eudr_backend.utils import extract_data_from_file, flatten_multipolygon_coordinates, generate_access_code, handle_failed_file_entry, store_file_in_s3, transform_csv_to_json, transform_db_data_to_geojson
+from eudr_backend.tiles import MAX_ZOOM, farm_tile
+from eudr_backend.s3_objects import aware, day_bounds, s3_file_url, s3_files
+from eudr_backend.tasks import process_ingestion_job, schedule_dashboard_metrics_refresh, schedule_geoid_registration, schedule_s3_index_crawl
+from eudr_backend.sync import RESTORE_PAGE_SIZE, parse_watermark, restore_backups, stream_restore, sync_backups
+from eudr_backend.util_classes import GzipJSONParser, IsSuperUser
+from eudr_backend.utils import VECTOR_FILE_FORMATS, extract_data_from_file, generate_access_code, handle_failed_file_entry, iter_csv_features, serialize_payload_to_file, store_file_in_s3, store_job_upload, transform_db_data_to_geojson
 from eudr_backend.validators import validate_csv, validate_geojson
 from .serializers import (
     EUDRCollectionSiteModelSerializer,
     EUDRFarmBackupModelSerializer,
     EUDRFarmModelSerializer,
+    EUDRIngestionJobModelSerializer,
     EUDRUploadedFilesModelSerializer,
     EUDRUserModelSerializer,
 )
@@ -391,6 +398,7 @@ def delete_user(request, pk):
 
     try:
         user = User.objects.get(id=pk)
+        mark_deleted_rows(User.objects.filter(id=pk))
         user.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
     except User.DoesNotExist:
@@ -503,7 +511,30 @@ def delete_user(request, pk):
             },
         },
     ),
+    manual_parameters=[openapi.Parameter(
+        name="async",
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_BOOLEAN,
+        required=False,
+        description="Queue the upload for background processing and return a job ID",
+    )],
     responses={
+        202: openapi.Response(
+            description="File/data queued for processing",
+            schema=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "message": openapi.Schema(type=openapi.TYPE_STRING),
+                    "job_id": openapi.Schema(type=openapi.TYPE_INTEGER),
+                },
+            ),
+            examples={
+                "application/json": {
+                    "message": "File/data queued for processing",
+                    "job_id": 1,
+                },
+            },
+        ),
         201: openapi.Response(
             description="File/data processed successfully",
             schema=openapi.Schema(
@@ -556,28 +587,54 @@ def create_farm_data(request):
     if file:
         file_name = file.name.split('.')[0]
         # Custom function to read data from file if needed
-        raw_data = extract_data_from_file(file, data_format)
+        try:
+            raw_data = extract_data_from_file(file, data_format)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        # CSV and GeoJSON files are handed to background jobs as they are
+        upload = file
+        if data_format in VECTOR_FILE_FORMATS:
+            data_format = 'geojson'
+            upload = None
     else:
         file_name = "uploaded_data"
+        upload = None
 
     # Validate the format
     if not data_format or not raw_data:
         return Response({'error': 'Format and data are required'}, status=status.HTTP_400_BAD_REQUEST)
-    elif data_format == 'geojson':
-        errors = validate_geojson(raw_data)
-    elif data_format == 'csv':
-        errors = validate_csv(raw_data)
-    else:
+    elif data_format not in ['geojson', 'csv']:
         return Response({'error': 'Unsupported format'}, status=status.HTTP_400_BAD_REQUEST)
 
+    # Hand the validate -> analyse -> save pipeline over to the background worker
+    run_in_background = request.query_params.get('async') or (
+        request.data.get('async') if isinstance(request.data, dict) else None)
+    if str(run_in_background).lower() in ['true', '1']:
+        job = EUDRIngestionJobModel.objects.create(
+            file_name=f"{file_name}.{data_format}",
+            data_format=data_format,
+            uploaded_by=request.user.username if request.user.is_authenticated else "admin",
+            from_file=bool(file),
+            upload_key=store_job_upload(
+                upload or serialize_payload_to_file(raw_data, data_format), data_format),
+        )
+        process_ingestion_job(job.id)
+        return Response({'message': 'File/data queued for processing', 'job_id': job.id}, status=status.HTTP_202_ACCEPTED)
+
+    try:
+        if data_format == 'geojson':
+            errors = validate_geojson(raw_data)
+        else:
+            errors = validate_csv(raw_data)
+    except ValueError as e:
+        # streamed GeoJSON uploads are only read to the end while validating
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
     if errors:
         # Custom function to handle S3 upload
         store_file_in_s3(file, request.user, file_name)
         return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
 
-    if data_format == 'csv':
-        raw_data = transform_csv_to_json(raw_data)
-
     # Combine file_name and format for database entry
     file_data = {
         "file_name": f"{file_name}.{data_format}",
@@ -596,8 +653,11 @@ def create_farm_data(request):
             uploaded_by=request.user.username if request.user.is_authenticated else "admin"
         ).id
 
-        errors, _ = async_to_sync(async_create_farm_data)(
-            raw_data, file_id)
+        # stream the rows through analysis and saving batch by batch
+        features = iter_csv_features(
+            raw_data) if data_format == 'csv' else raw_data.get('features', [])
+        errors, _ = async_to_sync(async_create_farm_data_from_features)(
+            features, file_id, owner=request.user)
         if errors:
             # Custom function to handle failed file entries
             handle_failed_file_entry(file_serializer, file, request.user)
@@ -608,12 +668,79 @@ def create_farm_data(request):
         return Response({'error': 'File serialization failed'}, status=status.HTTP_400_BAD_REQUEST)
 
     # Proceed with other operations...
-    update_geoid(repeat=60,
-                 user_id=request.user.username if request.user.is_authenticated else "admin")
+    schedule_geoid_registration(
+        request.user.username if request.user.is_authenticated else "admin")
     store_file_in_s3(file, request.user, file_name, True) if file else None
     return Response({'message': 'File/data processed successfully', 'file_id': file_id}, status=status.HTTP_201_CREATED)
 
 
+@swagger_auto_schema(
+    method="get",
+    operation_summary="Retrieve farm data upload job status",
+    responses={
+        200: openapi.Response(
+            description="Upload job retrieved successfully",
+            schema=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "id": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    "file_name": openapi.Schema(type=openapi.TYPE_STRING),
+                    "file_id": openapi.Schema(type=openapi.TYPE_STRING),
+                    "status": openapi.Schema(type=openapi.TYPE_STRING),
+                    "stage": openapi.Schema(type=openapi.TYPE_STRING),
+                    "rows_parsed": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    "chunks_total": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    "chunks_analysed": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    "rows_saved": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    "errors": openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                },
+            ),
+            examples={
+                "application/json": {
+                    "id": 1,
+                    "file_name": "farms.csv",
+                    "file_id": "1",
+                    "status": "RUNNING",
+                    "stage": "ANALYSING",
+                    "rows_parsed": 20000,
+                    "chunks_total": 40,
+                    "chunks_analysed": 12,
+                    "rows_saved": 0,
+                    "errors": [],
+                },
+            },
+        ),
+        404: openapi.Response(
+            description="Job not found",
+            schema=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "error": openapi.Schema(type=openapi.TYPE_STRING),
+                },
+            ),
+            examples={
+                "application/json": {
+                    "error": "Job not found",
+                },
+            },
+        ),
+    },
+    tags=["Farm Data Management"]
+)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def retrieve_farm_data_job(request, pk):
+    try:
+        job = EUDRIngestionJobModel.objects.get(id=pk)
+        # only staff or the uploader can follow a job
+        if not request.user.is_staff and job.uploaded_by != request.user.username:
+            raise EUDRIngestionJobModel.DoesNotExist
+        serializer = EUDRIngestionJobModelSerializer(job, many=False)
+        return Response(serializer.data)
+    except EUDRIngestionJobModel.DoesNotExist:
+        return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+
 @swagger_auto_schema(
     method="post",
     operation_summary="Sync farm data",
@@ -654,9 +781,16 @@ def create_farm_data(request):
                                 )
                             ),
                             "polygon_type": openapi.Schema(type=openapi.TYPE_STRING),
+                            "content_hash": openapi.Schema(
+                                type=openapi.TYPE_STRING,
+                                description="SHA-256 of the farm values, farms whose hash did not change are not written"),
                         },
                     ),
                 ),
+                "deleted_remote_ids": openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(type=openapi.TYPE_STRING),
+                    description="Farms deleted on the device since its last sync"),
             },
             default={
                 "device_id": "device_1",
@@ -693,11 +827,18 @@ def create_farm_data(request):
                         type=openapi.TYPE_ARRAY,
                         items=openapi.Schema(type=openapi.TYPE_STRING)
                     ),
+                    "deleted_remote_ids": openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(type=openapi.TYPE_STRING)
+                    ),
+                    "watermark": openapi.Schema(type=openapi.TYPE_STRING),
                 },
             ),
             examples={
                 "application/json": {
                     "synced_remote_ids": ["farm_1", "farm_2"],
+                    "deleted_remote_ids": [],
+                    "watermark": "2024-01-01T00:00:00+00:00",
                 },
             },
         ),
@@ -719,29 +860,16 @@ def create_farm_data(request):
     tags=["Farm Data Management"]
 )
 @api_view(["POST"])
+@parser_classes([GzipJSONParser, FormParser, MultiPartParser])
 def sync_farm_data(request):
-    sync_results = []
-    data = request.data
-    for entry in data:
-        # Check or create collection site
-        site_data = entry.get('collection_site')
-        # append device_id to site_data
-        site_data['device_id'] = entry.get("device_id")
-        site, created = EUDRCollectionSiteModel.objects.update_or_create(
-            name=site_data['name'],
-            defaults=site_data
-        )
-
-        # Sync farms
-        for farm_data in entry.get('farms', []):
-            farm_data['site_id'] = site
-            farm, farm_created = EUDRFarmBackupModel.objects.update_or_create(
-                remote_id=farm_data.get('remote_id'),
-                defaults=farm_data
-            )
-            sync_results.append(farm.remote_id)
+    if not isinstance(request.data, list):
+        return Response({'error': 'A list of device backups is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        sync_results = sync_backups(request.data)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    return Response({"synced_remote_ids": sync_results}, status=status.HTTP_200_OK)
+    return Response(sync_results, status=status.HTTP_200_OK)
 
 
 @swagger_auto_schema(
@@ -753,6 +881,11 @@ def sync_farm_data(request):
             "device_id": openapi.Schema(type=openapi.TYPE_STRING),
             "phone_number": openapi.Schema(type=openapi.TYPE_STRING),
             "email": openapi.Schema(type=openapi.TYPE_STRING),
+            "since": openapi.Schema(
+                type=openapi.TYPE_STRING,
+                description="Watermark of the last restore or sync. When since, cursor or page_size is given the response is a page: {watermark, next, results, deleted}"),
+            "cursor": openapi.Schema(type=openapi.TYPE_STRING, description="Cursor of the page to fetch, taken from next"),
+            "page_size": openapi.Schema(type=openapi.TYPE_INTEGER, description="Farms per page (max 2000)"),
         },
         default={
             "device_id": "device_1",
@@ -843,7 +976,7 @@ def restore_farm_data(request):
     phone_number = request.data.get("phone_number")
     email = request.data.get("email")
 
-    collection_sites = []
+    collection_sites = EUDRCollectionSiteModel.objects.none()
 
     # Query based on priority: device_id, phone_number, or email
     if device_id:
@@ -855,25 +988,18 @@ def restore_farm_data(request):
     elif email:
         collection_sites = EUDRCollectionSiteModel.objects.filter(email=email)
 
-    if not collection_sites:
-        return Response([], status=status.HTTP_200_OK)
-
-    # Prepare the restore data in the required format
-    restore_data = []
-
-    for site in collection_sites:
-        # Fetch all farms linked to this collection site
-        farms = EUDRFarmBackupModel.objects.filter(site_id=site.id)
-        farm_data = EUDRFarmBackupModelSerializer(farms, many=True).data
-
-        # Construct the structure with the collection site and farms
-        restore_data.append({
-            "device_id": site.device_id,
-            "collection_site": EUDRCollectionSiteModelSerializer(site).data,
-            "farms": farm_data
-        })
+    # delta restores: the rows changed since a watermark, a page at a time
+    if any(key in request.data for key in ('since', 'cursor', 'page_size')):
+        try:
+            since = parse_watermark(request.data['since']) if request.data.get('since') else None
+            page = restore_backups(collection_sites, since=since, cursor=request.data.get('cursor'),
+                                   page_size=int(request.data.get('page_size') or RESTORE_PAGE_SIZE))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(page, status=status.HTTP_200_OK)
 
-    return Response(restore_data, status=status.HTTP_200_OK)
+    # sites are sent as soon as their farms were read
+    return StreamingHttpResponse(stream_restore(collection_sites), content_type='application/json')
 
 
 @swagger_auto_schema(
@@ -991,7 +1117,15 @@ def update_farm_data(request, pk):
     serializer = EUDRFarmModelSerializer(instance=farm_data, data=request.data)
 
     if serializer.is_valid():
-        serializer.save()
+        has_new_geometry = geometry_changed(
+            farm_data, serializer.validated_data)
+        try:
+            serializer.save()
+        except ValueError as e:
+            # a file_id naming a file whose uploader is not a user
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if has_new_geometry:
+            update_farm_overlaps([farm_data.id])
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -1060,9 +1194,10 @@ def revalidate_farm_data(request):
     # combine file_name and format to save in the database with dummy uploaded_by. then retrieve the file_id
     if (serializer.data):
         errors, created_data = async_to_sync(async_create_farm_data)(
-            raw_data, file_id)
+            raw_data, file_id, owner=request.user)
         if errors:
             # delete the file if there are errors
+            mark_deleted_rows(EUDRUploadedFilesModel.objects.filter(id=file_id))
             EUDRUploadedFilesModel.objects.get(id=file_id).delete()
             return Response(errors, status=status.HTTP_400_BAD_REQUEST)
     else:
@@ -1073,6 +1208,7 @@ def revalidate_farm_data(request):
 
 @swagger_auto_schema(
     method="get",
+    manual_parameters=LIST_QUERY_PARAMETERS,
     operation_summary="Retrieve farm data",
     responses={
         200: openapi.Response(
@@ -1109,18 +1245,7 @@ def revalidate_farm_data(request):
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def retrieve_farm_data(request):
-    files = EUDRUploadedFilesModel.objects.filter(
-        uploaded_by=request.user.username if request.user.is_authenticated else "admin"
-    ) if not request.user.is_staff else EUDRUploadedFilesModel.objects.all()
-    filesSerializer = EUDRUploadedFilesModelSerializer(files, many=True)
-
-    data = EUDRFarmModel.objects.filter(
-        file_id__in=[file["id"] for file in filesSerializer.data]
-    ).order_by("-updated_at")
-
-    serializer = EUDRFarmModelSerializer(data, many=True)
-
-    return Response(serializer.data)
+    return list_response(request, visible_farms(request.user), EUDRFarmModelSerializer)
 
 
 @swagger_auto_schema(
@@ -1155,44 +1280,31 @@ def retrieve_farm_data(request):
                 ),
             ),
         ),
+        404: openapi.Response(description="File not found"),
     },
     tags=["Farm Data Management"]
 )
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def retrieve_overlapping_farm_data(request, pk):
-    files = EUDRUploadedFilesModel.objects.filter(
-        id=pk) if not request.user.is_staff else EUDRUploadedFilesModel.objects.all()
-
-    filesSerializer = EUDRUploadedFilesModelSerializer(files, many=True)
-
-    farms = EUDRFarmModel.objects.filter(
-        file_id=filesSerializer.data[0].get("id")
-    ).order_by("-updated_at")
-
+    overlapping = overlapping_farms(pk)
+    if overlapping is None:
+        return Response({'message': 'File does not exist'}, status=status.HTTP_404_NOT_FOUND)
+    farms, overlaps_by_farm = overlapping
     farmSerializer = EUDRFarmModelSerializer(farms, many=True)
 
     overLaps = []
-    farms = farmSerializer.data
-
-    for farm in farms:
-        # Assuming farm data has 'farmer_name', 'latitude', 'longitude', 'farm_size', and 'polygon' fields
-        polygon = flatten_multipolygon_coordinates(
-            farm['polygon']) if farm['polygon_type'] == 'MultiPolygon' else farm['polygon']
-        if 'polygon' in farm and len(polygon) == 1:
-            polygon = flatten_multipolygon_coordinates(farm['polygon'])
-
-            if polygon:
-                farm_polygon = Polygon(polygon[0])
-                is_overlapping = any(farm_polygon.overlaps(
-                    Polygon(other_farm['polygon'][0])) for other_farm in farms)
-                overLaps.append(farm) if is_overlapping else None
+    for farm in farmSerializer.data:
+        if farm['id'] in overlaps_by_farm:
+            overLaps.append(
+                {**farm, "overlaps": overlaps_by_farm[farm['id']]})
 
     return Response(overLaps)
 
 
 @swagger_auto_schema(
     method="get",
+    manual_parameters=LIST_QUERY_PARAMETERS,
     operation_summary="Retrieve user farm data",
     responses={
         200: openapi.Response(
@@ -1229,23 +1341,14 @@ def retrieve_overlapping_farm_data(request, pk):
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def retrieve_user_farm_data(request, pk):
-    users = User.objects.filter(id=pk)
-    files = EUDRUploadedFilesModel.objects.filter(
-        uploaded_by=users.values()[0].get("username")
-    )
-    filesSerializer = EUDRUploadedFilesModelSerializer(files, many=True)
-
-    data = EUDRFarmModel.objects.filter(
-        file_id__in=[file["id"] for file in filesSerializer.data]
-    ).order_by("-updated_at")
+    data = EUDRFarmModel.objects.filter(owner_id=pk).order_by("-updated_at")
 
-    serializer = EUDRFarmModelSerializer(data, many=True)
-
-    return Response(serializer.data)
+    return list_response(request, data, EUDRFarmModelSerializer)
 
 
 @swagger_auto_schema(
     method="get",
+    manual_parameters=LIST_QUERY_PARAMETERS,
     operation_summary="Retrieve all synced farm data",
     responses={
         200: openapi.Response(
@@ -1284,9 +1387,7 @@ def retrieve_user_farm_data(request, pk):
 def retrieve_all_synced_farm_data(request):
     data = EUDRFarmBackupModel.objects.all().order_by("-updated_at")
 
-    serializer = EUDRFarmBackupModelSerializer(data, many=True)
-
-    return Response(serializer.data)
+    return list_response(request, data, EUDRFarmBackupModelSerializer)
 
 
 @swagger_auto_schema(
@@ -1396,6 +1497,7 @@ def retrieve_collection_sites(request):
 
 @swagger_auto_schema(
     method="get",
+    manual_parameters=LIST_QUERY_PARAMETERS,
     operation_summary="Retrieve map data",
     responses={
         200: openapi.Response(
@@ -1432,18 +1534,7 @@ def retrieve_collection_sites(request):
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def retrieve_map_data(request):
-    files = EUDRUploadedFilesModel.objects.filter(
-        uploaded_by=request.user.username if request.user.is_authenticated else "admin"
-    )
-    filesSerializer = EUDRUploadedFilesModelSerializer(files, many=True)
-
-    data = EUDRFarmModel.objects.filter(
-        file_id__in=[file["id"] for file in filesSerializer.data]
-    ).order_by("-updated_at") if not request.user.is_staff else EUDRFarmModel.objects.all().order_by("-updated_at")
-
-    serializer = EUDRFarmModelSerializer(data, many=True)
-
-    return Response(serializer.data)
+    return list_response(request, visible_farms(request.user), EUDRFarmModelSerializer)
 
 
 @swagger_auto_schema(
@@ -1495,12 +1586,111 @@ def retrieve_map_data(request):
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def retrieve_farm_detail(request, pk):
-    try:
-        data = EUDRFarmModel.objects.get(id=pk)
-        serializer = EUDRFarmModelSerializer(data, many=False)
-        return Response(serializer.data)
-    except EUDRFarmModel.DoesNotExist:
+    data = farm_detail(pk)
+    if data is None:
         return Response({'message': 'Farm does not exist'}, status=status.HTTP_404_NOT_FOUND)
+    serializer = EUDRFarmModelSerializer(data, many=False)
+    return Response(serializer.data)
+
+
+@swagger_auto_schema(
+    method="get",
+    operation_summary="Retrieve a map tile of farm geometries",
+    operation_description="GeoJSON tile (XYZ, web mercator) of the farms drawn by a map, by default those visible to the user, simplified for the zoom level. Plots are sent as points below zoom 12. Farm details are loaded with the farm detail endpoint.",
+    manual_parameters=[
+        openapi.Parameter(name="file-id", in_=openapi.IN_QUERY, type=openapi.TYPE_STRING, required=False,
+                          description="Only the farms of this file"),
+        openapi.Parameter(name="farm-id", in_=openapi.IN_QUERY, type=openapi.TYPE_INTEGER, required=False,
+                          description="Only this farm"),
+        openapi.Parameter(name="overlaps", in_=openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN, required=False,
+                          description="Only the overlapping farms of the file"),
+        openapi.Parameter(name="v", in_=openapi.IN_QUERY, type=openapi.TYPE_STRING, required=False,
+                          description="Version of the farms the map was loaded with"),
+    ],
+    responses={
+        200: openapi.Response(
+            description="Farm tile retrieved successfully",
+            schema=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "type": openapi.Schema(type=openapi.TYPE_STRING),
+                    "features": openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                "id": openapi.Schema(type=openapi.TYPE_INTEGER),
+                                "geometry": openapi.Schema(type=openapi.TYPE_OBJECT),
+                                "properties": openapi.Schema(
+                                    type=openapi.TYPE_OBJECT,
+                                    properties={
+                                        "id": openapi.Schema(type=openapi.TYPE_INTEGER),
+                                        "eudr_risk_level": openapi.Schema(type=openapi.TYPE_STRING),
+                                        "overlapping": openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                                    },
+                                ),
+                            },
+                        ),
+                    ),
+                },
+            ),
+        ),
+        404: openapi.Response(
+            description="Tile does not exist",
+            schema=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "message": openapi.Schema(type=openapi.TYPE_STRING),
+                },
+            ),
+        ),
+    },
+    tags=["Farm Data Management"]
+)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def retrieve_farm_tile(request, z, x, y):
+    if z > MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return Response({'message': 'Tile does not exist'}, status=status.HTTP_404_NOT_FOUND)
+
+    farm_id = request.GET.get('farm-id')
+    return Response(farm_tile(
+        request.user, z, x, y, file_id=request.GET.get('file-id'),
+        farm_id=int(farm_id) if farm_id and farm_id.isdigit() else None,
+        overlaps_only=request.GET.get('overlaps') == 'true', version=request.GET.get('v')))
+
+
+@swagger_auto_schema(
+    method="get",
+    operation_summary="Retrieve the Earth Engine session health and initialization metrics",
+    responses={
+        200: openapi.Response(
+            description="Earth Engine session metrics",
+            schema=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "initialized": openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                    "initializations": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    "failures": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    "last_initialized_at": openapi.Schema(type=openapi.TYPE_NUMBER),
+                    "last_initialization_ms": openapi.Schema(type=openapi.TYPE_NUMBER),
+                    "average_initialization_ms": openapi.Schema(type=openapi.TYPE_NUMBER),
+                    "last_error": openapi.Schema(type=openapi.TYPE_STRING),
+                },
+            ),
+        ),
+        403: openapi.Response(description="Only superusers can read the session metrics"),
+        503: openapi.Response(description="The last Earth Engine initialization failed"),
+    },
+    tags=["Farm Data Management"]
+)
+@api_view(["GET"])
+@permission_classes([IsSuperUser])
+def retrieve_earth_engine_health(request):
+    metrics = earth_engine_session.metrics()
+    if metrics['last_error']:
+        return Response(metrics, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response(metrics)
 
 
 @swagger_auto_schema(
@@ -1556,7 +1746,7 @@ def retrieve_farm_detail(request, pk):
 @permission_classes([IsAuthenticated])
 def retrieve_farm_data_from_file_id(request, pk):
     try:
-        data = EUDRFarmModel.objects.filter(file_id=pk)
+        data = file_farms(pk)
         serializer = EUDRFarmModelSerializer(data, many=True)
         return Response(serializer.data)
     except EUDRFarmModel.DoesNotExist:
@@ -1672,30 +1862,9 @@ def retrieve_files(request):
 @permission_classes([IsAuthenticated])
 def retrieve_s3_files(request):
     try:
-        # Retrieve all files from all directories in the S3 bucket
-        s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
-        response = s3.list_objects_v2(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
-        # get file urls and date uploaded
-        files = []
-        count = 0
-        for content in response.get('Contents', []):
-            file = {
-                'id': count,
-                'file_name': content.get('Key').split("/")[1].split("_", 1)[1],
-                'last_modified': content.get('LastModified'),
-                'size': content.get('Size') / 1024,
-                'url': f"{settings.AWS_S3_BASE_URL}{content.get('Key')}",
-                'uploaded_by': content.get('Key').split("/")[1].split("_")[0],
-                'category': content.get('Key').split("/")[0],
-            }
-            files.append(file)
-            count += 1
-        
-        # Sort files by 'last_modified' in descending order (newest first)
-        files.sort(key=lambda x: x['last_modified'], reverse=True)
-
-        return Response(files)
+        # files of the local index of the bucket, newest first
+        schedule_s3_index_crawl()
+        return Response(s3_file_list(s3_files()))
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -1972,39 +2141,29 @@ def filter_backup(request):
     return JsonResponse(data_list, safe=False)
 
 
+def s3_file_list(files):
+    """Formats indexed S3 files for the file listings"""
+    return [{
+        'id': count,
+        'file_name': file['file_name'],
+        'last_modified': file['last_modified'],
+        'size': file['size'] / 1024,
+        'url': s3_file_url(file['key']),
+        'uploaded_by': file['uploaded_by'],
+        'category': file['category'],
+    } for count, file in enumerate(files)]
+
+
 def get_filtered_files_uploaded(start_date, end_date):
-    """Retrieve files uploaded within a specific date range in the S3 bucket"""
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
-    )
-    
-    response = s3.list_objects_v2(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
-    filtered_files = []
-
-    for content in response.get('Contents', []):
-        last_modified = content.get('LastModified')
-
-        # Convert S3 LastModified to datetime and check if it's within range
-        if start_date <= last_modified.replace(tzinfo=None) <= end_date:
-            key_parts = content.get('Key', '').split("/")
-            if len(key_parts) < 2:
-                continue  # Skip files that do not match expected folder structure
-            
-            file_parts = key_parts[1].split("_", 1)
-            if len(file_parts) < 2:
-                continue  # Skip files without the expected filename format
-
-            file_info = {
-                'file_name': file_parts[1],
-                'last_modified': last_modified.strftime("%Y-%m-%d %H:%M:%S"),
-                'size': round(content.get('Size', 0) / 1024, 2),  # Convert bytes to KB
-                'url': f"{settings.AWS_S3_BASE_URL}{content.get('Key')}",
-                'uploaded_by': file_parts[0],
-                'category': key_parts[0],
-            }
-            filtered_files.append(file_info)
+    """Retrieve files uploaded within a specific date range from the S3 object index"""
+    filtered_files = [{
+        'file_name': file['file_name'],
+        'last_modified': file['last_modified'].strftime("%Y-%m-%d %H:%M:%S"),
+        'size': round(file['size'] / 1024, 2),  # Convert bytes to KB
+        'url': s3_file_url(file['key']),
+        'uploaded_by': file['uploaded_by'],
+        'category': file['category'],
+    } for file in s3_files(aware(start_date), aware(end_date))]
 
     return len(filtered_files), filtered_files  # Return count & list
 
@@ -2027,33 +2186,25 @@ def filter_dashboard_metrics(request):
     except ValueError:
         return JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=400)
 
-    # Filter metrics based on the date range
-    total_farms = EUDRFarmModel.objects.filter(created_at__range=(start_date, end_date)).count()
-    total_files_uploaded = EUDRUploadedFilesModel.objects.filter(created_at__range=(start_date, end_date)).count()
-    total_users = User.objects.filter(date_joined__range=(start_date, end_date)).count()
-    total_backups = EUDRCollectionSiteModel.objects.filter(created_at__range=(start_date, end_date)).count()
-    # Get total filtered file uploads from json response
-    # ✅ Get total count & list of filtered files
-    all_files_uploaded, files_uploaded = get_filtered_files_uploaded(start_date, end_date)
-
-
-    # Calculate low risk rate (example logic)
-    low_risk_plots = EUDRFarmModel.objects.filter(
-        created_at__range=(start_date, end_date),
-        analysis__EUDR_risk="low"
-    ).count()
+    # the counts are sums of the daily rollups, kept up to date by periodic tasks
+    schedule_dashboard_metrics_refresh()
+    schedule_s3_index_crawl()
+    totals = dashboard_totals(start_date.date(), end_date.date())
+    total_farms = totals['farms']
+    # list of the files of the S3 object index
+    _, files_uploaded = get_filtered_files_uploaded(start_date, end_date)
 
-    low_farms_rate = (low_risk_plots / total_farms * 100) if total_farms > 0 else 0
+    low_farms_rate = (totals['low_risk_farms'] / total_farms * 100) if total_farms > 0 else 0
 
     # Return filtered metrics as JSON
     return JsonResponse({
         'total_farms': total_farms,
-        'total_files_uploaded': total_files_uploaded,
+        'total_files_uploaded': totals['files'],
         'low_farms_rate': round(low_farms_rate, 2),
-        'total_users': total_users,
-        'all_files_uploaded': all_files_uploaded,
+        'total_users': totals['users'],
+        'all_files_uploaded': totals['s3_objects'],
         'files_uploaded': files_uploaded,
-        'total_backups': total_backups,
+        'total_backups': totals['backups'],
     })
 
 
@@ -2077,23 +2228,13 @@ def filter_total_plots(request):
     except ValueError:
         return JsonResponse({'error': 'Invalid date format. Use ISO format (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)'}, status=400)
     
-    # Get files uploaded by the user (or all if the user is staff)
-    if request.user.is_authenticated:
-        if request.user.is_staff:
-            files = EUDRUploadedFilesModel.objects.all()
-        else:
-            files = EUDRUploadedFilesModel.objects.filter(uploaded_by=request.user.username)
-    else:
-        files = EUDRUploadedFilesModel.objects.filter(uploaded_by="admin")
-    
-    files_serializer = EUDRUploadedFilesModelSerializer(files, many=True)
-    file_ids = [file["id"] for file in files_serializer.data]
-    
-    # Filter farm data based on file IDs and date range
-    filtered_data = EUDRFarmModel.objects.filter(
-        file_id__in=file_ids,
-        created_at__date__gte=start_date,
-        created_at__date__lte=end_date
+    # Filter the farms of the user's files (or all if the user is staff) by date range
+    # compare created_at against datetimes rather than its date so the index is used
+    filtered_data = EUDRFarmModel.objects.visible_to(request.user).filter(
+        created_at__gte=timezone.make_aware(
+            datetime.combine(start_date, datetime.min.time())),
+        created_at__lt=timezone.make_aware(
+            datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
     ).values('created_at', 'id', 'updated_at')
 
     # Convert QuerySet to list for JSON serialization
@@ -2121,31 +2262,9 @@ def filter_total_files(request):
         return JsonResponse({'error': 'Invalid date format. Use ISO format (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)'}, status=400)
 
     try:
-        # Retrieve all files from S3 bucket
-        s3 = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                          aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
-        response = s3.list_objects_v2(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
-        files = []
-        count = 0
-        for content in response.get('Contents', []):
-            # Extract file metadata
-            last_modified = content.get('LastModified').date()  # Convert to date for filtering
-            if start_date <= last_modified <= end_date:
-                file = {
-                    'id': count,
-                    'file_name': content.get('Key').split("/")[1].split("_", 1)[1],
-                    'last_modified': content.get('LastModified'),
-                    'size': content.get('Size') / 1024,
-                    'url': f"{settings.AWS_S3_BASE_URL}{content.get('Key')}",
-                    'uploaded_by': content.get('Key').split("/")[1].split("_")[0],
-                    'category': content.get('Key').split("/")[0],
-                }
-                files.append(file)
-                count += 1
-        # Sort files by 'last_modified' in descending order (newest first)
-        files.sort(key=lambda x: x['last_modified'], reverse=True)
-        # return filtered files only
-        return Response(files)
+        # files of the local index of the bucket modified between the two days, newest first
+        schedule_s3_index_crawl()
+        return Response(s3_file_list(s3_files(*day_bounds(start_date, end_date))))
 
     
     except Exception as e:
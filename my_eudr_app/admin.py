@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from eudr_backend.models import EUDRCollectionSiteModel, EUDRFarmBackupModel, EUDRSharedMapAccessCodeModel, EUDRUploadedFilesModel,  WhispAPISetting, EUDRFarmModel
+from eudr_backend.models import DashboardDailyMetricsModel, EUDRCollectionSiteModel, EUDRFarmBackupModel, EUDRFarmBackupTombstoneModel, EUDRFarmOverlapModel, EUDRIngestionJobModel, EUDRSharedMapAccessCodeModel, EUDRUploadedFilesModel, S3ObjectModel, WhispAPISetting, WhispAnalysisCacheModel, EUDRFarmModel
 
 admin.site.register(
     [
@@ -8,7 +8,13 @@ admin.site.register(
         EUDRUploadedFilesModel,
         EUDRCollectionSiteModel,
         EUDRFarmBackupModel,
+        EUDRFarmBackupTombstoneModel,
         EUDRSharedMapAccessCodeModel,
-        WhispAPISetting
+        EUDRIngestionJobModel,
+        EUDRFarmOverlapModel,
+        WhispAPISetting,
+        WhispAnalysisCacheModel,
+        DashboardDailyMetricsModel,
+        S3ObjectModel
     ]
 )
@@ -298,3 +298,16 @@ def combine_disturbances_after_2020_images():
     radd_after_2020 = radd_after_2020_prep()
 
     return tmf_deg_after_2020.addBands(tmf_def_after_2020).addBands(gfc_loss_after_2020).addBands(modis_fire_after_2020).addBands(radd_after_2020)
+
+# Protected areas (WDPA) without proposed, unreported and biosphere reserve sites
+
+
+def protected_areas_image():
+    wdpa_poly = ee.FeatureCollection("WCMC/WDPA/current/polygons")
+
+    wdpa_filt = wdpa_poly.filter(
+        ee.Filter.And(ee.Filter.neq('STATUS', 'Proposed'),
+                      ee.Filter.neq('STATUS', 'Not Reported'),
+                      ee.Filter.neq('DESIG_ENG', 'UNESCO-MAB Biosphere Reserve'))
+    )
+    return ee.Image().paint(wdpa_filt, 1)
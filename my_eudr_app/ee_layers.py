@@ -0,0 +1,105 @@
+import threading
+import time
+
+import folium
+from django.core.cache import cache
+
+from eudr_backend.earth_engine import earth_engine_session
+from my_eudr_app.ee_images import combine_commodities_images, combine_disturbances_after_2020_images, combine_disturbances_before_2020_images, combine_forest_cover_images, protected_areas_image
+
+# Earth Engine tile URLs stop working once their map token expires, so they are
+# dropped well within its lifetime and refreshed in the background before that.
+# The cache is local to each process, so each one refreshes its own
+LAYER_URLS_TTL = 45 * 60
+LAYER_URLS_REFRESH_AFTER = 30 * 60
+LAYER_URLS_CACHE_KEY = 'ee_reference_layer_urls'
+
+# Static reference layers, identical for every user and every map
+REFERENCE_LAYERS = [
+    {"key": "protected_areas", "name": "Protected Areas",
+     "image": protected_areas_image, "vis_params": {'palette': ['#585858']}},
+    {"key": "forest_mapped_areas", "name": "Forest Mapped Areas",
+     "image": combine_forest_cover_images, "vis_params": {}},
+    {"key": "commodity_areas", "name": "Commodity Areas",
+     "image": combine_commodities_images, "vis_params": {}},
+    {"key": "disturbed_areas_before_2020", "name": "Disturbed Areas Before 2020",
+     "image": combine_disturbances_before_2020_images, "vis_params": {}},
+    {"key": "disturbed_areas_after_2020", "name": "Disturbed Areas After 2020",
+     "image": combine_disturbances_after_2020_images, "vis_params": {}},
+]
+
+
+class EarthEngineClient:
+    """
+    The Earth Engine calls the registry needs, so tests can swap in a fake.
+    """
+
+    def initialize(self):
+        earth_engine_session.ensure_initialized()
+
+    def tile_url(self, image, vis_params):
+        return image.getMapId(vis_params)['tile_fetcher'].url_format
+
+
+class LayerRegistry:
+    """
+    Computes the tile URL templates of the reference layers once and shares them
+    through the Django cache, instead of one getMapId round trip per layer and
+    map request.
+    """
+
+    def __init__(self, client=None, layers=REFERENCE_LAYERS):
+        self.client = client or EarthEngineClient()
+        self.layers = layers
+        self.refresh_lock = threading.Lock()
+
+    def build(self):
+        self.client.initialize()
+        entry = {
+            "urls": {layer['key']: self.client.tile_url(layer['image'](), layer['vis_params'])
+                     for layer in self.layers},
+            "built_at": time.time(),
+        }
+        cache.set(LAYER_URLS_CACHE_KEY, entry, LAYER_URLS_TTL)
+        return entry
+
+    def tile_urls(self):
+        entry = cache.get(LAYER_URLS_CACHE_KEY)
+        if entry is None:
+            entry = self.build()
+        elif time.time() - entry['built_at'] > LAYER_URLS_REFRESH_AFTER:
+            # serve the cached URLs while a thread of this process rebuilds them
+            self.refresh()
+        return entry['urls']
+
+    def refresh(self):
+        """
+        Rebuilds the URLs in a thread, unless a rebuild is already running.
+        Returns the thread, or None when one was already running.
+        """
+        if not self.refresh_lock.acquire(blocking=False):
+            return None
+
+        def rebuild():
+            try:
+                self.build()
+            except Exception:
+                # the stale URLs are served until they expire, then rebuilt by a request
+                pass
+            finally:
+                self.refresh_lock.release()
+
+        thread = threading.Thread(target=rebuild, daemon=True)
+        thread.start()
+        return thread
+
+    def tile_layers(self):
+        urls = self.tile_urls()
+        return [
+            folium.TileLayer(tiles=urls[layer['key']], attr='Google Earth Engine', name=layer['name'],
+                             overlay=True, control=True, show=False, max_zoom=24)
+            for layer in self.layers if layer['key'] in urls
+        ]
+
+
+layer_registry = LayerRegistry()
@@ -1,8 +1,32 @@
+import base64
+import gzip
+import io
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from asgiref.sync import async_to_sync
 from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+import shapely
+import shapely.wkt
+from shapely import Polygon
+from eudr_backend.async_tasks import async_create_farm_data_from_features, bulk_save_farm_data, perform_analysis
+from eudr_backend.agstack import MAX_CONCURRENT_REQUESTS, access_token, farm_boundary_wkt
+from eudr_backend.earth_engine import EarthEngineSession, earth_engine_session
+from eudr_backend.tiles import farm_tiles_version, tile_bounds
+from my_eudr_app.ee_layers import LAYER_URLS_CACHE_KEY, LAYER_URLS_REFRESH_AFTER, REFERENCE_LAYERS, LayerRegistry
+from eudr_backend.tasks import GEOID_MAX_ATTEMPTS, claim_geoid_batch, process_ingestion_job, schedule_dashboard_metrics_refresh, schedule_geoid_registration, schedule_s3_index_crawl, update_geoid
+from background_task.models import Task
 from eudr_backend.models import EUDRSharedMapAccessCodeModel
 from rest_framework.test import APIClient
 from unittest.mock import patch
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 import datetime
 from django.contrib.auth.models import User
@@ -13,10 +37,23 @@ from eudr_backend.models import (
     EUDRFarmModel,
     EUDRFarmBackupModel,
     EUDRCollectionSiteModel,
+    EUDRIngestionJobModel,
     EUDRUploadedFilesModel,
     EUDRSharedMapAccessCodeModel,
-    WhispAPISetting
+    WhispAPISetting,
+    WhispAnalysisCacheModel,
+    EUDRFarmOverlapModel,
+    DashboardDailyMetricsModel,
+    S3ObjectModel
 )
+from eudr_backend.dashboard import dashboard_totals, mark_deleted_rows, refresh_dashboard_metrics
+from eudr_backend.s3_objects import crawl_s3_objects, index_s3_object
+from eudr_backend.farm_queries import MAP_FIELDS, map_farm_rows
+from eudr_backend.overlaps import find_overlapping_pairs, update_farm_overlaps
+from eudr_backend.serializers import EUDRCollectionSiteModelSerializer, EUDRFarmBackupModelSerializer, EUDRFarmModelSerializer
+from eudr_backend.validators import validate_csv, validate_geojson
+from eudr_backend.views import get_filtered_files_uploaded
+from eudr_backend.utils import UploadedCSVRows, UploadedGeoJSONFeatures, extract_data_from_file, store_file_in_s3, geometry_cache_key, iter_batches, iter_csv_features
 
 
 class ViewsTestCase(TestCase):
@@ -607,3 +644,2060 @@ class MapViewTest(TestCase):
         self.assertEqual(response.status_code, 403)
         self.assertJSONEqual(response.content, {
                              "message": "Invalid file ID or access code.", "status": 403})
+
+
+class MockWhispServer:
+    """
+    Local stand-in for the WHISP geojson endpoint. Every feature gets an analysis
+    row echoing its farmer_name, and the delay/failure hooks let tests control
+    how chunks complete.
+    """
+
+    def __init__(self, delay=lambda features: 0, fail=lambda features: False):
+        self.delay = delay
+        self.fail = fail
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                features = json.loads(body).get('features', [])
+                with server.lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(
+                        server.max_in_flight, server.in_flight)
+                time.sleep(server.delay(features))
+                with server.lock:
+                    server.in_flight -= 1
+
+                if server.fail(features):
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                payload = json.dumps({"data": [
+                    {"plotId": feature['properties'].get('farmer_name'), "EUDR_risk": "low"}
+                    for feature in features
+                ]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/api/geojson"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def build_feature_collection(count):
+    return {"type": "FeatureCollection", "features": [{
+        "type": "Feature",
+        "properties": {"farmer_name": f"farmer_{i}", "farm_size": 1.0},
+        "geometry": {"type": "Point", "coordinates": [30.0 + i * 0.001, -1.9]}
+    } for i in range(count)]}
+
+
+class PerformAnalysisTest(TestCase):
+    def setUp(self):
+        WhispAPISetting.objects.create(chunk_size=2, max_concurrent_requests=3)
+
+    def test_chunks_are_dispatched_concurrently_within_limit(self):
+        """Test that at most max_concurrent_requests chunks are in flight."""
+        with MockWhispServer(delay=lambda features: 0.2) as server:
+            with patch('eudr_backend.async_tasks.WHISP_API_URL', server.url):
+                err, results = async_to_sync(perform_analysis)(
+                    build_feature_collection(12))
+
+        self.assertIsNone(err)
+        self.assertEqual(server.requests, 6)
+        self.assertEqual(server.max_in_flight, 3)
+        self.assertEqual(len(results), 12)
+
+    def test_results_keep_feature_order(self):
+        """Test that results are returned in feature order when chunks finish out of order."""
+        # earlier chunks take longer so they complete last
+        def delay(features):
+            return 0.3 - int(features[0]['properties']['farmer_name'].split('_')[1]) * 0.03
+
+        with MockWhispServer(delay=delay) as server:
+            with patch('eudr_backend.async_tasks.WHISP_API_URL', server.url):
+                err, results = async_to_sync(perform_analysis)(
+                    build_feature_collection(8))
+
+        self.assertIsNone(err)
+        self.assertEqual([result['plotId'] for result in results],
+                         [f"farmer_{i}" for i in range(8)])
+
+    def test_failed_chunk_returns_error(self):
+        """Test that a failing chunk aborts the analysis and removes created files."""
+        uploaded_file = EUDRUploadedFilesModel.objects.create(
+            file_name='failed.csv', uploaded_by='testuser')
+
+        def fail(features):
+            return any(feature['properties']['farmer_name'] == 'farmer_5' for feature in features)
+
+        with MockWhispServer(fail=fail) as server:
+            with patch('eudr_backend.async_tasks.WHISP_API_URL', server.url):
+                err, results = async_to_sync(perform_analysis)(
+                    build_feature_collection(8), [uploaded_file.id])
+
+        self.assertIsNotNone(err)
+        self.assertIsNone(results)
+        self.assertFalse(EUDRUploadedFilesModel.objects.filter(
+            id=uploaded_file.id).exists())
+
+
+class WhispAnalysisCacheTest(TestCase):
+    def setUp(self):
+        self.setting = WhispAPISetting.objects.create(chunk_size=2)
+        self.square = [[30.0, -1.9], [30.001, -1.9], [
+            30.001, -1.901], [30.0, -1.901], [30.0, -1.9]]
+
+    def polygon_collection(self, ring):
+        return {"type": "FeatureCollection", "features": [{
+            "type": "Feature",
+            "properties": {"farmer_name": "Alice", "farm_size": 5.0},
+            "geometry": {"type": "Polygon", "coordinates": [ring]}
+        }]}
+
+    def analyse(self, server, data):
+        with patch('eudr_backend.async_tasks.WHISP_API_URL', server.url):
+            return async_to_sync(perform_analysis)(data)
+
+    def test_geometry_cache_key_is_orientation_independent(self):
+        """Test that the same ring in another orientation and precision hashes identically."""
+        reversed_ring = list(reversed(self.square))
+        jittered_ring = [[lon + 1e-9, lat] for lon, lat in self.square]
+        key = geometry_cache_key(
+            {"type": "Polygon", "coordinates": [self.square]})
+        self.assertEqual(key, geometry_cache_key(
+            {"type": "Polygon", "coordinates": [reversed_ring]}))
+        self.assertEqual(key, geometry_cache_key(
+            {"type": "Polygon", "coordinates": [jittered_ring]}))
+        self.assertIsNone(geometry_cache_key(
+            {"type": "Polygon", "coordinates": [[1, 2]]}))
+
+    def test_cached_geometries_are_not_resent(self):
+        """Test that a re-upload of unchanged geometries is served from the cache."""
+        with MockWhispServer() as server:
+            err, first = self.analyse(
+                server, build_feature_collection(4))
+            err, second = self.analyse(
+                server, build_feature_collection(5))
+
+        self.assertIsNone(err)
+        # 2 chunks for the first upload, 1 chunk for the single new feature
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(second[:4], first)
+        self.assertEqual(second[4]['plotId'], 'farmer_4')
+        self.assertEqual(WhispAnalysisCacheModel.objects.count(), 5)
+
+    def test_reoriented_polygon_hits_cache(self):
+        """Test that a polygon with reversed ring orientation reuses the cached result."""
+        with MockWhispServer() as server:
+            self.analyse(server, self.polygon_collection(self.square))
+            err, results = self.analyse(
+                server, self.polygon_collection(list(reversed(self.square))))
+
+        self.assertIsNone(err)
+        self.assertEqual(server.requests, 1)
+        self.assertEqual(results[0]['plotId'], 'Alice')
+
+    def test_dataset_version_bump_invalidates_cache(self):
+        """Test that bumping the dataset version sends geometries again and evicts old entries."""
+        with MockWhispServer() as server, patch('eudr_backend.async_tasks.CACHE_EVICTION_RATE', 1):
+            self.analyse(server, build_feature_collection(2))
+            self.setting.dataset_version = "2"
+            self.setting.save()
+            self.analyse(server, build_feature_collection(2))
+
+        self.assertEqual(server.requests, 2)
+        self.assertFalse(WhispAnalysisCacheModel.objects.exclude(
+            dataset_version="2").exists())
+
+    def test_expired_entries_are_ignored(self):
+        """Test that results older than the TTL are not reused."""
+        with MockWhispServer() as server:
+            self.analyse(server, build_feature_collection(2))
+            WhispAnalysisCacheModel.objects.update(
+                created_at=timezone.now() - datetime.timedelta(days=31))
+            self.analyse(server, build_feature_collection(2))
+
+        self.assertEqual(server.requests, 2)
+        self.assertEqual(WhispAnalysisCacheModel.objects.count(), 2)
+        # the expired entries are refreshed even when the eviction does not run
+        self.assertFalse(WhispAnalysisCacheModel.objects.filter(
+            created_at__lt=timezone.now() - datetime.timedelta(days=1)).exists())
+
+    def test_cache_writes_evict_only_when_sampled(self):
+        """Test that storing results does not scan the cache for stale entries on every write."""
+        with MockWhispServer() as server:
+            self.analyse(server, build_feature_collection(2))
+            self.setting.dataset_version = "2"
+            self.setting.save()
+            with patch('eudr_backend.async_tasks.CACHE_EVICTION_RATE', 0), \
+                    CaptureQueriesContext(connection) as queries:
+                self.analyse(server, build_feature_collection(2))
+
+        self.assertFalse([query for query in queries if query['sql'].startswith('DELETE')])
+        self.assertEqual(WhispAnalysisCacheModel.objects.count(), 4)
+
+
+class FarmDataJobTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='jobuser', password='password123')
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        WhispAPISetting.objects.create(chunk_size=2)
+        self.s3 = FakeS3Client()
+        patcher = patch('eudr_backend.utils.s3_client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.data = build_feature_collection(5)
+        for feature in self.data['features']:
+            feature['properties'].update({
+                "collection_site": "Site A",
+                "farm_village": "Village A",
+                "farm_district": "District A",
+                "latitude": feature['geometry']['coordinates'][1],
+                "longitude": feature['geometry']['coordinates'][0],
+            })
+
+    def test_async_upload_returns_job_and_reports_progress(self):
+        """Test that an async upload is queued and its progress is exposed by the status endpoint."""
+        response = self.client.post(
+            reverse('create_farm_data') + '?async=true', self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.data['job_id']
+        self.assertEqual(EUDRIngestionJobModel.objects.get(
+            id=job_id).status, 'PENDING')
+        self.assertEqual(EUDRFarmModel.objects.count(), 0)
+
+        with MockWhispServer() as server:
+            with patch('eudr_backend.async_tasks.WHISP_API_URL', server.url):
+                process_ingestion_job.now(job_id)
+
+        response = self.client.get(
+            reverse('retrieve_farm_data_job', args=[job_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'COMPLETED')
+        self.assertEqual(response.data['stage'], 'DONE')
+        self.assertEqual(response.data['rows_parsed'], 5)
+        self.assertEqual(response.data['chunks_total'], 3)
+        self.assertEqual(response.data['chunks_analysed'], 3)
+        self.assertEqual(response.data['rows_saved'], 5)
+        self.assertNotIn('upload_key', response.data)
+        self.assertEqual(EUDRFarmModel.objects.filter(
+            file_id=response.data['file_id']).count(), 5)
+        # the upload is deleted once the job succeeded
+        self.assertEqual(self.s3.objects, {})
+
+    def test_job_upload_is_kept_until_the_job_succeeds(self):
+        """Test that a job whose worker died is run again from its upload in the bucket."""
+        upload = SimpleUploadedFile("farms.geojson", json.dumps(self.data).encode())
+        response = self.client.post(
+            reverse('create_farm_data') + '?async=true', {'format': 'geojson', 'file': upload}, format='multipart')
+        job = EUDRIngestionJobModel.objects.get(id=response.data['job_id'])
+        self.assertEqual(list(self.s3.objects), [job.upload_key])
+
+        with patch('eudr_backend.tasks.async_create_farm_data_from_features', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                process_ingestion_job.now(job.id)
+        self.assertEqual(list(self.s3.objects), [job.upload_key])
+
+        with MockWhispServer() as server:
+            with patch('eudr_backend.async_tasks.WHISP_API_URL', server.url), \
+                    patch('eudr_backend.tasks.store_file_in_s3') as store_file:
+                process_ingestion_job.now(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_saved, job.upload_key), ('COMPLETED', 5, None))
+        archived = store_file.call_args.args[0]
+        archived.seek(0)
+        self.assertEqual(archived.read(), json.dumps(self.data).encode())
+        self.assertEqual(self.s3.objects, {})
+
+    def test_async_upload_with_invalid_data_fails_job(self):
+        """Test that validation errors are reported on the job instead of the upload response."""
+        del self.data['features'][0]['properties']['farmer_name']
+        response = self.client.post(
+            reverse('create_farm_data') + '?async=true', self.data, format='json')
+        process_ingestion_job.now(response.data['job_id'])
+
+        job = EUDRIngestionJobModel.objects.get(id=response.data['job_id'])
+        self.assertEqual(job.status, 'FAILED')
+        self.assertTrue(job.errors)
+        self.assertFalse(EUDRUploadedFilesModel.objects.filter(
+            uploaded_by='jobuser').exists())
+
+    def test_job_status_is_private_to_uploader(self):
+        """Test that other users cannot read a job's status."""
+        job = EUDRIngestionJobModel.objects.create(
+            file_name='farms.csv', uploaded_by='someoneelse')
+        response = self.client.get(
+            reverse('retrieve_farm_data_job', args=[job.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BulkSaveFarmDataTest(TestCase):
+    def setUp(self):
+        self.existing = EUDRFarmModel.objects.create(
+            farmer_name="Alice",
+            farm_size=1.0,
+            collection_site="Site A",
+            farm_village="Village A",
+            farm_district="District A",
+            latitude=-1.9,
+            longitude=30.0,
+            polygon=[],
+            file_id="1"
+        )
+
+    def build_item(self, farmer_name, latitude=-1.9, longitude=30.0, polygon=[], farm_size=2.0):
+        return {
+            "farmer_name": farmer_name,
+            "farm_size": farm_size,
+            "collection_site": "Site A",
+            "farm_village": "Village A",
+            "farm_district": "District A",
+            "latitude": latitude,
+            "longitude": longitude,
+            "polygon": polygon,
+            "polygon_type": "Point",
+            "file_id": "2",
+            "analysis": {"eudr_risk_level": "low"},
+        }
+
+    def test_existing_records_are_updated_and_new_ones_created(self):
+        """Test that matching records are updated in place and the rest are inserted."""
+        items = [self.build_item("Alice")] + \
+            [self.build_item(f"Farmer {i}") for i in range(10)]
+        err, saved = bulk_save_farm_data(items)
+
+        self.assertIsNone(err)
+        self.assertEqual(len(saved), 11)
+        self.assertEqual(saved[0].id, self.existing.id)
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.farm_size, 2.0)
+        self.assertEqual(self.existing.file_id, "2")
+        self.assertEqual(EUDRFarmModel.objects.count(), 11)
+        self.assertTrue(all(record.id for record in saved))
+
+    def test_queries_are_batched(self):
+        """Test that saving a file costs a handful of batched queries instead of two per row."""
+        items = [self.build_item(f"Farmer {i}") for i in range(200)]
+        items.append(self.build_item("Alice"))
+        with CaptureQueriesContext(connection) as queries:
+            err, _ = bulk_save_farm_data(items)
+
+        self.assertIsNone(err)
+        self.assertLess(len(queries), 20)
+        # the candidate records, the owning files and users, and the plots for the overlap index
+        self.assertLessEqual(
+            len([query for query in queries if query['sql'].startswith('SELECT')]), 4)
+
+    def test_non_matching_coordinates_create_new_record(self):
+        """Test that the latitude/longitude condition of the lookup is preserved."""
+        err, saved = bulk_save_farm_data(
+            [self.build_item("Alice", latitude=-2.5, longitude=31.0)])
+        self.assertIsNone(err)
+        self.assertNotEqual(saved[0].id, self.existing.id)
+
+    def test_polygon_items_only_match_records_with_polygons(self):
+        """Test that a polygon item does not update a point-only record."""
+        polygon = [[[30.0, -1.9], [30.1, -1.9], [30.1, -2.0], [30.0, -1.9]]]
+        err, saved = bulk_save_farm_data(
+            [self.build_item("Alice", polygon=polygon)])
+        self.assertIsNone(err)
+        self.assertNotEqual(saved[0].id, self.existing.id)
+
+    def test_duplicate_rows_in_same_file_are_merged(self):
+        """Test that a later row updates the record created by an earlier row of the same file."""
+        err, saved = bulk_save_farm_data([
+            self.build_item("Bob", farm_size=1.0),
+            self.build_item("Bob", farm_size=3.0),
+        ])
+        self.assertIsNone(err)
+        self.assertIs(saved[0], saved[1])
+        self.assertEqual(EUDRFarmModel.objects.get(
+            farmer_name="Bob").farm_size, 3.0)
+
+    def test_validation_errors_are_reported_per_row(self):
+        """Test that every invalid row is reported and nothing is written."""
+        items = [self.build_item("Bob"), self.build_item(
+            "Carol", farm_size="big"), self.build_item(None)]
+        err, saved = bulk_save_farm_data(items)
+
+        self.assertIsNone(saved)
+        self.assertEqual([error['record'] for error in err], [2, 3])
+        self.assertIn('farm_size', err[0]['errors'])
+        self.assertIn('farmer_name', err[1]['errors'])
+        self.assertFalse(EUDRFarmModel.objects.filter(
+            farmer_name="Bob").exists())
+
+
+class StreamingIngestionTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='streamuser', password='password123')
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        WhispAPISetting.objects.create(chunk_size=2, max_concurrent_requests=1)
+
+    def build_csv(self, rows):
+        lines = ["farmer_name,farm_size,collection_site,farm_district,farm_village,latitude,longitude,polygon"]
+        lines += [f"farmer_{i},1.0,Site A,District A,Village A,-1.9,{30 + i * 0.001},"
+                  for i in range(rows)]
+        return "\n".join(lines).encode()
+
+    def test_iter_batches_reads_lazily(self):
+        """Test that batching consumes the source one batch at a time."""
+        consumed = []
+
+        def source():
+            for i in range(10):
+                consumed.append(i)
+                yield i
+
+        batches = iter_batches(source(), 4)
+        self.assertEqual(next(batches), [0, 1, 2, 3])
+        self.assertEqual(len(consumed), 4)
+        self.assertEqual(list(batches), [[4, 5, 6, 7], [8, 9]])
+
+    def test_uploaded_csv_rows_can_be_streamed_twice(self):
+        """Test that the CSV view rewinds the upload for every pass."""
+        rows = UploadedCSVRows(SimpleUploadedFile(
+            "farms.csv", self.build_csv(3)))
+        self.assertEqual(len(list(rows)), 4)
+        features = list(iter_csv_features(rows))
+        self.assertEqual(len(features), 3)
+        self.assertEqual(features[2]['properties']['farmer_name'], 'farmer_2')
+
+    def test_csv_upload_is_saved_in_batches(self):
+        """Test that a CSV upload streams through analysis and saving batch by batch."""
+        upload = SimpleUploadedFile("farms.csv", self.build_csv(5))
+        with MockWhispServer() as server:
+            with patch('eudr_backend.async_tasks.WHISP_API_URL', server.url), \
+                    patch('eudr_backend.views.store_file_in_s3') as store_file_in_s3:
+                response = self.client.post(
+                    reverse('create_farm_data'), {'format': 'csv', 'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(server.requests, 3)
+        store_file_in_s3.assert_called_once()
+        self.assertEqual(EUDRFarmModel.objects.filter(
+            file_id=response.data['file_id']).count(), 5)
+
+    def build_geojson(self, rows):
+        return json.dumps({"type": "FeatureCollection", "name": "farms", "features": [{
+            "type": "Feature",
+            "properties": {"farmer_name": f"farmer_{i}", "farm_size": 1, "collection_site": "Site A",
+                           "farm_district": "District A", "farm_village": "Village A",
+                           "latitude": -1.9, "longitude": 30 + i * 0.001, "member_id": "007"},
+            "geometry": {"type": "Polygon", "coordinates": [square_ring(30 + i * 0.001, -1.9, 0.0005)]},
+        } for i in range(rows)]}).encode()
+
+    def test_geojson_file_is_read_as_is(self):
+        """Test that a GeoJSON upload keeps its property types and top level members."""
+        data = extract_data_from_file(SimpleUploadedFile(
+            "farms.geojson", self.build_geojson(2)), 'geojson')
+        self.assertEqual(data['name'], 'farms')
+        features = list(data['features'])
+        self.assertEqual(features[1]['properties']['farm_size'], 1)
+        self.assertEqual(features[1]['properties']['member_id'], '007')
+        self.assertEqual(validate_geojson(data), [])
+
+    def test_geojson_features_are_streamed_in_chunks(self):
+        """Test that the features of a GeoJSON upload are read from the file on every pass and validated a chunk at a time."""
+        body = json.loads(self.build_geojson(5))
+        body['features'][3]['properties']['farm_size'] = "big"
+        data = extract_data_from_file(SimpleUploadedFile(
+            "farms.geojson", json.dumps(body).encode()), 'geojson')
+        self.assertIsInstance(data['features'], UploadedGeoJSONFeatures)
+        with patch('eudr_backend.validators.GEOJSON_CHUNK_SIZE', 2):
+            errors = validate_geojson(data)
+        self.assertEqual([(error['record'], error['field']) for error in errors], [(4, 'farm_size')])
+        self.assertEqual(len(list(data['features'])), 5)
+
+    def test_geojson_type_after_features(self):
+        """Test that the type of a GeoJSON file is found when it follows the features."""
+        upload = SimpleUploadedFile("farms.geojson", json.dumps({
+            "features": json.loads(self.build_geojson(1))['features'], "type": "FeatureCollection"}).encode())
+        self.assertEqual(validate_geojson(extract_data_from_file(upload, 'geojson')), [])
+
+    def test_geojson_upload_is_saved_in_batches(self):
+        """Test that a GeoJSON upload is read, validated and saved."""
+        upload = SimpleUploadedFile("farms.geojson", self.build_geojson(3))
+        with MockWhispServer() as server:
+            with patch('eudr_backend.async_tasks.WHISP_API_URL', server.url), \
+                    patch('eudr_backend.views.store_file_in_s3'):
+                response = self.client.post(
+                    reverse('create_farm_data'), {'format': 'geojson', 'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(EUDRFarmModel.objects.filter(
+            file_id=response.data['file_id']).count(), 3)
+
+    def test_unreadable_geojson_upload_is_rejected(self):
+        """Test that a file that is not JSON gets a bad request."""
+        upload = SimpleUploadedFile("farms.geojson", b'{"type": "FeatureCollection", "features": [')
+        response = self.client.post(
+            reverse('create_farm_data'), {'format': 'geojson', 'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Invalid GeoJSON file', response.data['error'])
+
+    def test_unreadable_vector_upload_is_rejected(self):
+        """Test that a corrupt zip, gpkg or kml file gets a bad request."""
+        for data_format in ('zip', 'gpkg', 'kml'):
+            upload = SimpleUploadedFile(f"farms.{data_format}", b'not a vector file')
+            response = self.client.post(
+                reverse('create_farm_data'), {'format': data_format, 'file': upload}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(f'Invalid {data_format} file', response.data['error'])
+
+    def test_failed_batch_discards_earlier_batches(self):
+        """Test that rows saved by earlier batches are removed when a later batch fails."""
+        uploaded_file = EUDRUploadedFilesModel.objects.create(
+            file_name='farms.csv', uploaded_by='streamuser')
+        features = iter_csv_features(UploadedCSVRows(
+            SimpleUploadedFile("farms.csv", self.build_csv(5))))
+
+        def fail(features):
+            return any(feature['properties']['farmer_name'] == 'farmer_4' for feature in features)
+
+        with MockWhispServer(fail=fail) as server:
+            with patch('eudr_backend.async_tasks.WHISP_API_URL', server.url):
+                errors, saved = async_to_sync(async_create_farm_data_from_features)(
+                    features, uploaded_file.id)
+
+        self.assertTrue(errors)
+        self.assertEqual(saved, 4)
+        self.assertFalse(EUDRFarmModel.objects.filter(
+            file_id=uploaded_file.id).exists())
+        self.assertFalse(EUDRUploadedFilesModel.objects.filter(
+            id=uploaded_file.id).exists())
+
+
+def square_ring(lon, lat, size):
+    return [[lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size], [lon, lat]]
+
+
+class OverlapEngineTest(TestCase):
+    def build_farm(self, farm_id, ring, polygon_type='Polygon'):
+        return {"id": farm_id, "polygon": [ring], "polygon_type": polygon_type}
+
+    def build_item(self, farmer_name, lon, file_id, lat=-1.9):
+        return {
+            "farmer_name": farmer_name,
+            "farm_size": 5,
+            "collection_site": "Site A",
+            "farm_village": "V",
+            "farm_district": "D",
+            "latitude": lat,
+            "longitude": lon,
+            "polygon": [square_ring(lon, lat, 0.01)],
+            "polygon_type": "Polygon",
+            "file_id": file_id,
+        }
+
+    def test_overlapping_pair_reports_area_and_percentage(self):
+        """Test that half-overlapping squares are reported once with their shared area."""
+        farms = [
+            self.build_farm(1, square_ring(30.0, -1.9, 0.01)),
+            self.build_farm(2, square_ring(30.005, -1.9, 0.01)),
+            self.build_farm(3, square_ring(31.0, -1.9, 0.01)),
+        ]
+        pairs = find_overlapping_pairs(farms)
+
+        self.assertEqual(len(pairs), 1)
+        self.assertEqual((pairs[0]['farm_id'], pairs[0]['other_farm_id']), (1, 2))
+        self.assertAlmostEqual(pairs[0]['farm_overlap_percentage'], 50, delta=0.1)
+        self.assertAlmostEqual(pairs[0]['other_farm_overlap_percentage'], 50, delta=0.1)
+        # half of a 0.01 degree square near the equator is roughly 61.5 ha
+        self.assertAlmostEqual(pairs[0]['intersection_area_ha'], 61.5, delta=1)
+
+    def test_matches_pairwise_overlaps(self):
+        """Test that the indexed search finds the same pairs as comparing every pair."""
+        farms = [self.build_farm(i, square_ring(30 + (i % 10) * 0.007, -1.9 + (i // 10) * 0.007, 0.01))
+                 for i in range(60)]
+        farms.append(self.build_farm(100, [[30.0, -1.9], [30.1, -1.9]]))
+        farms.append({"id": 101, "polygon": [], "polygon_type": "Point"})
+
+        geometries = {farm['id']: Polygon(farm['polygon'][0])
+                      for farm in farms[:60]}
+        expected = {(a, b) for a in geometries for b in geometries
+                    if a < b and geometries[a].overlaps(geometries[b])}
+        pairs = {(pair['farm_id'], pair['other_farm_id'])
+                 for pair in find_overlapping_pairs(farms)}
+        self.assertEqual(pairs, expected)
+
+    def test_invalid_polygons_are_repaired(self):
+        """Test that self-intersecting and flattened multipolygon plots are compared instead of raising."""
+        bowtie = [[30.0, -1.9], [30.01, -1.89], [30.01, -1.9], [30.0, -1.89], [30.0, -1.9]]
+        flattened = square_ring(31.0, -1.9, 0.01) + square_ring(31.02, -1.9, 0.01)
+        farms = [
+            self.build_farm(1, bowtie),
+            self.build_farm(2, square_ring(30.005, -1.9, 0.01)),
+            self.build_farm(3, flattened, polygon_type='MultiPolygon'),
+            self.build_farm(4, square_ring(31.005, -1.9, 0.01)),
+        ]
+        pairs = {(pair['farm_id'], pair['other_farm_id']): pair
+                 for pair in find_overlapping_pairs(farms)}
+
+        self.assertEqual(set(pairs), {(1, 2), (3, 4)})
+        # the right triangle of the bowtie lies inside the second square
+        self.assertAlmostEqual(pairs[(1, 2)]['other_farm_overlap_percentage'], 25, delta=0.1)
+
+    def test_saving_an_invalid_overlapping_plot(self):
+        """Test that an invalid plot touching a stored farm is saved with its overlap."""
+        bulk_save_farm_data([self.build_item("farmer_a", 30.005, "1")])
+        item = self.build_item("farmer_b", 30.0, "2")
+        item["polygon"] = [[[30.0, -1.9], [30.01, -1.89], [30.01, -1.9], [30.0, -1.89], [30.0, -1.9]]]
+        err, _ = bulk_save_farm_data([item])
+
+        self.assertIsNone(err)
+        self.assertEqual(EUDRFarmOverlapModel.objects.count(), 1)
+
+    def test_large_file_is_fast(self):
+        """Test that thousands of plots are checked well within a request."""
+        farms = [self.build_farm(i, square_ring(30 + (i % 70) * 0.009, -1.9 + (i // 70) * 0.009, 0.01))
+                 for i in range(5000)]
+        started = time.perf_counter()
+        pairs = find_overlapping_pairs(farms)
+        self.assertLess(time.perf_counter() - started, 5)
+        self.assertTrue(pairs)
+
+    def test_overlapping_endpoint_includes_overlap_details(self):
+        """Test that the overlapping farms endpoint returns only overlapping farms with details."""
+        user = User.objects.create_user(username='overlapuser', password='pw')
+        client = APIClient()
+        client.force_authenticate(user)
+        uploaded_file = EUDRUploadedFilesModel.objects.create(
+            file_name='farms.csv', uploaded_by='overlapuser')
+        err, _ = bulk_save_farm_data([
+            self.build_item(f"farmer_{i}", lon, uploaded_file.id) for i, lon in enumerate([30.0, 30.005, 31.0])])
+        self.assertIsNone(err)
+
+        response = client.get(
+            reverse('retrieve_overlapping_farm_data', args=[uploaded_file.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(farm['farmer_name'] for farm in response.data), [
+                         'farmer_0', 'farmer_1'])
+        self.assertEqual(len(response.data[0]['overlaps']), 1)
+
+    def test_overlapping_endpoint_reads_requested_file_for_staff(self):
+        """Test that staff get the overlaps of the requested file and a 404 for a missing one."""
+        staff = User.objects.create_user(username='overlapstaff', password='pw', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(staff)
+        EUDRUploadedFilesModel.objects.create(file_name='first.csv', uploaded_by='overlapstaff')
+        uploaded_file = EUDRUploadedFilesModel.objects.create(
+            file_name='farms.csv', uploaded_by='overlapstaff')
+        bulk_save_farm_data([
+            self.build_item(f"farmer_{i}", lon, uploaded_file.id) for i, lon in enumerate([30.0, 30.005])])
+
+        response = client.get(
+            reverse('retrieve_overlapping_farm_data', args=[uploaded_file.id]))
+        self.assertEqual(len(response.data), 2)
+        response = client.get(
+            reverse('retrieve_overlapping_farm_data', args=[uploaded_file.id + 100]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_overlaps_are_stored_across_files(self):
+        """Test that a new upload is checked against plots saved by earlier uploads."""
+        bulk_save_farm_data([self.build_item("farmer_a", 30.0, "1")])
+        bulk_save_farm_data([self.build_item("farmer_b", 30.005, "2")])
+
+        pair = EUDRFarmOverlapModel.objects.get()
+        self.assertEqual(
+            (pair.farm.farmer_name, pair.other_farm.farmer_name), ("farmer_a", "farmer_b"))
+        self.assertAlmostEqual(pair.farm_overlap_percentage, 50, delta=0.1)
+
+    def test_moving_a_plot_refreshes_only_its_overlaps(self):
+        """Test that a changed geometry drops stale overlaps and unchanged plots are not re-checked."""
+        bulk_save_farm_data([self.build_item("farmer_a", 30.0, "1"),
+                             self.build_item("farmer_b", 30.005, "1"),
+                             self.build_item("farmer_c", 31.0, "1")])
+        self.assertEqual(EUDRFarmOverlapModel.objects.count(), 1)
+
+        # re-saving identical plots leaves the stored overlaps untouched
+        with patch('eudr_backend.async_tasks.update_farm_overlaps') as update:
+            bulk_save_farm_data([self.build_item("farmer_a", 30.0, "1")])
+        update.assert_called_once_with([])
+
+        # same farmer and latitude, so the record is updated with the new polygon
+        bulk_save_farm_data([self.build_item("farmer_b", 30.995, "1")])
+
+        pair = EUDRFarmOverlapModel.objects.get()
+        self.assertEqual({pair.farm.farmer_name, pair.other_farm.farmer_name}, {
+                         "farmer_b", "farmer_c"})
+
+    def test_deleting_a_farm_removes_its_overlaps(self):
+        """Test that stored overlaps go away with the farms they reference."""
+        bulk_save_farm_data([self.build_item("farmer_a", 30.0, "1"),
+                             self.build_item("farmer_b", 30.005, "1")])
+        EUDRFarmModel.objects.filter(farmer_name="farmer_a").delete()
+        self.assertFalse(EUDRFarmOverlapModel.objects.exists())
+
+
+class FarmListPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='pageuser', password='password123')
+        self.client.force_authenticate(self.user)
+        self.file = EUDRUploadedFilesModel.objects.create(
+            file_name='farms.csv', uploaded_by='pageuser')
+        EUDRFarmModel.objects.bulk_create([EUDRFarmModel(
+            farmer_name=f"Farmer {i}",
+            farm_size=1.0,
+            farm_village="Village",
+            farm_district="District",
+            polygon=[square_ring(30 + i * 0.01, -1.9, 0.005)],
+            polygon_type="Polygon",
+            file_id=self.file.id,
+            uploaded_file=self.file,
+            owner=self.user
+        ) for i in range(25)])
+        # bulk saves stamp many rows with the same updated_at, spread the rest out
+        same_time = timezone.now()
+        for i, farm in enumerate(EUDRFarmModel.objects.order_by('id')):
+            EUDRFarmModel.objects.filter(id=farm.id).update(
+                updated_at=same_time if i < 15 else same_time - datetime.timedelta(minutes=i))
+
+    def fetch_all_pages(self, url):
+        ids = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [farm['id'] for farm in response.data['results']]
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_pages_cover_every_row_once(self):
+        """Test that walking the cursor returns each farm exactly once, newest first."""
+        ids, pages = self.fetch_all_pages(
+            reverse('retrieve_farm_data') + '?page_size=10')
+
+        expected = list(EUDRFarmModel.objects.order_by(
+            '-updated_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+    def test_fields_projection_leaves_out_polygons(self):
+        """Test that fields= limits the serialized columns."""
+        response = self.client.get(
+            reverse('retrieve_map_data') + '?page_size=5&fields=id,farmer_name,updated_at')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(set(response.data['results'][0]), {
+                         'id', 'farmer_name', 'updated_at'})
+
+    def test_listing_without_pagination_params_is_unchanged(self):
+        """Test that clients not asking for pages still get the full list."""
+        response = self.client.get(reverse('retrieve_farm_data'))
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 25)
+        self.assertIn('polygon', response.data[0])
+
+    def test_page_size_is_capped(self):
+        """Test that a page can not be larger than the maximum page size."""
+        with patch('eudr_backend.pagination.UpdatedAtCursorPagination.max_page_size', 7):
+            response = self.client.get(
+                reverse('retrieve_farm_data') + '?page_size=100000')
+        self.assertEqual(len(response.data['results']), 7)
+
+    def test_invalid_cursor(self):
+        """Test that a tampered cursor is rejected."""
+        response = self.client.get(
+            reverse('retrieve_farm_data') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FarmOwnershipTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username='owner', password='password123')
+        self.other = User.objects.create_user(
+            username='other', password='password123')
+        self.staff = User.objects.create_user(
+            username='staff', password='password123', is_staff=True)
+        self.file = EUDRUploadedFilesModel.objects.create(
+            file_name='mine.csv', uploaded_by='owner')
+        self.other_file = EUDRUploadedFilesModel.objects.create(
+            file_name='theirs.csv', uploaded_by='other')
+        self.farm = EUDRFarmModel.objects.create(
+            farmer_name="Mine", farm_size=1.0, farm_village="V", farm_district="D",
+            polygon=[], file_id=str(self.file.id))
+        EUDRFarmModel.objects.create(
+            farmer_name="Theirs", farm_size=1.0, farm_village="V", farm_district="D",
+            polygon=[], file_id=str(self.other_file.id))
+
+    def test_owner_relations_follow_file_id(self):
+        """Test that saving a farm links it to its uploaded file and uploader."""
+        self.assertEqual(self.farm.uploaded_file, self.file)
+        self.assertEqual(self.farm.owner, self.owner)
+
+        self.farm.file_id = str(self.other_file.id)
+        self.farm.save()
+        self.farm.refresh_from_db()
+        self.assertEqual(self.farm.owner, self.other)
+
+    def test_bulk_saved_farms_get_owners(self):
+        """Test that farms written in bulk are linked to their owner."""
+        err, saved = bulk_save_farm_data([{
+            "farmer_name": "Bulk", "farm_size": 1.0, "collection_site": "Site",
+            "farm_village": "V", "farm_district": "D", "latitude": 0, "longitude": 0,
+            "polygon": [], "file_id": str(self.file.id)}])
+        self.assertIsNone(err)
+        self.assertEqual(EUDRFarmModel.objects.get(
+            id=saved[0].id).owner, self.owner)
+
+    def test_farms_of_files_without_a_user_are_not_ownerless(self):
+        """Test that farms of a file uploaded as "admin" belong to the user saving them, or are refused."""
+        admin_file = EUDRUploadedFilesModel.objects.create(file_name='admin.csv', uploaded_by='admin')
+        farm = {"farmer_name": "Admin", "farm_size": 1.0, "collection_site": "Site", "farm_village": "V",
+                "farm_district": "D", "latitude": 0, "longitude": 0, "polygon": [], "file_id": str(admin_file.id)}
+        err, saved = bulk_save_farm_data([farm], self.staff)
+        self.assertIsNone(err)
+        self.assertEqual(EUDRFarmModel.objects.get(id=saved[0].id).owner, self.staff)
+
+        err, saved = bulk_save_farm_data([farm | {"farmer_name": "Nobody"}])
+        self.assertIn('"admin", who is not a user', err['error'])
+        self.assertFalse(EUDRFarmModel.objects.filter(farmer_name="Nobody").exists())
+        with self.assertRaises(ValueError):
+            EUDRFarmModel.objects.create(
+                farmer_name="Nobody", farm_size=1.0, farm_village="V", farm_district="D",
+                polygon=[], file_id=str(admin_file.id))
+
+    def test_visible_to_is_a_single_query(self):
+        """Test that listings filter by owner in SQL without reading the files first."""
+        with self.assertNumQueries(1):
+            names = list(EUDRFarmModel.objects.visible_to(
+                self.owner).values_list('farmer_name', flat=True))
+        self.assertEqual(names, ["Mine"])
+        self.assertEqual(
+            EUDRFarmModel.objects.visible_to(self.staff).count(), 2)
+
+    def test_listing_endpoints_use_ownership(self):
+        """Test that the farm listings only return the caller's farms."""
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        for url in [reverse('retrieve_farm_data'), reverse('retrieve_map_data'),
+                    reverse('retrieve_user_farm_data', args=[self.owner.id])]:
+            response = client.get(url)
+            self.assertEqual([farm['farmer_name']
+                             for farm in response.data], ["Mine"])
+
+
+class FarmQueryIndexTest(TestCase):
+    def test_benchmark_command_rolls_back(self):
+        """Test that the benchmark reports every query and leaves no seeded data behind."""
+        out = io.StringIO()
+        call_command('benchmark_farm_queries', farms=300,
+                     files=5, repeat=1, stdout=out)
+
+        for name in ['match_records', 'file_listing', 'owner_listing', 'staff_listing',
+                     'missing_geoid', 'created_range']:
+            self.assertIn(name, out.getvalue())
+        self.assertFalse(EUDRFarmModel.objects.exists())
+        self.assertFalse(User.objects.filter(
+            username='benchmark-owner').exists())
+
+    def test_listing_query_uses_index(self):
+        """Test that the planner serves listings from the new indexes."""
+        plan = EUDRFarmModel.objects.filter(
+            file_id="1").order_by('-updated_at').explain()
+        self.assertIn('farm_file_updated_idx', plan)
+
+    def test_total_plots_date_range_is_inclusive(self):
+        """Test that the created_at range still covers whole days at both ends."""
+        user = User.objects.create_user(
+            username='plots', password='pw', is_staff=True)
+        client = APIClient()
+        client.force_login(user)
+        farm = EUDRFarmModel.objects.create(
+            farmer_name="Day", farm_size=1.0, farm_village="V", farm_district="D", polygon=[])
+        end_of_day = timezone.make_aware(
+            datetime.datetime(2024, 5, 2, 23, 59, 59))
+        EUDRFarmModel.objects.filter(id=farm.id).update(created_at=end_of_day)
+
+        response = client.get(reverse('total_plots'), {
+                              'startDate': '2024-05-01', 'endDate': '2024-05-02'})
+        self.assertEqual([row['id'] for row in response.json()], [farm.id])
+        response = client.get(reverse('total_plots'), {
+                              'startDate': '2024-05-03', 'endDate': '2024-05-04'})
+        self.assertEqual(response.json(), [])
+
+
+class MockAgStackServer:
+    """
+    Local stand-in for the AgStack asset registry. Logins hand out JWT-like
+    tokens, boundaries get a new geoid the first time and their matched geoid
+    afterwards, and the first `unavailable` registrations answer 503.
+    """
+
+    def __init__(self, delay=0, unavailable=0):
+        self.delay = delay
+        self.unavailable = unavailable
+        self.logins = 0
+        self.registrations = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.tokens = set()
+        self.geoids = {}
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self, status_code, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(
+                    int(self.headers['Content-Length'])))
+                if self.path == '/login':
+                    with server.lock:
+                        server.logins += 1
+                        token = server.issue_token()
+                    return self.respond(200, {"access_token": token})
+
+                token = self.headers.get('Authorization', '')[len('Bearer '):]
+                with server.lock:
+                    if token not in server.tokens:
+                        return self.respond(401, {"message": "Token expired"})
+                    server.registrations += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(
+                        server.max_in_flight, server.in_flight)
+                    unavailable = server.registrations <= server.unavailable
+                time.sleep(server.delay)
+                with server.lock:
+                    server.in_flight -= 1
+                    if unavailable:
+                        return self.respond(503, {})
+                    if body['wkt'] in server.geoids:
+                        return self.respond(400, {"matched geo ids": [server.geoids[body['wkt']]]})
+                    server.geoids[body['wkt']] = f"geo-{len(server.geoids) + 1}"
+                    return self.respond(200, {"Geo Id": server.geoids[body['wkt']]})
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def issue_token(self):
+        claims = json.dumps({"exp": time.time() + 3600}).encode()
+        token = f"header.{base64.urlsafe_b64encode(claims).decode().rstrip('=')}.{len(self.tokens)}"
+        self.tokens.add(token)
+        return token
+
+    def revoke_tokens(self):
+        with self.lock:
+            self.tokens.clear()
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class GeoidRegistrationTest(TestCase):
+    def setUp(self):
+        access_token.clear()
+        User.objects.create_user(username='geo', password='password123')
+        self.file = EUDRUploadedFilesModel.objects.create(
+            file_name='farms.csv', uploaded_by='geo')
+
+    def create_farm(self, polygon, polygon_type='Polygon', farmer_name='Farmer'):
+        return EUDRFarmModel.objects.create(
+            farmer_name=farmer_name, farm_size=1.0, farm_village="V", farm_district="D",
+            polygon=polygon, polygon_type=polygon_type, file_id=str(self.file.id))
+
+    def run_update(self, server):
+        with patch('eudr_backend.agstack.AG_BASE_URL', server.url), \
+                patch('eudr_backend.agstack.BACKOFF_SECONDS', 0):
+            update_geoid.now('geo')
+
+    def test_farms_are_registered_concurrently(self):
+        """Test that every polygon farm gets a geoid over bounded concurrent requests."""
+        for i in range(20):
+            self.create_farm([square_ring(30 + i * 0.02, -1.9, 0.01)],
+                             farmer_name=f"Farmer {i}")
+        self.create_farm([], polygon_type='Point')
+
+        with MockAgStackServer(delay=0.05) as server:
+            self.run_update(server)
+
+        self.assertEqual(EUDRFarmModel.objects.filter(
+            geoid__isnull=False).count(), 20)
+        self.assertEqual(server.logins, 1)
+        self.assertGreater(server.max_in_flight, 1)
+        self.assertLessEqual(server.max_in_flight, MAX_CONCURRENT_REQUESTS)
+
+    def test_multipolygon_farms_are_registered(self):
+        """Test that MultiPolygon farms, skipped before, are registered as one boundary."""
+        farm = self.create_farm([square_ring(30.0, -1.9, 0.01), square_ring(30.1, -1.9, 0.01)],
+                                polygon_type='MultiPolygon')
+        with MockAgStackServer() as server:
+            self.run_update(server)
+
+        farm.refresh_from_db()
+        self.assertEqual(farm.geoid, "geo-1")
+        self.assertTrue(next(iter(server.geoids)).startswith('MULTIPOLYGON'))
+
+    def test_token_is_reused_and_refreshed_when_rejected(self):
+        """Test that runs share a cached token and log in again only once it is rejected."""
+        with MockAgStackServer() as server:
+            self.create_farm([square_ring(30.0, -1.9, 0.01)])
+            self.run_update(server)
+            self.create_farm([square_ring(31.0, -1.9, 0.01)])
+            self.run_update(server)
+            self.assertEqual(server.logins, 1)
+
+            server.revoke_tokens()
+            self.create_farm([square_ring(32.0, -1.9, 0.01)])
+            self.run_update(server)
+            self.assertEqual(server.logins, 2)
+
+        self.assertFalse(EUDRFarmModel.objects.filter(
+            geoid__isnull=True).exists())
+
+    def test_transient_errors_are_retried(self):
+        """Test that unavailable responses are retried instead of ending the run."""
+        self.create_farm([square_ring(30.0, -1.9, 0.01)])
+        with MockAgStackServer(unavailable=2) as server:
+            self.run_update(server)
+
+        self.assertEqual(server.registrations, 3)
+        self.assertEqual(EUDRFarmModel.objects.get().geoid, "geo-1")
+
+    def test_already_registered_boundary_gets_matched_geoid(self):
+        """Test that a boundary known to the registry takes the geoid it matched."""
+        first = self.create_farm([square_ring(30.0, -1.9, 0.01)])
+        second = self.create_farm(
+            [square_ring(30.0, -1.9, 0.01)], farmer_name="Other")
+        with MockAgStackServer() as server:
+            self.run_update(server)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.geoid, second.geoid)
+
+    def test_boundary_wkt_keeps_stored_order_and_holes(self):
+        """Test the WKT sent for polygons with holes and for points."""
+        boundary = farm_boundary_wkt(
+            [square_ring(30.0, -1.9, 0.1), square_ring(30.02, -1.88, 0.01)], 'Polygon')
+        polygon = shapely.wkt.loads(boundary)
+        self.assertEqual(polygon.exterior.coords[0], (30.0, -1.9))
+        self.assertEqual(len(polygon.interiors), 1)
+        self.assertIsNone(farm_boundary_wkt([], 'Point'))
+
+
+class GeoidSchedulingTest(TestCase):
+    def setUp(self):
+        access_token.clear()
+        User.objects.create_user(username='geo', password='password123')
+        self.file = EUDRUploadedFilesModel.objects.create(
+            file_name='farms.csv', uploaded_by='geo')
+        self.farm = EUDRFarmModel.objects.create(
+            farmer_name="Farmer", farm_size=1.0, farm_village="V", farm_district="D",
+            polygon=[square_ring(30.0, -1.9, 0.01)], polygon_type="Polygon", file_id=str(self.file.id))
+
+    def pending_geoid_tasks(self):
+        return Task.objects.filter(task_name='eudr_backend.tasks.update_geoid')
+
+    def test_one_pending_job_per_user(self):
+        """Test that repeated uploads keep a single pending job per user."""
+        for _ in range(50):
+            schedule_geoid_registration('geo')
+        schedule_geoid_registration('other')
+        schedule_geoid_registration()
+
+        self.assertEqual(self.pending_geoid_tasks().count(), 3)
+        self.assertFalse(self.pending_geoid_tasks().filter(
+            repeat__gt=Task.NEVER).exists())
+
+    def test_claimed_farms_are_not_claimed_twice(self):
+        """Test that a second worker does not get farms claimed by the first one."""
+        self.assertEqual([farm.id for farm in claim_geoid_batch('geo')], [
+                         self.farm.id])
+        self.assertEqual(claim_geoid_batch('geo'), [])
+        self.assertEqual(claim_geoid_batch(), [])
+
+    def test_job_stops_when_no_work_is_left(self):
+        """Test that a job which registered every farm does not schedule another one."""
+        with MockAgStackServer() as server, patch('eudr_backend.agstack.AG_BASE_URL', server.url):
+            update_geoid.now(user_id='geo')
+
+        self.farm.refresh_from_db()
+        self.assertEqual(self.farm.geoid, "geo-1")
+        self.assertIsNone(self.farm.geoid_claimed_at)
+        self.assertFalse(self.pending_geoid_tasks().exists())
+
+    def test_failed_registrations_are_retried_until_attempts_run_out(self):
+        """Test that failures reschedule the job after the lease and give up after the last attempt."""
+        with MockAgStackServer(unavailable=1000) as server, \
+                patch('eudr_backend.agstack.AG_BASE_URL', server.url), \
+                patch('eudr_backend.agstack.BACKOFF_SECONDS', 0), \
+                patch('eudr_backend.tasks.GEOID_CLAIM_LEASE', datetime.timedelta(0)):
+            update_geoid.now(user_id='geo')
+            self.farm.refresh_from_db()
+            self.assertEqual(self.farm.geoid_attempts, 1)
+            self.assertEqual(self.pending_geoid_tasks().count(), 1)
+
+            for _ in range(GEOID_MAX_ATTEMPTS):
+                self.pending_geoid_tasks().delete()
+                update_geoid.now(user_id='geo')
+
+        self.farm.refresh_from_db()
+        self.assertIsNone(self.farm.geoid)
+        self.assertEqual(self.farm.geoid_attempts, GEOID_MAX_ATTEMPTS)
+        self.assertFalse(self.pending_geoid_tasks().exists())
+
+
+def lon_lat_to_tile(lon, lat, z):
+    n = 2 ** z
+    y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    return z, int((lon + 180) / 360 * n), int(y)
+
+
+class FarmTileTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='tiles', password='password123')
+        other = User.objects.create_user(
+            username='othertiles', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.file = EUDRUploadedFilesModel.objects.create(
+            file_name='farms.csv', uploaded_by='tiles')
+        other_file = EUDRUploadedFilesModel.objects.create(
+            file_name='other.csv', uploaded_by=other.username)
+        self.farm = EUDRFarmModel.objects.create(
+            farmer_name="Mine", farm_size=1.0, farm_village="V", farm_district="D",
+            polygon=[square_ring(30.0, -1.9, 0.001)], polygon_type="Polygon",
+            analysis={"eudr_risk_level": "high"}, file_id=str(self.file.id))
+        EUDRFarmModel.objects.create(
+            farmer_name="Theirs", farm_size=1.0, farm_village="V", farm_district="D",
+            polygon=[square_ring(30.0002, -1.9, 0.001)], polygon_type="Polygon",
+            file_id=str(other_file.id))
+
+    def get_tile(self, z, x, y):
+        return self.client.get(reverse('retrieve_farm_tile', args=[z, x, y]))
+
+    def test_tile_bounds(self):
+        """Test the XYZ tile math against known tiles."""
+        self.assertEqual(tile_bounds(0, 0, 0)[0], -180)
+        self.assertAlmostEqual(tile_bounds(0, 0, 0)[3], 85.0511, places=4)
+        self.assertEqual(tile_bounds(1, 1, 1)[:3], (0, tile_bounds(1, 1, 1)[1], 180))
+
+    def test_tile_contains_only_visible_farms(self):
+        """Test that a tile holds the user's farms in it and nothing from other tiles."""
+        response = self.get_tile(*lon_lat_to_tile(30.0005, -1.8995, 16))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        features = response.data['features']
+        self.assertEqual([feature['id'] for feature in features], [self.farm.id])
+        self.assertEqual(features[0]['geometry']['type'], 'Polygon')
+        self.assertEqual(features[0]['properties']['eudr_risk_level'], 'high')
+
+        self.assertEqual(self.get_tile(
+            *lon_lat_to_tile(10.0, 10.0, 16)).data['features'], [])
+
+    def test_low_zooms_send_points(self):
+        """Test that plots become points when they are too small to be drawn."""
+        features = self.get_tile(
+            *lon_lat_to_tile(30.0005, -1.8995, 5)).data['features']
+        self.assertEqual(features[0]['geometry']['type'], 'Point')
+
+    def test_tiles_are_cached_until_farms_change(self):
+        """Test that repeated tiles only read the version of the farms, and saves and deletes refresh them."""
+        tile = lon_lat_to_tile(30.0005, -1.8995, 16)
+        self.get_tile(*tile)
+        with self.assertNumQueries(1):
+            self.get_tile(*tile)
+
+        err, _ = bulk_save_farm_data([{
+            "farmer_name": "New", "farm_size": 1.0, "collection_site": "Site",
+            "farm_village": "V", "farm_district": "D", "latitude": -1.8995, "longitude": 30.0005,
+            "polygon": [], "polygon_type": "Point", "file_id": str(self.file.id)}])
+        self.assertIsNone(err)
+        self.assertEqual(len(self.get_tile(*tile).data['features']), 2)
+
+        EUDRFarmModel.objects.filter(farmer_name="New").delete()
+        self.assertEqual(len(self.get_tile(*tile).data['features']), 1)
+
+    def test_tiles_use_the_version_of_the_map(self):
+        """Test that tiles requested with the version the map was loaded with skip the version query."""
+        tile = lon_lat_to_tile(30.0005, -1.8995, 16)
+        version = farm_tiles_version(EUDRFarmModel.objects.visible_to(self.user))
+        self.client.get(reverse('retrieve_farm_tile', args=tile), {'v': version})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('retrieve_farm_tile', args=tile), {'v': version})
+        self.assertEqual([feature['id'] for feature in response.data['features']], [self.farm.id])
+
+    def test_tiles_of_a_file_flag_overlaps(self):
+        """Test that file and overlap scoped tiles hold the farms of the file with their overlap flag."""
+        other = EUDRFarmModel.objects.get(farmer_name="Theirs")
+        update_farm_overlaps([self.farm.id, other.id])
+        tile = reverse('retrieve_farm_tile', args=lon_lat_to_tile(30.0005, -1.8995, 16))
+
+        features = self.client.get(tile, {'file-id': other.file_id}).data['features']
+        self.assertEqual([feature['id'] for feature in features], [other.id])
+        self.assertTrue(features[0]['properties']['overlapping'])
+        features = self.client.get(tile, {'file-id': self.file.id, 'overlaps': 'true'}).data['features']
+        self.assertEqual([feature['id'] for feature in features], [self.farm.id])
+
+    def test_tile_out_of_range(self):
+        """Test that tiles outside the zoom level grid do not exist."""
+        self.assertEqual(self.get_tile(2, 4, 0).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.get_tile(30, 0, 0).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+
+class FakeEarthEngineClient:
+    """
+    Stands in for Earth Engine, counting the calls the registry makes.
+    """
+
+    def __init__(self):
+        self.initialize_calls = 0
+        self.tile_url_calls = 0
+
+    def initialize(self):
+        self.initialize_calls += 1
+
+    def tile_url(self, image, vis_params):
+        self.tile_url_calls += 1
+        return f"https://earthengine.test/{image}/{self.tile_url_calls}/{{z}}/{{x}}/{{y}}"
+
+
+class LayerRegistryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = FakeEarthEngineClient()
+        # images are plain names, nothing is sent to Earth Engine
+        layers = [dict(layer, image=lambda key=layer['key']: key)
+                  for layer in REFERENCE_LAYERS]
+        self.registry = LayerRegistry(client=self.client, layers=layers)
+
+    def test_urls_are_computed_once(self):
+        """Test that the tile URLs are shared through the cache after the first build."""
+        urls = self.registry.tile_urls()
+        self.assertEqual(set(urls), {layer['key'] for layer in REFERENCE_LAYERS})
+        self.assertEqual(self.client.initialize_calls, 1)
+        self.assertEqual(self.client.tile_url_calls, len(REFERENCE_LAYERS))
+
+        other_registry = LayerRegistry(
+            client=FakeEarthEngineClient(), layers=self.registry.layers)
+        self.assertEqual(other_registry.tile_urls(), urls)
+        self.assertEqual(self.registry.tile_urls(), urls)
+        self.assertEqual(other_registry.client.tile_url_calls, 0)
+        self.assertEqual(self.client.tile_url_calls, len(REFERENCE_LAYERS))
+
+    def test_stale_urls_are_refreshed_in_background(self):
+        """Test that stale URLs are still served while one thread of the process refreshes them."""
+        urls = self.registry.tile_urls()
+        entry = cache.get(LAYER_URLS_CACHE_KEY)
+        entry['built_at'] -= LAYER_URLS_REFRESH_AFTER + 1
+        cache.set(LAYER_URLS_CACHE_KEY, entry)
+
+        # a refresh is already running, no other one starts
+        self.registry.refresh_lock.acquire()
+        self.assertEqual(self.registry.tile_urls(), urls)
+        self.assertEqual(self.registry.tile_urls(), urls)
+        self.assertIsNone(self.registry.refresh())
+        self.assertEqual(self.client.tile_url_calls, len(REFERENCE_LAYERS))
+        self.registry.refresh_lock.release()
+
+        self.registry.refresh().join()
+        self.assertNotEqual(self.registry.tile_urls(), urls)
+        self.assertEqual(self.client.tile_url_calls, 2 * len(REFERENCE_LAYERS))
+
+    def test_expired_urls_are_rebuilt(self):
+        """Test that the URLs are rebuilt once they dropped out of the cache."""
+        first = self.registry.tile_urls()
+        cache.delete(LAYER_URLS_CACHE_KEY)
+        second = self.registry.tile_urls()
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.client.initialize_calls, 2)
+
+    def test_tile_layers(self):
+        """Test that the map layers use the cached URLs and start hidden."""
+        urls = self.registry.tile_urls()
+        layers = self.registry.tile_layers()
+        self.assertEqual([layer.layer_name for layer in layers],
+                         [layer['name'] for layer in REFERENCE_LAYERS])
+        self.assertEqual([layer.tiles for layer in layers],
+                         [urls[layer['key']] for layer in REFERENCE_LAYERS])
+        self.assertFalse(any(layer.show for layer in layers))
+
+
+class FakeCredentials:
+    expired = False
+
+
+class FakeCredentialsBackend:
+    """
+    Stands in for the service account backend, counting the initializations.
+    """
+
+    def __init__(self, delay=0, error=None):
+        self.delay = delay
+        self.error = error
+        self.initializations = 0
+
+    def credentials(self):
+        return FakeCredentials()
+
+    def initialize(self, credentials):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        self.initializations += 1
+
+
+class EarthEngineSessionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.backend = FakeCredentialsBackend()
+        self.session = EarthEngineSession(backend=self.backend)
+        self.user = User.objects.create_user(
+            username='eehealth', password='password123')
+        Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(User.objects.create_superuser(
+            username='eeadmin', password='password123'))
+
+    def tearDown(self):
+        earth_engine_session.reset()
+
+    def test_map_requests_initialize_once(self):
+        """Test that N map requests cause exactly one Earth Engine initialization."""
+        # the reference layers are served from the cache, nothing reaches Earth Engine
+        cache.set(LAYER_URLS_CACHE_KEY, {
+            "urls": {layer['key']: f"https://earthengine.test/{layer['key']}/{{z}}/{{x}}/{{y}}" for layer in REFERENCE_LAYERS},
+            "built_at": time.time(),
+        })
+        earth_engine_session.reset()
+        with patch.object(earth_engine_session, 'backend', self.backend):
+            for _ in range(5):
+                response = self.client.get(reverse('map_view'))
+                self.assertEqual(response.status_code, 200)
+
+            self.assertEqual(self.backend.initializations, 1)
+            metrics = self.admin_client.get(
+                reverse('retrieve_earth_engine_health')).json()
+        self.assertTrue(metrics['initialized'])
+        self.assertEqual(metrics['initializations'], 1)
+        self.assertIsNotNone(metrics['last_initialization_ms'])
+
+    def test_concurrent_requests_initialize_once(self):
+        """Test that requests arriving during the initialization wait for it."""
+        self.backend.delay = 0.05
+        threads = [threading.Thread(target=self.session.ensure_initialized)
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.backend.initializations, 1)
+
+    def test_expired_credentials_initialize_again(self):
+        """Test that the session initializes again once its credentials expired."""
+        self.session.ensure_initialized()
+        self.session.ensure_initialized()
+        self.session.credentials.expired = True
+        self.session.ensure_initialized()
+        self.assertEqual(self.backend.initializations, 2)
+        self.assertEqual(self.session.metrics()['initializations'], 2)
+
+    def test_failed_initialization_is_reported(self):
+        """Test that a failed initialization is retried and reported as unhealthy."""
+        earth_engine_session.reset()
+        failing = FakeCredentialsBackend(error=RuntimeError('invalid grant'))
+        with patch.object(earth_engine_session, 'backend', failing):
+            with self.assertRaises(RuntimeError):
+                earth_engine_session.ensure_initialized()
+            with self.assertRaises(RuntimeError):
+                earth_engine_session.ensure_initialized()
+            response = self.admin_client.get(
+                reverse('retrieve_earth_engine_health'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['failures'], 2)
+        self.assertEqual(response.json()['last_error'], 'invalid grant')
+        self.assertFalse(response.json()['initialized'])
+
+    def test_health_requires_superuser(self):
+        """Test that the session metrics, which include the last error, are hidden from regular users."""
+        response = self.client.get(reverse('retrieve_earth_engine_health'))
+        self.assertEqual(response.status_code, 403)
+
+
+class FarmQueryServiceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='mapper', password='password123')
+        Token.objects.create(user=self.user)
+        other = User.objects.create_user(
+            username='othermapper', password='password123')
+        self.file = EUDRUploadedFilesModel.objects.create(
+            file_name='mine.csv', uploaded_by=self.user.username)
+        other_file = EUDRUploadedFilesModel.objects.create(
+            file_name='theirs.csv', uploaded_by=other.username)
+        self.first = self.create_farm("First", 30.0, self.file)
+        self.second = self.create_farm("Second", 30.005, self.file)
+        self.alone = self.create_farm("Alone", 31.0, self.file)
+        self.theirs = self.create_farm("Theirs", 32.0, other_file)
+        update_farm_overlaps([self.first.id, self.second.id])
+
+    def create_farm(self, farmer_name, lon, file):
+        return EUDRFarmModel.objects.create(
+            farmer_name=farmer_name, farm_size=1.0, farm_village="V", farm_district="D",
+            latitude=-1.9, longitude=lon, polygon=[square_ring(lon, -1.9, 0.01)],
+            polygon_type="Polygon", analysis={"eudr_risk_level": "low"}, file_id=str(file.id))
+
+    def test_rows_are_plain_dicts(self):
+        """Test that the map reads plain rows of the fields it draws."""
+        rows = map_farm_rows(self.user)
+        self.assertEqual({row['id'] for row in rows},
+                         {self.first.id, self.second.id, self.alone.id})
+        self.assertTrue(all(type(row) is dict for row in rows))
+        self.assertEqual(set(rows[0]), set(MAP_FIELDS))
+
+    def test_map_variants(self):
+        """Test the single farm, file and overlap variants of the map rows."""
+        self.assertEqual([row['id'] for row in map_farm_rows(self.user, farm_id=self.theirs.id)],
+                         [self.theirs.id])
+        self.assertEqual(len(map_farm_rows(self.user, file_id=str(self.file.id))), 3)
+        overlapping = map_farm_rows(
+            self.user, file_id=str(self.file.id), overlaps_only=True)
+        self.assertEqual({row['id'] for row in overlapping},
+                         {self.first.id, self.second.id})
+
+    def test_overlap_variant_uses_subqueries(self):
+        """Test that the overlapping farms are matched in one query, without a bound id per farm."""
+        with self.assertNumQueries(1):
+            rows = map_farm_rows(self.user, file_id=str(self.file.id), overlaps_only=True)
+        self.assertEqual(len(rows), 2)
+
+    def test_rows_match_the_api(self):
+        """Test that the map rows hold the same farms the REST listing returns."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        listed = client.get(reverse('retrieve_map_data')).json()
+        rows = map_farm_rows(self.user)
+        self.assertEqual([farm['id'] for farm in listed], [row['id'] for row in rows])
+        self.assertEqual([farm['polygon'] for farm in listed], [row['polygon'] for row in rows])
+
+    def test_map_view_does_not_call_the_api(self):
+        """Test that map_view reads the farms without a loopback HTTP request."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with patch('requests.get', side_effect=AssertionError('loopback request')) as loopback, \
+                patch('my_eudr_app.map_views.map_farms', return_value=EUDRFarmModel.objects.none()) as rows, \
+                patch.object(earth_engine_session, 'backend', FakeCredentialsBackend()), \
+                patch('my_eudr_app.map_views.layer_registry', LayerRegistry(client=FakeEarthEngineClient(), layers=[])):
+            response = client.get(reverse('map_view'), {'file-id': self.file.id})
+        earth_engine_session.reset()
+
+        self.assertEqual(response.status_code, 200)
+        loopback.assert_not_called()
+        rows.assert_called_once_with(
+            self.user, file_id=str(self.file.id), farm_id=None, overlaps_only=None)
+
+    def test_map_loads_farm_tiles(self):
+        """Test that the map hands its farms to the tile layer instead of embedding them."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with patch.object(earth_engine_session, 'backend', FakeCredentialsBackend()), \
+                patch('my_eudr_app.map_views.layer_registry', LayerRegistry(client=FakeEarthEngineClient(), layers=[])):
+            response = client.get(reverse('map_view'), {'file-id': self.file.id})
+        earth_engine_session.reset()
+
+        map_html = response.json()['map_html']
+        self.assertIn('addFarmTileLayer', map_html)
+        self.assertIn(farm_tiles_version(EUDRFarmModel.objects.filter(file_id=str(self.file.id))), map_html)
+        self.assertNotIn('First', map_html)
+
+
+class FarmGeometryColumnsTest(TestCase):
+    def create_farm(self, polygon, polygon_type="Polygon", latitude=-1.9, longitude=30.0):
+        return EUDRFarmModel.objects.create(
+            farmer_name="Geo", farm_size=1.0, farm_village="V", farm_district="D",
+            latitude=latitude, longitude=longitude, polygon=polygon, polygon_type=polygon_type)
+
+    def test_polygon_columns(self):
+        """Test that saving a polygon stores its WKB, box, centroid, area and vertices."""
+        farm = self.create_farm([square_ring(30.0, -1.9, 0.01)])
+        farm.refresh_from_db()
+
+        self.assertTrue(farm.geometry_is_valid)
+        self.assertEqual(shapely.from_wkb(bytes(farm.geometry_wkb)),
+                         Polygon(square_ring(30.0, -1.9, 0.01)))
+        self.assertEqual((farm.bbox_min_lon, farm.bbox_min_lat, farm.bbox_max_lon, farm.bbox_max_lat),
+                         (30.0, -1.9, 30.01, -1.89))
+        self.assertAlmostEqual(farm.centroid_lon, 30.005)
+        self.assertAlmostEqual(farm.centroid_lat, -1.895)
+        # a 0.01 degree square near the equator is roughly 123 ha
+        self.assertAlmostEqual(farm.area_ha, 123, delta=1)
+        self.assertEqual(farm.vertex_count, 5)
+
+    def test_point_and_invalid_columns(self):
+        """Test that points keep their coordinates and self-intersecting rings are flagged."""
+        point = self.create_farm([], polygon_type="Point")
+        self.assertTrue(point.geometry_is_valid)
+        self.assertEqual((point.bbox_min_lon, point.bbox_min_lat), (30.0, -1.9))
+        self.assertEqual((point.area_ha, point.vertex_count), (0, 1))
+
+        bowtie = self.create_farm(
+            [[[30.0, -1.9], [30.01, -1.89], [30.01, -1.9], [30.0, -1.89], [30.0, -1.9]]])
+        self.assertFalse(bowtie.geometry_is_valid)
+        self.assertIsNone(bowtie.area_ha)
+        self.assertEqual(bowtie.bbox_max_lon, 30.01)
+
+    def test_columns_follow_updates(self):
+        """Test that bulk saves and edits keep the columns in step with the polygon."""
+        errors, records = bulk_save_farm_data([{
+            "farmer_name": "Bulk", "farm_size": 1.0, "collection_site": "Site", "farm_village": "V",
+            "farm_district": "D", "latitude": -1.9, "longitude": 31.0,
+            "polygon": [square_ring(31.0, -1.9, 0.01)], "polygon_type": "Polygon", "file_id": "1",
+        }])
+        self.assertIsNone(errors)
+        farm = EUDRFarmModel.objects.get(id=records[0].id)
+        self.assertEqual(farm.bbox_min_lon, 31.0)
+        self.assertIsNotNone(farm.geometry_wkb)
+
+        farm.polygon = [square_ring(32.0, -1.9, 0.02)]
+        farm.save()
+        farm.refresh_from_db()
+        self.assertEqual(farm.bbox_max_lon, 32.02)
+
+    def test_wkb_is_not_serialized(self):
+        """Test that the API returns the derived columns but not the WKB."""
+        farm = self.create_farm([square_ring(30.0, -1.9, 0.01)])
+        data = EUDRFarmModelSerializer(farm).data
+        self.assertNotIn('geometry_wkb', data)
+        self.assertEqual(data['vertex_count'], 5)
+
+
+class CSVValidatorTest(TestCase):
+    header = ['farmer_name', 'farm_size', 'collection_site', 'farm_district',
+              'farm_village', 'latitude', 'longitude', 'polygon']
+
+    def row(self, farm_size='1.5', latitude='-1.9', longitude='30.0', polygon=None):
+        if polygon is None:
+            polygon = json.dumps(square_ring(30.0, -1.9, 0.01))
+        return ['Farmer', farm_size, 'Site', 'District', 'Village', latitude, longitude, polygon]
+
+    def test_valid_rows(self):
+        """Test that plain rings, nested rings, 3D points and points pass."""
+        ring = square_ring(30.0, -1.9, 0.01)
+        rows = [self.header,
+                self.row(),
+                self.row(polygon=json.dumps([ring])),
+                self.row(polygon=json.dumps([point + [1200] for point in ring])),
+                self.row(latitude='', longitude='', polygon=''),
+                ['Farmer', '2']]
+        self.assertEqual(validate_csv(rows), [])
+
+    def test_row_errors(self):
+        """Test that each bad cell is reported once, in record order."""
+        rows = [self.header,
+                self.row(farm_size='abc', latitude='north'),
+                self.row(polygon='[[30.0, -1.9], [30.01'),
+                self.row(polygon='[[30.0, -1.9]]'),
+                self.row(polygon='[[0, 0], [1, 1], [1, 0], [0, 1], [0, 0]]'),
+                self.row(polygon='[[30.0, "north"], [30.01, -1.9], [30.01, -1.89]]'),
+                self.row()]
+        self.assertEqual(validate_csv(rows), [
+            {"record": 1, "field": "farm_size", "message": '"farm_size" must be a number.'},
+            {"record": 1, "field": "latitude", "message": '"latitude" must be a number.'},
+            {"record": 2, "field": "polygon", "message": '"polygon" must be a valid list.'},
+            {"record": 3, "field": "polygon", "message": 'Should have valid polygon format.'},
+            {"record": 4, "field": "polygon", "message": '"polygon" must be a valid polygon geometry.'},
+            {"record": 5, "field": "polygon", "message": 'Should have valid polygon format.'},
+        ])
+
+    def test_header_errors(self):
+        """Test that a bad header is reported before any row is read."""
+        self.assertEqual(validate_csv([])[0]['message'], 'The file is empty.')
+        errors = validate_csv([self.header + ['colour'], self.row()])
+        self.assertEqual(errors, [{"record": None, "field": "colour",
+                                   "message": '"colour" is not a valid field.'}])
+
+    def test_errors_are_capped(self):
+        """Test that validation stops once the error cap is reached."""
+        rows = [self.header] + [self.row(farm_size='x') for _ in range(500)]
+        errors = validate_csv(rows, max_errors=10)
+        self.assertEqual(len(errors), 11)
+        self.assertEqual(errors[-1]['message'], 'Validation stopped after 10 errors.')
+
+    def test_plain_and_json_parsers_agree(self):
+        """Test that a chunk falling back to the json parser gets the same errors."""
+        rows = [self.header] + [self.row(polygon=json.dumps(
+            square_ring(30.0 + i * 0.02, -1.9, 0.01))) for i in range(50)]
+        rows.append(self.row(polygon='[[0, 0], [1, 1], [1, 0], [0, 1]]'))
+        expected = validate_csv(rows)
+        # an empty number sends the whole chunk through the json parser
+        rows.append(self.row(polygon='[[0, 0], [1, , 1], [1, 0]]'))
+        self.assertEqual(validate_csv(rows), expected + [
+            {"record": 52, "field": "polygon", "message": '"polygon" must be a valid list.'}])
+
+
+class GeoJSONValidatorTest(TestCase):
+    def feature(self, geometry, **properties):
+        return {"type": "Feature", "geometry": geometry, "properties": {
+            "farmer_name": "Farmer", "farm_village": "Village", "farm_district": "District",
+            "farm_size": 1.5, "latitude": -1.9, "longitude": 30.0} | properties}
+
+    def collection(self, *features):
+        return {"type": "FeatureCollection", "features": list(features)}
+
+    def polygon(self, ring=None):
+        return {"type": "Polygon", "coordinates": [ring or square_ring(30.0, -1.9, 0.01)]}
+
+    def test_valid_features(self):
+        """Test that points, polygons and multipolygons pass."""
+        ring = square_ring(30.0, -1.9, 0.01)
+        errors = validate_geojson(self.collection(
+            self.feature({"type": "Point", "coordinates": [30.0, -1.9]}),
+            self.feature(self.polygon(), farm_size=6),
+            self.feature({"type": "MultiPolygon", "coordinates": [[ring], [square_ring(31.0, -1.9, 0.01)]]})))
+        self.assertEqual(errors, [])
+
+    def test_all_errors_reported(self):
+        """Test that every feature is checked, not only those before the first error."""
+        bowtie = [[0, 0], [1, 1], [1, 0], [0, 1], [0, 0]]
+        errors = validate_geojson(self.collection(
+            self.feature(self.polygon(), farmer_name=None),
+            self.feature(self.polygon(square_ring(30.0, -1.9, 0.01)[:2])),
+            self.feature({"type": "Point", "coordinates": [30.0, -1.9]}, farm_size=4),
+            self.feature(self.polygon(bowtie), farm_size=5),
+            self.feature(self.polygon(bowtie)),
+            self.feature({"type": "Point", "coordinates": [200.0, -1.9]}),
+            self.feature({"type": "Polygon", "coordinates": [[[30.0, "x"], [30.0, -1.9]]]}),
+            self.feature({"type": "LineString", "coordinates": []}),
+            {"type": "Thing"}))
+        self.assertEqual([(error['record'], error['message']) for error in errors], [
+            (1, 'Invalid GeoJSON properties. Missing or invalid "farmer_name"'),
+            (2, 'Invalid GeoJSON coordinates. Must be a list of lists with at least 4 coordinates'),
+            (3, 'Invalid record. Farm size must be less than 4 hectares for a point geometry'),
+            (4, 'Invalid GeoJSON coordinates. Must be a valid polygon'),
+            # self-intersecting plots are rejected whatever their size
+            (5, 'Invalid GeoJSON coordinates. Must be a valid polygon'),
+            (6, 'Invalid GeoJSON coordinates. Longitude must be between -180 and 180 and latitude between -90 and 90'),
+            (7, 'Invalid GeoJSON coordinates. Must be a list of lists with 2 numbers'),
+            (8, 'Invalid GeoJSON geometry type. Must be Point, Polygon or MultiPolygon'),
+            (9, 'Invalid GeoJSON feature. Must be Feature'),
+        ])
+
+    def test_unclosed_rings_and_3d_positions(self):
+        """Test that rings the GeoJSON reader refuses get the error of what is wrong with them."""
+        errors = validate_geojson(self.collection(
+            self.feature(self.polygon(square_ring(30.0, -1.9, 0.01)[:-1])),
+            self.feature(self.polygon([point + [1.0] for point in square_ring(30.0, -1.9, 0.01)])),
+            self.feature({"type": "Point", "coordinates": ["30.0", -1.9]}),
+            self.feature({"type": "MultiPolygon", "coordinates": []})))
+        self.assertEqual([(error['record'], error['message']) for error in errors], [
+            (2, 'Invalid GeoJSON coordinates. Must be a list of lists with 2 numbers'),
+            (3, 'Invalid GeoJSON coordinates. Must be a list of 2 numbers'),
+            (4, 'Invalid GeoJSON coordinates. Must be a list of lists'),
+        ])
+
+    def test_collection_errors(self):
+        """Test that a document that is not a FeatureCollection is reported without a record."""
+        self.assertEqual(validate_geojson({"type": "Feature"}), [
+            {"record": None, "field": "type", "message": 'Invalid GeoJSON type. Must be FeatureCollection'},
+            {"record": None, "field": "features", "message": 'Invalid GeoJSON features. Must be a list'},
+        ])
+
+    def test_errors_are_capped(self):
+        """Test that the errors stop at the cap."""
+        features = [self.feature(self.polygon(), farm_size="x") for _ in range(50)]
+        errors = validate_geojson(self.collection(*features), max_errors=10)
+        self.assertEqual(len(errors), 11)
+        self.assertEqual(errors[-1]['message'], 'Validation stopped after 10 errors.')
+
+
+class SyncFarmDataTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def backup(self, device_id, site_name, farms):
+        return {
+            "device_id": device_id,
+            "collection_site": {"name": site_name, "agent_name": "agent", "email": "agent@example.com",
+                                "village": "kitabi", "district": "nyamagabe"},
+            "farms": [{"remote_id": remote_id, "farmer_name": f"Farmer {remote_id}", "size": size,
+                       "village": "kitabi", "district": "nyamagabe", "latitude": -1.93,
+                       "longitude": 30.13, "coordinates": [], "accuracies": []}
+                      for remote_id, size in farms],
+        }
+
+    def sync(self, data, **extra):
+        return self.client.post(reverse('sync_farm_data'), data, format='json', **extra)
+
+    def test_sync_inserts_then_updates_in_bulk(self):
+        """Test that a sync takes the same number of queries however many farms it holds."""
+        farms = [(f"farm_{i}", 1.0) for i in range(200)]
+        with CaptureQueriesContext(connection) as inserts:
+            response = self.sync([self.backup("device_1", "Site A", farms)])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['synced_remote_ids'], [remote_id for remote_id, _ in farms])
+        self.assertLess(len(inserts), 12)
+
+        farms = [(f"farm_{i}", 2.0) for i in range(250)]
+        with CaptureQueriesContext(connection) as updates:
+            response = self.sync([self.backup("device_2", "Site A", farms)])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLess(len(updates), 12)
+
+        site = EUDRCollectionSiteModel.objects.get()
+        self.assertEqual(site.device_id, "device_2")
+        self.assertEqual(EUDRFarmBackupModel.objects.count(), 250)
+        self.assertFalse(EUDRFarmBackupModel.objects.exclude(size=2.0).exists())
+        self.assertFalse(EUDRFarmBackupModel.objects.exclude(site_id=site).exists())
+
+    def test_duplicate_remote_ids_keep_the_last_row(self):
+        """Test that a farm sent twice in one sync is saved once, with its last values."""
+        response = self.sync([self.backup("device_1", "Site A", [("farm_1", 1.0)]),
+                              self.backup("device_1", "Site B", [("farm_1", 3.0)])])
+        self.assertEqual(response.data['synced_remote_ids'], ["farm_1", "farm_1"])
+        farm = EUDRFarmBackupModel.objects.get()
+        self.assertEqual((farm.size, farm.site_id.name), (3.0, "Site B"))
+
+    def test_gzip_body(self):
+        """Test that a gzip-compressed body is synced like a plain one."""
+        body = gzip.compress(json.dumps(
+            [self.backup("device_1", "Site A", [("farm_1", 1.0)])]).encode())
+        response = self.client.post(reverse('sync_farm_data'), body, content_type='application/json',
+                                    HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['synced_remote_ids'], ["farm_1"])
+
+        response = self.client.post(reverse('sync_farm_data'), b'not gzip', content_type='application/json',
+                                    HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bad_entry_saves_nothing(self):
+        """Test that a sync with an unknown field is rejected as a whole."""
+        bad = self.backup("device_1", "Site B", [("farm_2", 1.0)])
+        bad["farms"][0]["colour"] = "red"
+        response = self.sync([self.backup("device_1", "Site A", [("farm_1", 1.0)]), bad])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(EUDRCollectionSiteModel.objects.exists())
+        self.assertFalse(EUDRFarmBackupModel.objects.exists())
+
+    def test_restored_farms_sync_back(self):
+        """Test that a restore echoed back through sync is accepted, ignoring its ids and timestamps."""
+        self.sync([self.backup("device_1", "Site A", [("farm_1", 1.0)])])
+        restored = json.loads(b''.join(self.restore().streaming_content))
+        # a device that edits a farm drops or recomputes its content hash
+        restored[0]["farms"][0]["size"] = 2.0
+        del restored[0]["farms"][0]["content_hash"]
+        response = self.sync(restored)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['synced_remote_ids'], ["farm_1"])
+        farm = EUDRFarmBackupModel.objects.get()
+        self.assertEqual((farm.size, farm.site_id.name), (2.0, "Site A"))
+
+    def test_form_body_is_parsed(self):
+        """Test that form bodies still reach the view rather than being refused by the parsers."""
+        response = self.client.post(reverse('sync_farm_data'), {"device_id": "device_1"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unchanged_farms_are_not_written(self):
+        """Test that farms whose content hash did not change are skipped."""
+        farms = [(f"farm_{i}", 1.0) for i in range(5)]
+        self.sync([self.backup("device_1", "Site A", farms)])
+        EUDRFarmBackupModel.objects.update(updated_at=timezone.now() - datetime.timedelta(days=1))
+
+        farms[2] = ("farm_2", 2.0)
+        response = self.sync([self.backup("device_1", "Site A", farms)])
+        self.assertEqual(len(response.data['synced_remote_ids']), 5)
+        changed = EUDRFarmBackupModel.objects.filter(
+            updated_at__gt=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual([farm.remote_id for farm in changed], ["farm_2"])
+        self.assertEqual(changed[0].size, 2.0)
+
+    def restore(self, **data):
+        return self.client.post(reverse('restore_farm_data'), {"device_id": "device_1"} | data, format='json')
+
+    def test_delta_restore(self):
+        """Test that a restore since a watermark returns the changed farms and the deleted ones."""
+        self.sync([self.backup("device_1", "Site A", [(f"farm_{i}", 1.0) for i in range(4)])])
+        EUDRFarmBackupModel.objects.update(updated_at=timezone.now() - datetime.timedelta(days=1))
+        watermark = (timezone.now() - datetime.timedelta(hours=1)).isoformat()
+
+        entry = self.backup("device_1", "Site A", [("farm_1", 5.0)])
+        entry["deleted_remote_ids"] = ["farm_3"]
+        response = self.sync([entry])
+        self.assertEqual(response.data['deleted_remote_ids'], ["farm_3"])
+
+        response = self.restore(since=watermark)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([farm['remote_id'] for farm in response.data['results'][0]['farms']], ["farm_1"])
+        self.assertEqual([tombstone['remote_id'] for tombstone in response.data['deleted']], ["farm_3"])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(self.restore(since='yesterday').status_code, status.HTTP_400_BAD_REQUEST)
+
+        # syncing a deleted farm again brings it back
+        self.sync([self.backup("device_1", "Site A", [("farm_3", 1.0)])])
+        self.assertEqual(self.restore(since=watermark).data['deleted'], [])
+
+    def test_restore_pages(self):
+        """Test that paging through a restore returns every farm once."""
+        self.sync([self.backup("device_1", "Site A", [(f"farm_{i}", 1.0) for i in range(5)])])
+        remote_ids = []
+        page = self.restore(page_size=2).data
+        while True:
+            remote_ids += [farm['remote_id'] for site in page['results'] for farm in site['farms']]
+            if not page['next']:
+                break
+            page = self.restore(page_size=2, cursor=page['next']).data
+        self.assertEqual(sorted(remote_ids), [f"farm_{i}" for i in range(5)])
+        self.assertEqual(self.restore(cursor='nope').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_full_restore_is_streamed_in_two_queries(self):
+        """Test that a full restore reads sites and farms with one query each, however many sites match."""
+        self.sync([self.backup("device_1", f"Site {i}", [(f"farm_{i}_{j}", 1.0) for j in range(3)])
+                   for i in range(5)] + [self.backup("device_1", "Site without farms", [])])
+        expected = [{
+            "device_id": site.device_id,
+            "collection_site": EUDRCollectionSiteModelSerializer(site).data,
+            "farms": EUDRFarmBackupModelSerializer(
+                EUDRFarmBackupModel.objects.filter(site_id=site).order_by('id'), many=True).data,
+        } for site in EUDRCollectionSiteModel.objects.order_by('id')]
+
+        response = self.restore()
+        with self.assertNumQueries(2):
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(content), json.loads(json.dumps(expected)))
+        self.assertEqual(b''.join(self.client.post(
+            reverse('restore_farm_data'), {"device_id": "device_9"}, format='json').streaming_content), b'[]')
+
+
+class DashboardMetricsTest(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.last_week = self.today - datetime.timedelta(days=7)
+        User.objects.create_user(username='dashboard', password='password123')
+        self.file = EUDRUploadedFilesModel.objects.create(
+            file_name='farms.csv', uploaded_by='dashboard')
+        for i, risk in enumerate(['low', 'low', 'high', 'more_info_needed']):
+            self.add_farm(risk, f"Farmer {i}")
+        old = self.add_farm('high', "Old farmer")
+        EUDRFarmModel.objects.filter(id=old.id).update(
+            created_at=timezone.now() - datetime.timedelta(days=7), updated_at=timezone.now() - datetime.timedelta(days=7))
+        EUDRCollectionSiteModel.objects.create(name="Site A", village="V", district="D")
+
+    def add_farm(self, risk, farmer_name):
+        return EUDRFarmModel.objects.create(
+            farmer_name=farmer_name, farm_size=1.0, farm_village="V", farm_district="D",
+            polygon=[square_ring(30.0, -1.9, 0.001)], polygon_type="Polygon",
+            analysis={"eudr_risk_level": risk}, file_id=str(self.file.id))
+
+    def metrics(self, start, end):
+        with patch('eudr_backend.views.get_filtered_files_uploaded', return_value=(0, [])):
+            return self.client.get(reverse('dashboard_metrics'), {
+                'startDate': start.isoformat(), 'endDate': end.isoformat()}).json()
+
+    def test_rollups_are_summed_over_the_range(self):
+        """Test that the dashboard counts come from the daily rollups, with the stored risk key."""
+        refresh_dashboard_metrics()
+        with self.assertNumQueries(1):
+            totals = dashboard_totals(self.last_week, self.today)
+        self.assertEqual((totals['farms'], totals['low_risk_farms'], totals['high_risk_farms'],
+                          totals['more_info_needed_farms']), (5, 2, 2, 1))
+
+        metrics = self.metrics(self.today, self.today)
+        self.assertEqual(metrics['total_farms'], 4)
+        self.assertEqual(metrics['low_farms_rate'], 50.0)
+        self.assertEqual((metrics['total_files_uploaded'], metrics['total_users'], metrics['total_backups']), (1, 1, 1))
+        self.assertEqual(self.metrics(self.last_week, self.last_week)['total_farms'], 1)
+        self.assertTrue(Task.objects.filter(task_name='eudr_backend.tasks.update_dashboard_metrics').exists())
+
+    def test_refresh_is_scheduled_once_while_running(self):
+        """Test that dashboard requests made while the refresh runs do not start another repeating task."""
+        schedule_dashboard_metrics_refresh()
+        Task.objects.update(locked_by='1234', locked_at=timezone.now())
+        for _ in range(3):
+            schedule_dashboard_metrics_refresh()
+        self.assertEqual(Task.objects.filter(
+            task_name='eudr_backend.tasks.update_dashboard_metrics').count(), 1)
+
+    def test_refresh_picks_up_changes(self):
+        """Test that a refresh recounts the days of the rows written since the last one."""
+        refresh_dashboard_metrics()
+        index_s3_object('processed/dashboard_a.csv', 10)
+        index_s3_object('failed/dashboard_b.csv', 20)
+        self.add_farm('low', "New farmer")
+        # analysing an older farm moves the counts of the day it was created
+        old = EUDRFarmModel.objects.get(farmer_name="Old farmer")
+        old.analysis = {"eudr_risk_level": "low"}
+        old.save()
+
+        DashboardDailyMetricsModel.objects.update(
+            refreshed_at=timezone.now() - datetime.timedelta(hours=1))
+        refresh_dashboard_metrics()
+        today = DashboardDailyMetricsModel.objects.get(date=self.today)
+        self.assertEqual((today.farms, today.low_risk_farms, today.s3_objects), (5, 3, 2))
+        last_week = DashboardDailyMetricsModel.objects.get(date=self.last_week)
+        self.assertEqual((last_week.farms, last_week.low_risk_farms, last_week.high_risk_farms), (1, 1, 0))
+
+    def test_refresh_picks_up_deletes(self):
+        """Test that rows marked before their deletion have their day recounted by the next refresh."""
+        refresh_dashboard_metrics()
+        for rows in (EUDRFarmModel.objects.filter(farmer_name="Old farmer"), EUDRCollectionSiteModel.objects.all()):
+            with self.assertNumQueries(1):
+                mark_deleted_rows(rows)
+            rows.delete()
+        self.assertIsNone(DashboardDailyMetricsModel.objects.get(date=self.last_week).refreshed_at)
+
+        refresh_dashboard_metrics()
+        self.assertEqual(DashboardDailyMetricsModel.objects.get(date=self.last_week).farms, 0)
+        self.assertEqual(DashboardDailyMetricsModel.objects.get(date=self.today).backups, 0)
+        self.assertEqual(dashboard_totals(self.last_week, self.today)['farms'], 4)
+
+
+class FakeS3Client:
+    """
+    Stands in for an S3 bucket in memory, listing its keys in order in pages of
+    at most 1000 like list_objects_v2, and counting the pages listed.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.bodies = {}
+        self.pages_listed = 0
+
+    def put_object(self, Bucket, Key, Body=b'', LastModified=None):
+        self.objects[Key] = {'Key': Key, 'Size': len(Body),
+                             'LastModified': LastModified or timezone.now()}
+        self.bodies[Key] = Body
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.put_object(bucket, key, fileobj.read())
+
+    def download_fileobj(self, bucket, key, fileobj):
+        fileobj.write(self.bodies[key])
+
+    def delete_object(self, Bucket, Key):
+        del self.objects[Key], self.bodies[Key]
+
+    def get_paginator(self, operation):
+        assert operation == 'list_objects_v2'
+        return self
+
+    def paginate(self, Bucket, PaginationConfig=None):
+        page_size = min((PaginationConfig or {}).get('PageSize', 1000), 1000)
+        keys = sorted(self.objects)
+        for i in range(0, max(len(keys), 1), page_size):
+            self.pages_listed += 1
+            yield {'Contents': [self.objects[key] for key in keys[i:i + page_size]]}
+
+
+class S3ObjectIndexTest(TestCase):
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        for target in ('eudr_backend.s3_objects.s3_client', 'eudr_backend.utils.s3_client'):
+            patcher = patch(target, return_value=self.s3)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='uploader', password='password123')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.now = timezone.now().replace(microsecond=0)
+
+    def test_stored_files_are_indexed(self):
+        """Test that storing a file in S3 indexes it without listing the bucket."""
+        store_file_in_s3(io.BytesIO(b'a' * 2048), self.user, 'farms.csv')
+        store_file_in_s3(io.BytesIO(b'b' * 1024), self.user, 'broken.csv', is_failed=True)
+        self.assertEqual(self.s3.pages_listed, 0)
+
+        response = self.api.get(reverse('retrieve_all_files'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(file['file_name'], file['category'], file['uploaded_by'], file['size'])
+                          for file in response.json()],
+                         [('broken.csv', 'failed', 'uploader', 1.0), ('farms.csv', 'processed', 'uploader', 2.0)])
+        self.assertTrue(response.json()[1]['url'].endswith('processed/uploader_farms.csv'))
+        self.assertTrue(Task.objects.filter(task_name='eudr_backend.tasks.crawl_s3_index').exists())
+
+    def test_crawl_is_scheduled_once_while_running(self):
+        """Test that listings made while the crawl runs do not start another repeating crawler."""
+        schedule_s3_index_crawl()
+        Task.objects.update(locked_by='1234', locked_at=timezone.now())
+        for _ in range(3):
+            self.api.get(reverse('retrieve_all_files'))
+        self.assertEqual(Task.objects.filter(task_name='eudr_backend.tasks.crawl_s3_index').count(), 1)
+
+    def test_crawl_reconciles_index_with_bucket(self):
+        """Test that the crawler walks every page of the bucket and drops objects no longer in it."""
+        for i in range(2500):
+            self.s3.put_object('bucket', f'processed/uploader_{i:04}.csv', b'x' * i,
+                               LastModified=self.now - datetime.timedelta(days=i % 3))
+        self.s3.put_object('bucket', 'readme.txt', b'x')
+        index_s3_object('processed/uploader_gone.csv', 10)
+
+        self.assertEqual(crawl_s3_objects()[:2], (2501, 1))
+        self.assertEqual(self.s3.pages_listed, 3)
+        self.assertEqual(S3ObjectModel.objects.count(), 2501)
+        self.assertFalse(S3ObjectModel.objects.filter(key='processed/uploader_gone.csv').exists())
+        # keys without an uploader and a file name are indexed but not listed
+        readme = S3ObjectModel.objects.get(key='readme.txt')
+        self.assertIsNone(readme.file_name)
+
+        files = self.api.get(reverse('retrieve_all_files'))
+        self.assertEqual(len(files.json()), 2500)
+        self.assertEqual(self.s3.pages_listed, 3)
+
+    def test_files_are_filtered_by_date(self):
+        """Test that the date filters are answered from the index."""
+        for i, days in enumerate([0, 1, 5]):
+            self.s3.put_object('bucket', f'processed/uploader_{i}.csv', b'x',
+                               LastModified=self.now - datetime.timedelta(days=days))
+        crawl_s3_objects()
+
+        yesterday = (self.now - datetime.timedelta(days=1)).date()
+        response = self.api.get(reverse('total_files'), {
+            'startDate': yesterday.isoformat(), 'endDate': self.now.date().isoformat()})
+        self.assertEqual([file['file_name'] for file in response.json()], ['0.csv', '1.csv'])
+
+        count, files = get_filtered_files_uploaded(
+            (self.now - datetime.timedelta(days=6)).replace(tzinfo=None),
+            (self.now - datetime.timedelta(days=1)).replace(tzinfo=None))
+        self.assertEqual((count, [file['file_name'] for file in files]), (2, ['1.csv', '2.csv']))
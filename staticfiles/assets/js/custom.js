@@ -178,6 +178,20 @@ function uploadData() {
   }
 }
 
+// validation errors are {record, field, message} objects, other failures a single error.
+// GeoJSON records are the positions of the features in the collection
+function uploadErrorText(errorData, format) {
+  const error = errorData?.errors?.[0];
+  if (!error) {
+    return errorData?.error ?? "";
+  }
+  if (typeof error === "string") {
+    return error;
+  }
+  const label = format === "geojson" ? "Feature" : "Record";
+  return error.record ? `${label} ${error.record}: ${error.message}` : error.message;
+}
+
 function sendDataToAPI(data, file_name, format, file) {
   const csrftoken = getCookie("csrftoken");
   const progressContainer = document.querySelector(".progress");
@@ -255,7 +269,7 @@ function sendDataToAPI(data, file_name, format, file) {
 
           return response.json().then((errorData) => {
             document.querySelector("#headingOneErrorText").textContent =
-              errorData?.errors?.[0];
+              uploadErrorText(errorData, format);
             document
               .querySelector("#close-error-accordion")
               .addEventListener("click", (e) => {
@@ -2624,6 +2638,186 @@ if (queryParams.get("cs-id")) {
     });
 }
 
+// Farm map: the map built by map_view runs in an iframe and hands its Leaflet
+// map to addFarmTileLayer, which draws the farm tiles of the viewport and
+// loads the details of a plot when it is clicked
+const farmRiskColors = {
+  high: "#F64468",
+  low: "#3AD190",
+  more_info_needed: "#ACDCE8",
+};
+const FARM_TILES_MAX_ZOOM = 22;
+
+function escapeHtml(value) {
+  return String(value).replace(
+    /[&<>"']/g,
+    (character) =>
+      ({
+        "&": "&amp;",
+        "<": "&lt;",
+        ">": "&gt;",
+        '"': "&quot;",
+        "'": "&#39;",
+      }[character])
+  );
+}
+
+function titleCase(value) {
+  return value.toLowerCase().replace(/\b\w/g, (letter) => letter.toUpperCase());
+}
+
+function farmPopupHtml(farm) {
+  const row = (label, value) =>
+    `<div class='d-flex justify-content-between mb-2'><b>${label}:</b> <span class='align-self-end'>${value}</span></div>`;
+  const info = [
+    ["GeoID", farm.geoid],
+    ["Farmer Name", farm.farmer_name],
+    ["Farm Size", farm.farm_size],
+    ["Collection Site", farm.collection_site],
+    ["Agent Name", farm.agent_name],
+    ["Farm Village", farm.farm_village],
+    ["District", farm.farm_district],
+  ]
+    .map(([label, value]) => row(label, escapeHtml(value ?? "-")))
+    .join("");
+  const analysis = Object.entries(farm.analysis || {})
+    .map(([key, value]) => {
+      const label = key.replaceAll("_", " ");
+      if (key === "eudr_risk_level" && value) {
+        const level = String(value).toLowerCase();
+        const badge =
+          level === "low" ? "bg-success" : level === "high" ? "bg-danger" : "bg-info";
+        return row(
+          label.charAt(0).toUpperCase() + label.slice(1),
+          `<span class="rounded px-2 py-1 text-white ${badge}">${escapeHtml(
+            titleCase(String(value).replaceAll("_", " "))
+          )}</span>`
+        );
+      }
+      return row(
+        label.charAt(0).toUpperCase() + label.slice(1),
+        value ? escapeHtml(titleCase(String(value).replaceAll("_", " "))) : "-"
+      );
+    })
+    .join("");
+
+  return `
+    <div class='bg-dark rounded p-2 text-white fs-4 mb-2'>Plot Info</div>
+    ${info}
+    ${farm.polygon_type === "MultiPolygon" ? "<b>N.B:</b> <i>This is a Multi Polygon Type Plot</i><br><br>" : ""}
+    <div class='bg-dark rounded p-2 text-white fs-4 mb-2'>Farm Analysis</div>
+    ${analysis}
+  `;
+}
+
+function openFarmPopup(L, map, farmId, latlng) {
+  fetch(`/api/farm/list/${farmId}/`, {
+    headers: {
+      Authorization: `Token ${localStorage.getItem("terratracAuthToken")}`,
+    },
+  })
+    .then((response) => {
+      if (!response.ok) {
+        throw new Error("Network response was not ok " + response.statusText);
+      }
+      return response.json();
+    })
+    .then((farm) => {
+      L.popup({ minWidth: 300, maxWidth: 500 })
+        .setLatLng(latlng)
+        .setContent(farmPopupHtml(farm))
+        .openOn(map);
+    })
+    .catch((error) => {
+      console.error("There was a problem loading the farm details:", error);
+    });
+}
+
+function addFarmTileLayer(L, map, options) {
+  const query = new URLSearchParams({ v: options.version });
+  if (options.fileId) query.set("file-id", options.fileId);
+  if (options.farmId) query.set("farm-id", options.farmId);
+  if (options.overlaps) query.set("overlaps", "true");
+
+  const layer = L.geoJSON(null, {
+    style: (feature) => ({
+      color: farmRiskColors[feature.properties.eudr_risk_level] || "#777",
+      weight: 2,
+      fillColor: feature.properties.overlapping ? "#800080" : "#777",
+      fillOpacity: 0.2,
+    }),
+    pointToLayer: (feature, latlng) => L.circleMarker(latlng, { radius: 6 }),
+    onEachFeature: (feature, featureLayer) => {
+      featureLayer.on("click", (event) =>
+        openFarmPopup(L, map, feature.properties.id, event.latlng)
+      );
+    },
+  }).addTo(map);
+
+  let tilesZoom = null;
+  let loadedTiles = new Set();
+  let drawnFarms = new Set();
+
+  function loadTiles() {
+    const z = Math.min(Math.max(Math.round(map.getZoom()), 0), FARM_TILES_MAX_ZOOM);
+    if (z !== tilesZoom) {
+      // plots are simplified for each zoom level, draw them again from its tiles
+      tilesZoom = z;
+      loadedTiles = new Set();
+      drawnFarms = new Set();
+      layer.clearLayers();
+    }
+
+    const n = 2 ** z;
+    const clamp = (tile) => Math.min(n - 1, Math.max(0, tile));
+    const tileX = (lon) => clamp(Math.floor(((lon + 180) / 360) * n));
+    const tileY = (lat) => {
+      const radians = (Math.max(-85.0511, Math.min(85.0511, lat)) * Math.PI) / 180;
+      return clamp(Math.floor(((1 - Math.asinh(Math.tan(radians)) / Math.PI) / 2) * n));
+    };
+    const bounds = map.getBounds();
+    for (let x = tileX(bounds.getWest()); x <= tileX(bounds.getEast()); x++) {
+      for (let y = tileY(bounds.getNorth()); y <= tileY(bounds.getSouth()); y++) {
+        const tile = `${z}/${x}/${y}`;
+        if (loadedTiles.has(tile)) continue;
+        loadedTiles.add(tile);
+
+        fetch(`/api/farm/tiles/${tile}/?${query}`, {
+          headers: {
+            Authorization: `Token ${localStorage.getItem("terratracAuthToken")}`,
+          },
+        })
+          .then((response) => {
+            if (!response.ok) {
+              throw new Error("Network response was not ok " + response.statusText);
+            }
+            return response.json();
+          })
+          .then((data) => {
+            if (z !== tilesZoom) return;
+            // plots crossing tile edges come with every tile they touch
+            const features = data.features.filter((feature) => {
+              if (drawnFarms.has(feature.id)) return false;
+              drawnFarms.add(feature.id);
+              return true;
+            });
+            layer.addData(features);
+          })
+          .catch((error) => {
+            loadedTiles.delete(tile);
+            console.error("There was a problem loading the farm tiles:", error);
+          });
+      }
+    }
+  }
+
+  map.on("moveend", loadTiles);
+  loadTiles();
+  if (options.farmId) {
+    openFarmPopup(L, map, options.farmId, map.getCenter());
+  }
+}
+
 if (window.location.pathname === "/map/") {
   $("#loader-container").show();
 